@@ -0,0 +1,38 @@
+"""Compares per-task crawler creation with pooled crawlers using `runner_replay.py`.
+
+    python benchmarks/crawler_pool.py --tasks 300
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+from os import path
+
+REPLAY = path.join(path.dirname(path.realpath(__file__)), 'runner_replay.py')
+
+
+def replay(tasks, pooled):
+    output = subprocess.check_output([
+        sys.executable, REPLAY,
+        '--tasks', str(tasks),
+        '--set', 'RUNNER_CRAWLER_POOL_ENABLED={}'.format(json.dumps(pooled)),
+    ])
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tasks', type=int, default=300)
+    options = parser.parse_args()
+
+    for pooled in (False, True):
+        result = replay(options.tasks, pooled)
+        print('{:<8} tasks/s {:>8.1f}  cpu/task {:>7.2f} ms  results {}/{}  crawlers created {}'.format(
+            'pooled' if pooled else 'cold',
+            result['tasks_per_second'],
+            result['cpu_ms_per_task'],
+            result['results'],
+            result['tasks'],
+            result['runner_stats'].get('crawler_pool/created', result['tasks'])
+        ))
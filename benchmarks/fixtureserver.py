@@ -0,0 +1,83 @@
+"""Local HTTP server with product pages for runner benchmarks.
+
+Serves `/product/<number>` pages of `benchmarks.spiders`, optionally after a delay which emulates
+the response time of a site. Prints its port once it listens:
+
+    python benchmarks/fixtureserver.py --port 8000 --delay 0.2
+"""
+import sys
+import argparse
+import subprocess
+
+from os import path
+
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..'))
+
+from twisted.internet import reactor  # noqa: E402
+from twisted.web import resource, server  # noqa: E402
+
+from benchmarks.spiders import PRODUCT_PAGE  # noqa: E402
+
+
+class ProductPage(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, delay=0.0):
+        resource.Resource.__init__(self)
+        self.delay = delay
+
+    def render_GET(self, request):
+        parts = request.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'product':
+            request.setResponseCode(404)
+            return b''
+        page = PRODUCT_PAGE.format(parts[1])
+        if not self.delay:
+            return page
+
+        def respond():
+            if not request.finished and not request._disconnected:  # pylint: disable=protected-access
+                request.write(page)
+                request.finish()
+
+        reactor.callLater(self.delay, respond)
+        return server.NOT_DONE_YET
+
+
+class FixtureServer(object):
+    """Runs the server in a child process, so it does not share the reactor with the runner."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.process = None
+        self.port = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, path.realpath(__file__), '--port', '0', '--delay', str(self.delay)],
+            stdout=subprocess.PIPE
+        )
+        self.port = int(self.process.stdout.readline())
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+
+def main(options):
+    site = server.Site(ProductPage(options.delay))
+    site.noisy = False
+    port = reactor.listenTCP(options.port, site, interface='127.0.0.1')
+    print(port.getHost().port)
+    sys.stdout.flush()
+    reactor.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=0, help='port to listen, any free one by default')
+    parser.add_argument('--delay', type=float, default=0.0, help='response time, seconds')
+    main(parser.parse_args())
@@ -0,0 +1,235 @@
+"""Replays product tasks through a real `Runner` against local queue and blob backends.
+
+Runs a single runner in this process, or a supervisor with runner workers, against a local HTTP
+fixture server and prints a JSON line with throughput, task latency and CPU usage:
+
+    python benchmarks/runner_replay.py --tasks 500 --set RUNNER_CRAWLER_POOL_ENABLED=true
+    python benchmarks/runner_replay.py --tasks 500 --supervisor --set RUNNER_WORKERS=4
+    python benchmarks/runner_replay.py --tasks 300 --rate 20 --page-delay 0.2
+
+Task latency is the time from putting a task to the input queue to its output message, so with
+all tasks put at once (default) it includes the time spent in the queue. Supervisor workers are
+separate processes, so they share queues through the disk backend.
+"""
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+
+from os import path
+
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..'))
+
+from scrapy.settings import Settings  # noqa: E402
+
+from benchmarks.fixtureserver import FixtureServer  # noqa: E402
+from benchmarks.spiders import product_url  # noqa: E402
+from content_analytics.backends import QUEUE, BLOB, create_resource  # noqa: E402
+
+INPUT_QUEUE_NAME = 'scraper_benchmark_in'
+URGENT_QUEUE_NAME = 'scraper_benchmark_in_urgent'
+OUTPUT_QUEUE_NAME = 'scraper_benchmark_out'
+
+BACKENDS = {
+    'memory': 'content_analytics.backends.memory.MemoryBackend',
+    'disk': 'content_analytics.backends.disk.DiskBackend',
+}
+
+
+def get_settings(overrides, filebeat_path, backend='memory', backend_path=None):
+    from content_analytics.settings import production
+
+    settings = Settings()
+    settings.setmodule(production)
+    settings.setdict({
+        'SPIDER_MODULES': ['benchmarks.spiders'],
+        'LOG_LEVEL': 'WARNING',
+        'FILEBEAT_PATH': filebeat_path,
+        'SENTRY_ENABLED': False,
+        'RUNNER_SETTINGS_BUCKET_ENABLED': False,
+        'RUNNER_CACHE_SETTINGS_BUCKET_ENABLED': False,
+        'RUNNER_GRACE_PERIOD_ENABLED': False,
+        'INPUT_QUEUE_WAIT_TIME': 1,
+        'RUNNER_STATS_INTERVAL': 0,
+        'INPUT_QUEUE_NAME': INPUT_QUEUE_NAME,
+        'INPUT_QUEUE_AWS_ACCESS_KEY_ID': 'local',
+        'INPUT_QUEUE_AWS_SECRET_ACCESS_KEY': 'local',
+        'QUEUE_BACKEND': BACKENDS[backend],
+        'BLOB_BACKEND': BACKENDS[backend],
+        'LOCAL_BACKEND_PATH': backend_path,
+    })
+    for key, value in overrides:
+        settings.set(key, value)
+    return settings
+
+
+def fill_input_queue(queue, tasks, first=0, distinct=0, batch=1, server_url=None, rate=0, sent=None):
+    for number in range(first, first + tasks):
+        urls = [
+            product_url(product % distinct if distinct else product, server_url)
+            for product in range(number * batch, (number + 1) * batch)
+        ]
+        message = {
+            'site': 'benchmark',
+            'task_id': number,
+            'result_queue': OUTPUT_QUEUE_NAME,
+            'response_format': 'sc',
+        }
+        if batch > 1:
+            message['urls'] = urls
+        else:
+            message['url'] = urls[0]
+        queue.put(message)
+        if sent is not None:
+            sent[number] = time.time()
+        if rate:
+            time.sleep(1.0 / rate)
+
+
+def read_messages(queue):
+    messages = []
+    while True:
+        received = queue.receive_messages(MaxNumberOfMessages=10, VisibilityTimeout=3600)
+        if not received:
+            return messages
+        messages.extend(received)
+
+
+def get_latencies(sent, output_messages):
+    latencies = []
+    for message in output_messages:
+        task_id = json.loads(message.body).get('msg_id')
+        if task_id in sent:
+            latencies.append(int(message.attributes['SentTimestamp']) / 1000.0 - sent[task_id])
+    return sorted(latencies)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(int(len(values) * fraction), len(values) - 1)], 3)
+
+
+def main(options):
+    backend = 'disk' if options.supervisor else options.backend
+    backend_path = tempfile.mkdtemp(prefix='benchmark_backend_')
+    filebeat_path = tempfile.mkdtemp(prefix='benchmark_filebeat_')
+    if options.urgent:
+        options.set.append(('INPUT_QUEUE_URGENT_NAME', URGENT_QUEUE_NAME))
+    if options.rate:
+        # Runner waits for the tasks which are still to come instead of shutting down on empty queue
+        options.set.extend([('RUNNER_GRACE_PERIOD_ENABLED', True), ('RUNNER_GRACE_PERIOD', 5)])
+    settings = get_settings(options.set, filebeat_path, backend, backend_path)
+    settings.set('LOCAL_BACKEND_QUEUE_LATENCY', options.sqs_latency)
+    settings.set('LOCAL_BACKEND_BLOB_LATENCY', options.s3_latency)
+    logging.basicConfig(level=settings.get('LOG_LEVEL'))
+
+    server = None
+    server_url = None
+    if not options.data_uri:
+        server = FixtureServer(delay=options.page_delay)
+        server_url = server.start()
+
+    sqs = create_resource(settings, QUEUE)
+    input_queue = sqs.create_queue(QueueName=INPUT_QUEUE_NAME)
+    output_queue = sqs.create_queue(QueueName=OUTPUT_QUEUE_NAME)
+    sent = {}
+    fill_kwargs = {'distinct': options.distinct, 'batch': options.batch, 'server_url': server_url, 'sent': sent}
+    feeder = None
+    if options.rate:
+        feeder = threading.Thread(target=fill_input_queue, args=(input_queue, options.tasks),
+                                  kwargs=dict(fill_kwargs, rate=options.rate))
+        feeder.daemon = True
+    else:
+        fill_input_queue(input_queue, options.tasks, **fill_kwargs)
+    if options.urgent:
+        fill_input_queue(sqs.create_queue(QueueName=URGENT_QUEUE_NAME), options.urgent, first=options.tasks,
+                         server_url=server_url, sent=sent)
+
+    started = time.time()
+    usage = get_cpu_usage()
+    if feeder is not None:
+        feeder.start()
+    if options.supervisor:
+        from content_analytics.supervisor import Supervisor
+        runner = Supervisor(settings)
+        runner.start()
+        stats = runner.get_stats()
+    else:
+        from content_analytics.runner import Runner
+        runner = Runner(settings)
+        stats = runner.stats.get_stats()
+    elapsed = time.time() - started
+    cpu = get_cpu_usage() - usage
+    if server is not None:
+        server.stop()
+
+    tasks = options.tasks + options.urgent
+    products = options.tasks * options.batch + options.urgent
+    output_messages = read_messages(output_queue)
+    latencies = get_latencies(sent, output_messages)
+    blob_store = create_resource(settings, BLOB).meta.client.store
+    uploads = len(blob_store.keys(settings.get('OUTPUT_BUCKET_NAME')))
+    shutil.rmtree(filebeat_path, ignore_errors=True)
+    shutil.rmtree(backend_path, ignore_errors=True)
+
+    print(json.dumps({
+        'settings': dict(options.set),
+        'backend': backend,
+        'tasks': tasks,
+        'results': len(output_messages),
+        'uploads': uploads,
+        'elapsed': round(elapsed, 3),
+        'tasks_per_second': round(tasks / elapsed, 2),
+        'products_per_second': round(products / elapsed, 2),
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'cpu_ms_per_task': round(cpu * 1000 / tasks, 3),
+        'runner_stats': stats,
+    }, sort_keys=True, default=str))
+
+
+def get_cpu_usage():
+    usage = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        rusage = resource.getrusage(who)
+        usage += rusage.ru_utime + rusage.ru_stime
+    return usage
+
+
+def parse_setting(value):
+    key, _, raw = value.partition('=')
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--distinct', type=int, default=0,
+                        help='number of distinct product urls, tasks repeat them (all distinct by default)')
+    parser.add_argument('--batch', type=int, default=1, help='number of product urls per task')
+    parser.add_argument('--urgent', type=int, default=0, help='number of additional tasks in the urgent queue')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='tasks put to the input queue per second while running (all at once by default)')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='memory',
+                        help='queue and blob backend, supervisor mode always uses disk')
+    parser.add_argument('--page-delay', type=float, default=0.0, help='response time of product pages, seconds')
+    parser.add_argument('--data-uri', action='store_true', help='inline product pages instead of fixture server')
+    parser.add_argument('--sqs-latency', type=float, default=0.0, help='emulated SQS round trip, seconds')
+    parser.add_argument('--s3-latency', type=float, default=0.0, help='emulated S3 upload time, seconds')
+    parser.add_argument('--supervisor', action='store_true', help='run supervisor with runner workers')
+    parser.add_argument('--set', type=parse_setting, action='append', default=[], metavar='NAME=VALUE',
+                        help='override runner setting, value is parsed as JSON when possible')
+    return parser
+
+
+if __name__ == '__main__':
+    main(get_parser().parse_args())
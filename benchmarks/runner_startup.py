@@ -0,0 +1,95 @@
+"""Measures runner startup: time from a fresh interpreter to the first receive from the input queue.
+
+Every sample starts a new Python process which imports and starts a real `Runner` against local SQS
+and S3 stand-ins, with production spiders. Prints a JSON line with the median and all samples for each
+spider loader:
+
+    python benchmarks/runner_startup.py --samples 5
+    python benchmarks/runner_startup.py --loader scrapy.spiderloader.SpiderLoader
+"""
+import time
+
+STARTED = time.time()
+
+import sys  # noqa: E402
+import json  # noqa: E402
+import argparse  # noqa: E402
+import tempfile  # noqa: E402
+import subprocess  # noqa: E402
+
+from os import path  # noqa: E402
+
+ROOT = path.join(path.dirname(path.realpath(__file__)), '..')
+DEFAULT_LOADERS = ['scrapy.spiderloader.SpiderLoader', 'content_analytics.spiderloader.ManifestSpiderLoader']
+HEAVY_MODULES = ['PIL.Image', 'fuzzywuzzy.fuzz', 'content_analytics.spiders.walmart']
+
+
+def run_sample(loader):
+    """Starts the runner in this process and returns timings once it receives from the input queue."""
+    sys.path.append(ROOT)
+
+    from twisted.internet import reactor
+
+    from benchmarks.runner_replay import INPUT_QUEUE_NAME, OUTPUT_QUEUE_NAME, get_settings
+    from content_analytics.backends import QUEUE, create_resource
+    from content_analytics.backends.local import LocalQueue
+    from content_analytics.settings import production
+
+    timings = {}
+
+    def receive_messages(queue, **kwargs):
+        if 'first_receive' not in timings:
+            timings['first_receive'] = time.time() - STARTED
+            reactor.callFromThread(reactor.stop)
+        return []
+
+    LocalQueue.receive_messages = receive_messages
+
+    # Production spiders, the replay benchmark swaps them for the benchmark one
+    settings = get_settings([('SPIDER_LOADER_CLASS', loader)], filebeat_path=tempfile.gettempdir())
+    settings.set('SPIDER_MODULES', production.SPIDER_MODULES)
+    sqs = create_resource(settings, QUEUE)
+    for queue_name in (INPUT_QUEUE_NAME, OUTPUT_QUEUE_NAME):
+        sqs.create_queue(QueueName=queue_name)
+
+    from content_analytics.runner import Runner
+    timings['runner_import'] = time.time() - STARTED
+    Runner(settings)
+    timings['heavy_modules'] = sorted(name for name in HEAVY_MODULES if name in sys.modules)
+    timings['modules'] = len(sys.modules)
+    return timings
+
+
+def main(options):
+    results = {}
+    for loader in options.loader or DEFAULT_LOADERS:
+        samples = []
+        for _ in range(options.samples):
+            output = subprocess.check_output([sys.executable, path.realpath(__file__), '--sample', loader])
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        first_receive = sorted(sample['first_receive'] for sample in samples)
+        results[loader] = {
+            'first_receive_median': round(first_receive[len(first_receive) // 2], 3),
+            'first_receive': [round(value, 3) for value in first_receive],
+            'runner_import_median': round(sorted(sample['runner_import'] for sample in samples)[len(samples) // 2], 3),
+            'modules': samples[-1]['modules'],
+            'heavy_modules': samples[-1]['heavy_modules'],
+        }
+    print(json.dumps({'samples': options.samples, 'loaders': results}, sort_keys=True))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--samples', type=int, default=5, help='number of runner processes per loader')
+    parser.add_argument('--loader', action='append', default=[], metavar='CLASS',
+                        help='spider loader class, both Scrapy and manifest loaders by default')
+    parser.add_argument('--sample', default=None, metavar='CLASS', help=argparse.SUPPRESS)
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = get_parser().parse_args()
+    if arguments.sample:
+        print(json.dumps(run_sample(arguments.sample)))
+    else:
+        main(arguments)
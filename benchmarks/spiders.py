@@ -0,0 +1,55 @@
+"""Spider used by runner benchmarks.
+
+Product pages are served by `benchmarks.fixtureserver`, or inlined as `data:` URIs if no server
+is given, so no network is needed.
+"""
+from urllib import quote
+
+from content_analytics.spiders import BaseProductsSpider
+from content_analytics.items import SiteProductItem
+
+PRODUCT_PAGE = '<html><head><title>Product {}</title></head><body><img src="/image.png"/></body></html>'
+
+
+def product_url(number, server_url=None):
+    if server_url:
+        return '{}/product/{}'.format(server_url, number)
+    return 'data:text/html,{}'.format(quote(PRODUCT_PAGE.format(number)))
+
+
+class BenchmarkProductsSpider(BaseProductsSpider):
+    name = 'benchmark_products'
+    allowed_domains = []
+
+    def parse_product(self, response):
+        item = response.meta.get('item') or SiteProductItem()
+        item['title'] = response.xpath('//title/text()').extract_first()
+        item['image_url'] = response.xpath('//img/@src').extract_first()
+        yield item
+
+    def get_search_term_url(self, search_term):
+        pass
+
+    def get_search_term_next_page(self, response):
+        pass
+
+    def parse_search_term_items(self, response):
+        return []
+
+    def parse_search_term_total_matches(self, response):
+        pass
+
+    def parse_search_term_results_per_page(self, response):
+        pass
+
+    def get_shelf_page_next_page(self, response):
+        pass
+
+    def parse_shelf_page_items(self, response):
+        return []
+
+    def parse_shelf_page_total_matches(self, response):
+        pass
+
+    def parse_shelf_page_results_per_page(self, response):
+        pass
@@ -0,0 +1,123 @@
+"""Measures reactor lag caused by SQS calls made by the runner.
+
+Compares blocking boto3-style calls made on the reactor thread with calls dispatched through
+`content_analytics.sqs.SQSExecutor`. SQS is emulated by `content_analytics.backends.memory` with a fixed
+per-call latency, so no AWS access is required.
+
+    python benchmarks/sqs_reactor_lag.py --tasks 200 --concurrency 20 --latency 0.05
+"""
+import sys
+import time
+import argparse
+
+from os import path
+
+sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..'))
+
+from twisted.internet import defer, task, reactor  # noqa: E402
+
+from content_analytics.backends import QUEUE  # noqa: E402
+from content_analytics.backends.memory import MemoryBackend  # noqa: E402
+from content_analytics.sqs import SQSExecutor  # noqa: E402
+
+
+class LagProbe(object):
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self.last = None
+        self.looping_call = task.LoopingCall(self.tick)
+
+    def start(self):
+        self.last = time.time()
+        self.looping_call.start(self.interval, now=False)
+
+    def stop(self):
+        self.looping_call.stop()
+
+    def tick(self):
+        now = time.time()
+        self.samples.append(max(0.0, now - self.last - self.interval))
+        self.last = now
+
+    def percentile(self, value):
+        samples = sorted(self.samples) or [0.0]
+        return samples[min(len(samples) - 1, int(len(samples) * value))]
+
+
+def blocking_call(func, *args, **kwargs):
+    return defer.maybeDeferred(func, *args, **kwargs)
+
+
+@defer.inlineCallbacks
+def run_task(call, queue, output_queue, crawl_time):
+    messages = yield call(queue.receive_messages, MaxNumberOfMessages=1)
+    for message in messages:
+        yield call(queue.change_message_visibility_batch, Entries=[{
+            'Id': '0', 'ReceiptHandle': message.receipt_handle, 'VisibilityTimeout': 300
+        }])
+        yield task.deferLater(reactor, crawl_time, lambda: None)
+        yield call(output_queue.send_message, MessageBody=message.body)
+        yield call(message.delete)
+
+
+@defer.inlineCallbacks
+def run_mode(mode, options):
+    MemoryBackend.reset()
+    sqs = MemoryBackend(queue_latency=options.latency).resource(QUEUE)
+    queue = sqs.create_queue(QueueName='bench_in')
+    output_queue = sqs.create_queue(QueueName='bench_out')
+    for i in range(options.tasks):
+        queue.put({'url': 'http://localhost/{}'.format(i)})
+
+    if mode == 'executor':
+        executor = SQSExecutor(reactor, max_threads=options.threads)
+        executor.start()
+        call = executor.call
+    else:
+        executor = None
+        call = blocking_call
+
+    probe = LagProbe()
+    probe.start()
+    started = time.time()
+
+    semaphore = defer.DeferredSemaphore(options.concurrency)
+    yield defer.gatherResults([
+        semaphore.run(run_task, call, queue, output_queue, options.crawl_time)
+        for _ in range(options.tasks)
+    ])
+
+    elapsed = time.time() - started
+    probe.stop()
+    if executor:
+        executor.stop()
+
+    print('{:<10} tasks/s {:>8.1f}  lag p50 {:>7.1f} ms  p95 {:>7.1f} ms  max {:>7.1f} ms  sent {}'.format(
+        mode,
+        options.tasks / elapsed,
+        probe.percentile(0.5) * 1000,
+        probe.percentile(0.95) * 1000,
+        max(probe.samples or [0.0]) * 1000,
+        len(output_queue.store)
+    ))
+
+
+@defer.inlineCallbacks
+def main(options):
+    try:
+        for mode in ('blocking', 'executor'):
+            yield run_mode(mode, options)
+    finally:
+        reactor.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=SQSExecutor.DEFAULT_MAX_THREADS)
+    parser.add_argument('--latency', type=float, default=0.05, help='emulated SQS round trip, seconds')
+    parser.add_argument('--crawl-time', type=float, default=0.2, help='emulated crawl duration, seconds')
+    reactor.callWhenRunning(main, parser.parse_args())
+    reactor.run()
@@ -0,0 +1,35 @@
+"""Queue and blob storage backends of the runner.
+
+`QUEUE_BACKEND` and `BLOB_BACKEND` settings name the backend classes which create SQS and S3
+resources for the runner, the supervisor and `S3ExportPipeline`. `BotoBackend` talks to AWS,
+`memory.MemoryBackend` and `disk.DiskBackend` provide boto3-compatible stand-ins, so the runner
+can be run and benchmarked without AWS.
+"""
+import boto3
+
+from scrapy.utils.misc import load_object
+
+QUEUE = 'sqs'
+BLOB = 's3'
+
+DEFAULT_BACKEND = 'content_analytics.backends.BotoBackend'
+BACKEND_SETTINGS = {
+    QUEUE: 'QUEUE_BACKEND',
+    BLOB: 'BLOB_BACKEND'
+}
+
+
+def create_resource(settings, service, aws_settings=None):
+    """Returns boto3-compatible resource of `service` ('sqs' or 's3') from the configured backend."""
+    backend_class = load_object(settings.get(BACKEND_SETTINGS[service]) or DEFAULT_BACKEND)
+    return backend_class.from_settings(settings).resource(service, **(aws_settings or {}))
+
+
+class BotoBackend(object):
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls()
+
+    def resource(self, service, **aws_settings):
+        return boto3.resource(service, **aws_settings)
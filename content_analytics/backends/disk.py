@@ -0,0 +1,174 @@
+"""On-disk queue and blob stores, which can be shared by several processes (e.g. supervisor workers).
+
+A queue is a directory with `visible` and `inflight` subdirectories and a file per message. Messages
+are received by renaming them to `inflight`, rename is atomic, so every message goes to a single
+receiver. The receipt handle is the name of the in-flight file and its modification time is the end
+of the visibility timeout. Blobs are files under `<path>/<bucket>/<key>`.
+"""
+import os
+import json
+import time
+import errno
+
+from uuid import uuid4
+from datetime import datetime
+
+from content_analytics.backends.local import LocalBackend
+
+VISIBLE = 'visible'
+INFLIGHT = 'inflight'
+TEMP = 'tmp'
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def write_atomically(path, data, temp_dir):
+    temp_path = os.path.join(temp_dir, uuid4().hex)
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.rename(temp_path, path)
+
+
+class DiskQueueStore(object):
+    def __init__(self, path, visibility_timeout):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.visible_path = os.path.join(path, VISIBLE)
+        self.inflight_path = os.path.join(path, INFLIGHT)
+        self.temp_path = os.path.join(path, TEMP)
+
+    def create(self):
+        for path in (self.visible_path, self.inflight_path, self.temp_path):
+            makedirs(path)
+
+    def exists(self):
+        return os.path.isdir(self.visible_path)
+
+    def __len__(self):
+        return len(os.listdir(self.visible_path)) + len(os.listdir(self.inflight_path))
+
+    def put(self, message):
+        # Names start with the time in microseconds, so messages are received roughly in the order they were sent
+        name = '{:016d}-{}'.format(int(time.time() * 1000000), message['MessageId'])
+        write_atomically(os.path.join(self.visible_path, name), json.dumps(message), self.temp_path)
+
+    def receive(self, max_number, visibility_timeout):
+        self._release_expired()
+        received = []
+        for name in sorted(os.listdir(self.visible_path)):
+            if len(received) >= max_number:
+                break
+            receipt_handle = '{}.{}'.format(name, uuid4().hex)
+            # Claimed in the temp directory, it appears in flight only with its visibility deadline set
+            claimed_path = os.path.join(self.temp_path, receipt_handle)
+            try:
+                os.rename(os.path.join(self.visible_path, name), claimed_path)
+            except OSError:
+                # Received by another process
+                continue
+            with open(claimed_path) as f:
+                message = json.load(f)
+            attributes = message['Attributes']
+            attributes['ApproximateReceiveCount'] = str(int(attributes['ApproximateReceiveCount']) + 1)
+            with open(claimed_path, 'wb') as f:
+                f.write(json.dumps(message))
+            self._set_deadline(claimed_path, visibility_timeout)
+            os.rename(claimed_path, os.path.join(self.inflight_path, receipt_handle))
+            received.append((message, receipt_handle))
+        return received
+
+    def change_visibility(self, receipt_handle, timeout):
+        inflight_path = os.path.join(self.inflight_path, receipt_handle)
+        try:
+            if timeout == 0:
+                os.rename(inflight_path, os.path.join(self.visible_path, receipt_handle.rsplit('.', 1)[0]))
+            else:
+                self._set_deadline(inflight_path, timeout)
+        except OSError:
+            return False
+        return True
+
+    def delete(self, receipt_handle):
+        try:
+            os.unlink(os.path.join(self.inflight_path, receipt_handle))
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _set_deadline(path, timeout):
+        deadline = time.time() + timeout
+        os.utime(path, (deadline, deadline))
+
+    def _release_expired(self):
+        now = time.time()
+        for receipt_handle in os.listdir(self.inflight_path):
+            inflight_path = os.path.join(self.inflight_path, receipt_handle)
+            try:
+                if os.path.getmtime(inflight_path) <= now:
+                    os.rename(inflight_path, os.path.join(self.visible_path, receipt_handle.rsplit('.', 1)[0]))
+            except OSError:
+                # Deleted or released by another process
+                continue
+
+
+class DiskBlobStore(object):
+    def __init__(self, path):
+        self.path = path
+        # Not a valid bucket name, so it never clashes with buckets
+        self.temp_path = os.path.join(path, '.{}'.format(TEMP))
+
+    def get_path(self, bucket, key):
+        return os.path.join(self.path, bucket, *key.split('/'))
+
+    def put(self, bucket, key, data):
+        path = self.get_path(bucket, key)
+        makedirs(os.path.dirname(path))
+        makedirs(self.temp_path)
+        write_atomically(path, data, self.temp_path)
+
+    def get(self, bucket, key):
+        path = self.get_path(bucket, key)
+        try:
+            with open(path, 'rb') as f:
+                return f.read(), datetime.utcfromtimestamp(os.path.getmtime(path))
+        except (IOError, OSError):
+            return None
+
+    def keys(self, bucket):
+        bucket_path = os.path.join(self.path, bucket)
+        keys = []
+        for directory, _, names in os.walk(bucket_path):
+            prefix = os.path.relpath(directory, bucket_path).replace(os.sep, '/')
+            keys.extend(name if prefix == '.' else '{}/{}'.format(prefix, name) for name in names)
+        return sorted(keys)
+
+
+class DiskBackend(LocalBackend):
+    """Queues and blobs are kept under `LOCAL_BACKEND_PATH`, `sqs` and `s3` directories respectively."""
+    DEFAULT_PATH = '/tmp/local_backend'
+
+    def __init__(self, path=DEFAULT_PATH, **kwargs):
+        super(DiskBackend, self).__init__(**kwargs)
+        self.path = path
+        self.blob_store = DiskBlobStore(os.path.join(path, 's3'))
+
+    @classmethod
+    def get_options(cls, settings):
+        options = super(DiskBackend, cls).get_options(settings)
+        options['path'] = settings.get('LOCAL_BACKEND_PATH') or cls.DEFAULT_PATH
+        return options
+
+    def get_queue_store(self, name, create=False):
+        store = DiskQueueStore(os.path.join(self.path, 'sqs', name), self.visibility_timeout)
+        if create:
+            store.create()
+        elif not store.exists():
+            return None
+        return store
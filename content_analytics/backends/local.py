@@ -0,0 +1,293 @@
+"""boto3-compatible SQS and S3 resources on top of local queue and blob stores.
+
+Only the calls made by the runner, the supervisor and the pipelines are implemented. Stores are
+provided by `LocalBackend` subclasses (see `memory` and `disk` modules), every call to a resource
+sleeps for the configured latency to emulate an AWS round trip.
+"""
+import json
+import time
+import hashlib
+import threading
+
+from uuid import uuid4
+from cStringIO import StringIO
+
+from botocore.exceptions import ClientError
+
+from content_analytics.backends import QUEUE, BLOB
+
+
+def new_message(body):
+    return {
+        'MessageId': str(uuid4()),
+        'Body': body,
+        'Attributes': {
+            'SentTimestamp': str(int(time.time() * 1000)),
+            'ApproximateReceiveCount': '0'
+        }
+    }
+
+
+def get_etag(data):
+    return '"{}"'.format(hashlib.md5(data).hexdigest())
+
+
+def client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class LocalMessage(object):
+    def __init__(self, queue, message, receipt_handle):
+        self.queue = queue
+        self.message_id = message['MessageId']
+        self.body = message['Body']
+        self.attributes = message['Attributes']
+        self.message_attributes = None
+        self.receipt_handle = receipt_handle
+
+    def delete(self):
+        return self.queue.delete_messages(Entries=[{'Id': '0', 'ReceiptHandle': self.receipt_handle}])
+
+    def change_visibility(self, VisibilityTimeout):
+        return self.queue.change_message_visibility_batch(Entries=[{
+            'Id': '0',
+            'ReceiptHandle': self.receipt_handle,
+            'VisibilityTimeout': VisibilityTimeout
+        }])
+
+
+class LocalQueue(object):
+    RECEIVE_POLL_INTERVAL = 0.05
+
+    def __init__(self, name, store, latency=0.0):
+        self.name = name
+        self.url = 'local://{}'.format(name)
+        self.store = store
+        self.latency = latency
+        self.attributes = {'VisibilityTimeout': str(store.visibility_timeout)}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put(self, body):
+        """Adds a message without emulated latency, for filling queues."""
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+        self.store.put(new_message(body))
+
+    def receive_messages(self, MaxNumberOfMessages=1, VisibilityTimeout=None, WaitTimeSeconds=0, **kwargs):
+        self._call('receive_messages')
+        timeout = VisibilityTimeout if VisibilityTimeout is not None else self.store.visibility_timeout
+        deadline = time.time() + WaitTimeSeconds
+        while True:
+            received = self.store.receive(MaxNumberOfMessages, timeout)
+            if received or time.time() >= deadline:
+                return [LocalMessage(self, message, receipt_handle) for message, receipt_handle in received]
+            time.sleep(self.RECEIVE_POLL_INTERVAL)
+
+    def change_message_visibility_batch(self, Entries):
+        self._call('change_message_visibility_batch')
+        return self._batch(Entries, lambda entry: self.store.change_visibility(
+            entry['ReceiptHandle'],
+            entry['VisibilityTimeout']
+        ))
+
+    def delete_messages(self, Entries):
+        self._call('delete_messages')
+        return self._batch(Entries, lambda entry: self.store.delete(entry['ReceiptHandle']))
+
+    def send_message(self, MessageBody, **kwargs):
+        self._call('send_message')
+        message = new_message(MessageBody)
+        self.store.put(message)
+        return {'MessageId': message['MessageId']}
+
+    def send_messages(self, Entries):
+        self._call('send_messages')
+        successful = []
+        for entry in Entries:
+            message = new_message(entry['MessageBody'])
+            self.store.put(message)
+            successful.append({'Id': entry['Id'], 'MessageId': message['MessageId']})
+        return {'Successful': successful, 'Failed': []}
+
+    @staticmethod
+    def _batch(entries, operation):
+        successful, failed = [], []
+        for entry in entries:
+            if operation(entry):
+                successful.append({'Id': entry['Id']})
+            else:
+                failed.append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True})
+        return {'Successful': successful, 'Failed': failed}
+
+
+class LocalSQSResource(object):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create_queue(self, QueueName, **kwargs):
+        return self._get_queue(QueueName, create=True)
+
+    def get_queue_by_name(self, QueueName, **kwargs):
+        return self._get_queue(QueueName, create=False)
+
+    def _get_queue(self, name, create):
+        if self.backend.queue_latency:
+            time.sleep(self.backend.queue_latency)
+        store = self.backend.get_queue_store(name, create=create)
+        if store is None:
+            raise client_error('AWS.SimpleQueueService.NonExistentQueue', 'Queue {} does not exist'.format(name),
+                               'GetQueueUrl')
+        return LocalQueue(name, store, self.backend.queue_latency)
+
+
+class LocalS3Client(object):
+    def __init__(self, backend):
+        self.backend = backend
+        self.store = backend.blob_store
+        # Parts of unfinished multipart uploads are kept by the client which started them
+        self.multipart_uploads = {}
+        self.lock = threading.Lock()
+
+    def _call(self):
+        if self.backend.blob_latency:
+            time.sleep(self.backend.blob_latency)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call()
+        data = Body if isinstance(Body, basestring) else Body.read()
+        self.store.put(Bucket, Key, data)
+        return {'ETag': get_etag(data)}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self._call()
+        blob = self.store.get(Bucket, Key)
+        if blob is None:
+            raise client_error('NoSuchKey', 'The specified key does not exist.', 'GetObject')
+        data, modified = blob
+        etag = get_etag(data)
+        if IfNoneMatch and IfNoneMatch == etag:
+            raise client_error('304', 'Not Modified', 'GetObject')
+        return {'Body': StringIO(data), 'ETag': etag, 'LastModified': modified, 'ContentLength': len(data)}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read())
+
+    def download_fileobj(self, Bucket, Key, Fileobj, ExtraArgs=None, Callback=None, Config=None):
+        Fileobj.write(self.get_object(Bucket=Bucket, Key=Key)['Body'].read())
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._call()
+        upload_id = str(uuid4())
+        with self.lock:
+            self.multipart_uploads[upload_id] = (Bucket, Key, {})
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def _get_multipart_upload(self, Bucket, Key, UploadId, operation):
+        with self.lock:
+            upload = self.multipart_uploads.get(UploadId)
+        if upload is None or upload[:2] != (Bucket, Key):
+            raise client_error('NoSuchUpload', 'The specified upload does not exist.', operation)
+        return upload[2]
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._call()
+        parts = self._get_multipart_upload(Bucket, Key, UploadId, 'UploadPart')
+        data = Body if isinstance(Body, basestring) else Body.read()
+        parts[PartNumber] = data
+        return {'ETag': get_etag(data)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._call()
+        parts = self._get_multipart_upload(Bucket, Key, UploadId, 'CompleteMultipartUpload')
+        for part in MultipartUpload['Parts']:
+            if get_etag(parts.get(part['PartNumber'], '')) != part['ETag']:
+                raise client_error('InvalidPart', 'One or more of the specified parts could not be found.',
+                                   'CompleteMultipartUpload')
+        data = ''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+        self.store.put(Bucket, Key, data)
+        with self.lock:
+            del self.multipart_uploads[UploadId]
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': get_etag(data)}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._call()
+        self._get_multipart_upload(Bucket, Key, UploadId, 'AbortMultipartUpload')
+        with self.lock:
+            del self.multipart_uploads[UploadId]
+        return {}
+
+
+class LocalBucket(object):
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def put_object(self, Key, Body, **kwargs):
+        return self.client.put_object(Bucket=self.name, Key=Key, Body=Body, **kwargs)
+
+    def upload_fileobj(self, Fileobj, Key, **kwargs):
+        self.client.upload_fileobj(Fileobj, self.name, Key, **kwargs)
+
+    def download_fileobj(self, Key, Fileobj, **kwargs):
+        self.client.download_fileobj(self.name, Key, Fileobj, **kwargs)
+
+
+class LocalResourceMeta(object):
+    def __init__(self, client):
+        self.client = client
+
+
+class LocalS3Resource(object):
+    def __init__(self, backend):
+        self.meta = LocalResourceMeta(LocalS3Client(backend))
+
+    def Bucket(self, name):
+        return LocalBucket(self.meta.client, name)
+
+
+class LocalBackend(object):
+    """Base of the backends with local queue and blob stores.
+
+    Subclasses provide `get_queue_store(name, create)`, which returns the store of the queue or None
+    if it does not exist, and `blob_store`. Queue stores implement `put(message)`,
+    `receive(max_number, visibility_timeout)`, `change_visibility(receipt_handle, timeout)` and
+    `delete(receipt_handle)`, blob stores implement `put(bucket, key, data)`, `get(bucket, key)`
+    and `keys(bucket)`.
+    """
+    DEFAULT_VISIBILITY_TIMEOUT = 300
+
+    blob_store = None
+
+    def __init__(self, queue_latency=0.0, blob_latency=0.0, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        self.queue_latency = queue_latency
+        self.blob_latency = blob_latency
+        self.visibility_timeout = visibility_timeout
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(**cls.get_options(settings))
+
+    @classmethod
+    def get_options(cls, settings):
+        return {
+            'queue_latency': settings.getfloat('LOCAL_BACKEND_QUEUE_LATENCY', 0.0),
+            'blob_latency': settings.getfloat('LOCAL_BACKEND_BLOB_LATENCY', 0.0),
+            'visibility_timeout': settings.getint('LOCAL_BACKEND_VISIBILITY_TIMEOUT', cls.DEFAULT_VISIBILITY_TIMEOUT)
+        }
+
+    def resource(self, service, **aws_settings):
+        if service == QUEUE:
+            return LocalSQSResource(self)
+        if service == BLOB:
+            return LocalS3Resource(self)
+        raise ValueError('Unsupported service {}'.format(service))
+
+    def get_queue_store(self, name, create=False):
+        raise NotImplementedError
@@ -0,0 +1,96 @@
+"""In-memory queue and blob stores, shared by everything in the process."""
+import time
+import threading
+
+from uuid import uuid4
+from datetime import datetime
+from collections import deque
+
+from content_analytics.backends.local import LocalBackend
+
+
+class MemoryQueueStore(object):
+    def __init__(self, visibility_timeout):
+        self.visibility_timeout = visibility_timeout
+        self.visible = deque()
+        self.invisible = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.visible) + len(self.invisible)
+
+    def put(self, message):
+        with self.lock:
+            self.visible.append(message)
+
+    def receive(self, max_number, visibility_timeout):
+        received = []
+        with self.lock:
+            self._release_expired()
+            while self.visible and len(received) < max_number:
+                message = self.visible.popleft()
+                attributes = message['Attributes']
+                attributes['ApproximateReceiveCount'] = str(int(attributes['ApproximateReceiveCount']) + 1)
+                receipt_handle = str(uuid4())
+                self.invisible[receipt_handle] = (message, time.time() + visibility_timeout)
+                received.append((message, receipt_handle))
+        return received
+
+    def change_visibility(self, receipt_handle, timeout):
+        with self.lock:
+            record = self.invisible.get(receipt_handle)
+            if record is None:
+                return False
+            if timeout == 0:
+                del self.invisible[receipt_handle]
+                self.visible.appendleft(record[0])
+            else:
+                self.invisible[receipt_handle] = (record[0], time.time() + timeout)
+            return True
+
+    def delete(self, receipt_handle):
+        with self.lock:
+            return self.invisible.pop(receipt_handle, None) is not None
+
+    def _release_expired(self):
+        now = time.time()
+        for receipt_handle, (message, deadline) in list(self.invisible.items()):
+            if deadline <= now:
+                del self.invisible[receipt_handle]
+                self.visible.append(message)
+
+
+class MemoryBlobStore(object):
+    def __init__(self):
+        self.blobs = {}
+        self.lock = threading.Lock()
+
+    def put(self, bucket, key, data):
+        with self.lock:
+            self.blobs[(bucket, key)] = (data, datetime.utcnow())
+
+    def get(self, bucket, key):
+        with self.lock:
+            return self.blobs.get((bucket, key))
+
+    def keys(self, bucket):
+        with self.lock:
+            return sorted(key for blob_bucket, key in self.blobs if blob_bucket == bucket)
+
+
+class MemoryBackend(LocalBackend):
+    """Queues and blobs live in memory of the process, forked workers get their own copies."""
+    queues = {}
+    blob_store = MemoryBlobStore()
+
+    def get_queue_store(self, name, create=False):
+        store = self.queues.get(name)
+        if store is None and create:
+            store = self.queues.setdefault(name, MemoryQueueStore(self.visibility_timeout))
+        return store
+
+    @classmethod
+    def reset(cls):
+        cls.queues.clear()
+        cls.blob_store = MemoryBlobStore()
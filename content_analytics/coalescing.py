@@ -0,0 +1,90 @@
+import json
+import logging
+
+from collections import OrderedDict
+
+from twisted.internet import reactor
+from w3lib.url import canonicalize_url
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class TaskCoalescer(StatsMixin):
+    """Coalesces duplicate tasks into a single crawl.
+
+    Tasks are duplicates if they have the same spider, response format, normalized url (or search
+    term) and the same values of all other message fields except those in `IGNORED_FIELDS`, which
+    only identify and route the task. The first task of a key is crawled, later duplicates are attached
+    to it and get its result once it is done. Successful results are kept for `result_ttl` seconds,
+    so duplicates which arrive shortly after the crawl reuse them without crawling at all.
+    """
+    DEFAULT_RESULT_TTL = 120
+
+    # Every duplicate gets its own output message built from its own input message,
+    # fields which are not listed here (e.g. quantity, pages_count, output_compression) make tasks different
+    IGNORED_FIELDS = frozenset(['task_id', 'msg_id', 'server_ip', 'result_queue', 'url', 'shelf_url', 'search_term',
+                                'searchterms_str'])
+
+    STATS_ATTACHED = 'runner/coalescing/attached'
+    STATS_REUSED = 'runner/coalescing/reused'
+
+    def __init__(self, result_ttl=DEFAULT_RESULT_TTL, stats=None, clock=None):
+        self.result_ttl = result_ttl
+        self.stats = stats
+        self.clock = clock or reactor
+        # key -> [leader task, follower tasks...]
+        self.in_flight = {}
+        # key -> (expiration time, filename), ordered by expiration time
+        self.results = OrderedDict()
+
+    @staticmethod
+    def get_key(message):
+        url = message.get('url') or message.get('shelf_url')
+        if url:
+            url = canonicalize_url(url)
+        else:
+            url = message.get('search_term')
+        if not url:
+            return None
+        fields = dict((name, value) for name, value in message.items() if name not in TaskCoalescer.IGNORED_FIELDS)
+        return message.get_spider_name(), message.get_format(), url, json.dumps(fields, sort_keys=True)
+
+    def get_result(self, key):
+        self._expire_results()
+        entry = self.results.get(key)
+        if entry is None:
+            return None
+        self._inc_stats(self.STATS_REUSED)
+        return entry[1]
+
+    def attach(self, key, task):
+        """Returns True if the task has been attached to the crawl of a duplicate, otherwise it becomes its leader."""
+        tasks = self.in_flight.get(key)
+        if tasks is None:
+            self.in_flight[key] = [task]
+            return False
+        logger.debug('Task {} is attached to the crawl of duplicate task {}'.format(task.id, tasks[0].id))
+        tasks.append(task)
+        self._inc_stats(self.STATS_ATTACHED)
+        return True
+
+    def complete(self, key, task, filename=None):
+        """Returns followers of the task if it is the leader of the key, remembers its successful result."""
+        tasks = self.in_flight.get(key)
+        if not tasks or tasks[0] is not task:
+            return []
+        del self.in_flight[key]
+        if filename and self.result_ttl > 0:
+            self.results.pop(key, None)
+            self.results[key] = (self.clock.seconds() + self.result_ttl, filename)
+        return tasks[1:]
+
+    def _expire_results(self):
+        now = self.clock.seconds()
+        while self.results:
+            key = next(iter(self.results))
+            if self.results[key][0] > now:
+                break
+            del self.results[key]
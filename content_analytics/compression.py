@@ -0,0 +1,94 @@
+import gzip
+import zlib
+import shutil
+
+from tempfile import SpooledTemporaryFile
+
+
+class Compression(object):
+    """Streams file object into compressed spooled temporary file.
+
+    Compression is CPU bound, so `compress` is meant to be called in a thread, see `S3Uploader.upload`.
+    Outputs which are uploaded while written are compressed chunk by chunk with `compressobj`, see
+    `MultipartOutput`.
+    """
+    CHUNK_SIZE = 64 * 1024
+    # Compressed outputs bigger than this are spooled to disk
+    MAX_MEMORY_SIZE = 16 * 1024 * 1024
+
+    content_encoding = None
+
+    def __init__(self, level=None):
+        self.level = level
+
+    def compress(self, fileobj):
+        """Compresses file object from its current position, returns compressed file object at its start."""
+        compressed = SpooledTemporaryFile(max_size=self.MAX_MEMORY_SIZE)
+        self.copy(fileobj, compressed)
+        compressed.seek(0)
+        return compressed
+
+    def copy(self, source, target):
+        raise NotImplementedError
+
+    def compressobj(self):
+        """Returns compressor of a single stream with `compress(data)` and `flush()` like `zlib` ones."""
+        raise NotImplementedError
+
+
+class GzipCompression(Compression):
+    content_encoding = 'gzip'
+    DEFAULT_LEVEL = 6
+
+    def copy(self, source, target):
+        with gzip.GzipFile(fileobj=target, mode='wb', compresslevel=self.level or self.DEFAULT_LEVEL) as gzipf:
+            shutil.copyfileobj(source, gzipf, self.CHUNK_SIZE)
+
+    def compressobj(self):
+        # Window bits over 16 produce gzip header and trailer
+        return zlib.compressobj(self.level or self.DEFAULT_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class ZstdCompression(Compression):
+    content_encoding = 'zstd'
+    DEFAULT_LEVEL = 3
+
+    def __init__(self, level=None):
+        super(ZstdCompression, self).__init__(level)
+        # Optional dependency, only workers configured for zstd need it
+        import zstandard
+        self.zstandard = zstandard
+
+    def copy(self, source, target):
+        # Compressors are not thread safe, every upload thread needs its own
+        compressor = self.zstandard.ZstdCompressor(level=self.level or self.DEFAULT_LEVEL)
+        compressor.copy_stream(source, target, read_size=self.CHUNK_SIZE, write_size=self.CHUNK_SIZE)
+
+    def compressobj(self):
+        return self.zstandard.ZstdCompressor(level=self.level or self.DEFAULT_LEVEL).compressobj()
+
+
+COMPRESSIONS = {
+    'gzip': GzipCompression,
+    'zstd': ZstdCompression,
+}
+
+
+def get_compression(name, level=None):
+    """Returns compression by its Content-Encoding name, None for empty name."""
+    if not name or name == 'identity':
+        return None
+    try:
+        compression_cls = COMPRESSIONS[name]
+    except KeyError:
+        raise ValueError('Unknown output compression {}'.format(name))
+    return compression_cls(level)
+
+
+class EncodedKey(str):
+    """Key of the output object with its Content-Encoding, output messages add the encoding."""
+
+    def __new__(cls, key, content_encoding):
+        encoded_key = str.__new__(cls, key)
+        encoded_key.content_encoding = content_encoding
+        return encoded_key
@@ -0,0 +1,172 @@
+import os
+import logging
+
+from twisted.internet import task
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+def get_rss():
+    """Current resident set size of the process in bytes, or None if it can not be read."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+class ReactorLagProbe(object):
+    """Measures how late the reactor runs a call scheduled every `interval` seconds."""
+
+    def __init__(self, interval=0.5, clock=None):
+        self.interval = interval
+        self.max_lag = 0.0
+        self.last_call = None
+        self.looping_call = task.LoopingCall(self.probe)
+        if clock is not None:
+            self.looping_call.clock = clock
+        self.clock = self.looping_call.clock
+
+    def start(self):
+        if not self.looping_call.running:
+            self.last_call = self.clock.seconds()
+            self.looping_call.start(self.interval, now=False)
+
+    def stop(self):
+        if self.looping_call.running:
+            self.looping_call.stop()
+
+    def probe(self):
+        now = self.clock.seconds()
+        if self.last_call is not None:
+            self.max_lag = max(self.max_lag, now - self.last_call - self.interval)
+        self.last_call = now
+
+    def reset(self):
+        lag, self.max_lag = self.max_lag, 0.0
+        return lag
+
+
+class AdaptiveConcurrency(StatsMixin):
+    """AIMD controller of the number of tasks processed by the runner at the same time.
+
+    Every `interval` seconds the target is decreased by `decrease_factor` if reactor lag, RSS,
+    average task latency or task error rate observed during the interval exceeds its limit,
+    otherwise it is increased by `increase` if all slots were in use. The target always stays
+    between `floor` and `ceiling`. Limits set to None are not checked.
+    """
+    DEFAULT_INTERVAL = 10
+    DEFAULT_INCREASE = 1
+    DEFAULT_DECREASE_FACTOR = 0.5
+    DEFAULT_MAX_REACTOR_LAG = 0.5
+    DEFAULT_MAX_ERROR_RATE = 0.5
+    MIN_ERROR_SAMPLES = 5
+
+    STATS_TARGET = 'runner/max_tasks'
+    STATS_INCREASED = 'runner/max_tasks/increased'
+    STATS_DECREASED = 'runner/max_tasks/decreased'
+
+    def __init__(self, initial, floor, ceiling, load, interval=DEFAULT_INTERVAL, increase=DEFAULT_INCREASE,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR, max_reactor_lag=DEFAULT_MAX_REACTOR_LAG, max_rss=None,
+                 max_task_latency=None, max_error_rate=DEFAULT_MAX_ERROR_RATE, on_change=None, stats=None,
+                 clock=None, rss=get_rss):
+        assert 0 < floor <= ceiling and 0 < decrease_factor < 1
+        self.floor = floor
+        self.ceiling = ceiling
+        self.target = min(max(initial, floor), ceiling)
+        self.load = load
+        self.interval = interval
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.max_reactor_lag = max_reactor_lag
+        self.max_rss = max_rss
+        self.max_task_latency = max_task_latency
+        self.max_error_rate = max_error_rate
+        self.on_change = on_change
+        self.stats = stats
+        self.rss = rss
+        self.saturated = False
+        self.latencies = []
+        self.failures = 0
+
+        self.lag_probe = ReactorLagProbe(clock=clock)
+        self.looping_call = task.LoopingCall(self.adjust)
+        if clock is not None:
+            self.looping_call.clock = clock
+        self._set_stats(self.STATS_TARGET, self.target)
+
+    def start(self):
+        self.lag_probe.start()
+        if not self.looping_call.running:
+            self.looping_call.start(self.interval, now=False)
+
+    def stop(self):
+        self.lag_probe.stop()
+        if self.looping_call.running:
+            self.looping_call.stop()
+
+    def task_started(self):
+        if self.load() >= self.target:
+            self.saturated = True
+
+    def task_finished(self, latency, failed=False):
+        self.latencies.append(latency)
+        if failed:
+            self.failures += 1
+
+    def get_overload_reason(self, lag, rss, latency, error_rate):
+        if self.max_reactor_lag is not None and lag > self.max_reactor_lag:
+            return 'reactor_lag'
+        if self.max_rss is not None and rss is not None and rss > self.max_rss:
+            return 'rss'
+        if self.max_task_latency is not None and latency is not None and latency > self.max_task_latency:
+            return 'task_latency'
+        if self.max_error_rate is not None and error_rate is not None and error_rate > self.max_error_rate:
+            return 'error_rate'
+
+    def adjust(self):
+        lag = self.lag_probe.reset()
+        rss = self.rss()
+        latency = sum(self.latencies) / len(self.latencies) if self.latencies else None
+        error_rate = float(self.failures) / len(self.latencies) if len(self.latencies) >= self.MIN_ERROR_SAMPLES else None
+        saturated = self.saturated or self.load() >= self.target
+        self.latencies = []
+        self.failures = 0
+        self.saturated = False
+
+        self._set_stats('runner/reactor_lag', round(lag, 3))
+        if rss is not None:
+            self._set_stats('runner/rss', rss)
+        if latency is not None:
+            self._set_stats('runner/task_latency', round(latency, 3))
+        if error_rate is not None:
+            self._set_stats('runner/error_rate', round(error_rate, 3))
+
+        target = self.target
+        reason = self.get_overload_reason(lag, rss, latency, error_rate)
+        if reason:
+            target = max(self.floor, int(self.target * self.decrease_factor))
+            if target < self.target:
+                self._inc_stats(self.STATS_DECREASED)
+                self._inc_stats('{}/{}'.format(self.STATS_DECREASED, reason))
+                logger.info('Runner is overloaded ({}), decreasing max tasks from {} to {}'.format(
+                    reason, self.target, target
+                ))
+        elif saturated:
+            target = min(self.ceiling, self.target + self.increase)
+            if target > self.target:
+                self._inc_stats(self.STATS_INCREASED)
+                logger.debug('All task slots are in use, increasing max tasks from {} to {}'.format(self.target, target))
+
+        if target != self.target:
+            self.target = target
+            self._set_stats(self.STATS_TARGET, target)
+            if self.on_change is not None:
+                self.on_change(target)
+        return target
+
+    def _set_stats(self, key, value):
+        if self.stats is not None:
+            self.stats.set_value(key, value)
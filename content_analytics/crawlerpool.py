@@ -0,0 +1,186 @@
+import logging
+
+from datetime import datetime
+
+from twisted.internet import reactor
+from scrapy.exceptions import DontCloseSpider
+
+from content_analytics import signals
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class PooledCrawler(object):
+    """Crawler which stays open between tasks and takes them one by one.
+
+    Middlewares, extensions, pipelines and the downloader are created once per crawler. Every task
+    gets a re-initialized spider, fresh stats and its own `task_opened`/`task_closed` signals, which
+    per-task components are connected to instead of `spider_opened`/`spider_closed`
+    (see `content_analytics.signals.connect_task_signals`).
+    """
+
+    def __init__(self, pool, spider_name, crawler):
+        self.pool = pool
+        self.spider_name = spider_name
+        self.crawler = crawler
+        self.message = None
+        self.options = None
+        self.tasks = 0
+        self.closing = False
+        self.idle_since = None
+        self.started = None
+
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @property
+    def spider(self):
+        return self.crawler.spider
+
+    @property
+    def busy(self):
+        return self.message is not None
+
+    @property
+    def reusable(self):
+        return hasattr(self.spider, 'reset_task')
+
+    def start(self, message, options):
+        self.message = message
+        self.options = options
+        self.started = reactor.seconds()
+        return self.pool.runner.crawl(
+            crawler_or_spidercls=self.crawler,
+            message=message,
+            **options
+        )
+
+    def submit(self, message, options):
+        assert not self.busy and not self.closing
+        self.message = message
+        self.options = options
+        self.started = reactor.seconds()
+        self.idle_since = None
+
+        spider = self.spider
+        spider.reset_task(message=message, **options)
+        self.crawler.stats.set_value('start_time', datetime.utcnow(), spider=spider)
+        self.open_task()
+
+        dt = self.crawler.engine.scraper.spidermw.process_start_requests(iter(spider.start_requests()), spider)
+        dt.addCallback(self.schedule_start_requests)
+        return dt
+
+    def schedule_start_requests(self, start_requests):
+        slot = self.crawler.engine.slot
+        slot.start_requests = iter(start_requests)
+        slot.nextcall.schedule()
+
+    def open_task(self):
+        self.pool._inc_stats('tasks')
+        self.crawler.signals.send_catch_log(
+            signal=signals.task_opened,
+            spider=self.spider,
+            message=self.message
+        )
+
+    def close_task(self, reason):
+        message, self.message = self.message, None
+        spider = self.spider
+        stats = self.crawler.stats
+        stats.set_value('finish_time', datetime.utcnow(), spider=spider)
+        stats.set_value('finish_reason', reason, spider=spider)
+
+        dt = self.crawler.signals.send_catch_log_deferred(
+            signal=signals.task_closed,
+            spider=spider,
+            reason=reason,
+            message=message
+        )
+        # All receivers have read task stats synchronously, the next task starts from scratch
+        stats.clear_stats(spider)
+        self.tasks += 1
+        self.idle_since = reactor.seconds()
+        self.pool.release(self)
+        return dt
+
+    def spider_opened(self, spider):
+        self.open_task()
+
+    def spider_idle(self, spider):
+        if self.busy:
+            self.close_task('finished')
+        if self.busy:
+            # The next task has been submitted while closing the previous one
+            raise DontCloseSpider
+        if self.should_close():
+            self.closing = True
+            self.pool.remove(self)
+            return
+        raise DontCloseSpider
+
+    def spider_closed(self, spider, reason):
+        self.closing = True
+        if self.busy:
+            self.close_task(reason)
+        self.pool.remove(self)
+
+    def should_close(self):
+        if not self.reusable or self.tasks >= self.pool.max_crawler_tasks:
+            return True
+        return self.idle_since is not None and reactor.seconds() - self.idle_since >= self.pool.idle_timeout
+
+
+class CrawlerPool(StatsMixin):
+    """Keeps warm crawlers per spider name and feeds them with tasks from the runner."""
+    DEFAULT_IDLE_TIMEOUT = 300
+    DEFAULT_MAX_CRAWLER_TASKS = 1000
+
+    stats_prefix = 'crawler_pool'
+
+    def __init__(self, runner, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_crawler_tasks=DEFAULT_MAX_CRAWLER_TASKS,
+                 stats=None):
+        self.runner = runner
+        self.idle_timeout = idle_timeout
+        self.max_crawler_tasks = max_crawler_tasks
+        self.stats = stats
+        self.crawlers = {}
+        self.idle = {}
+
+    def submit(self, spider_name, message, options):
+        idle = self.idle.get(spider_name)
+        while idle:
+            pooled = idle.pop()
+            if not pooled.closing and not pooled.busy:
+                self._inc_stats('reused')
+                logger.debug('Reusing warm crawler for spider {}'.format(spider_name))
+                pooled.submit(message, options)
+                return pooled
+
+        self._inc_stats('created')
+        logger.debug('Creating new crawler for spider {}'.format(spider_name))
+        pooled = PooledCrawler(self, spider_name, self.runner.create_crawler(spider_name))
+        self.crawlers.setdefault(spider_name, set()).add(pooled)
+        self.runner.connect_crawler_signals(pooled.crawler)
+        pooled.start(message, options)
+        return pooled
+
+    def release(self, pooled):
+        if pooled.closing or not pooled.reusable:
+            return
+        idle = self.idle.setdefault(pooled.spider_name, [])
+        if pooled not in idle:
+            idle.append(pooled)
+
+    def remove(self, pooled):
+        name = pooled.spider_name
+        if pooled in self.idle.get(name, []):
+            self.idle[name].remove(pooled)
+        if pooled in self.crawlers.get(name, set()):
+            self.crawlers[name].remove(pooled)
+            self._inc_stats('closed')
+
+    def __len__(self):
+        return sum(len(crawlers) for crawlers in self.crawlers.values())
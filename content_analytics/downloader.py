@@ -0,0 +1,210 @@
+import logging
+
+from collections import OrderedDict
+
+from OpenSSL import SSL
+from OpenSSL._util import lib as ssl_lib
+from twisted.internet import defer, reactor
+from twisted.web.client import HTTPConnectionPool
+from twisted.web.iweb import IPolicyForHTTPS
+from zope.interface.declarations import implementer
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.core.downloader.tls import ScrapyClientTLSOptions, openssl_methods
+from scrapy.utils.misc import load_object
+
+logger = logging.getLogger(__name__)
+
+
+class SharedConnectionPool(HTTPConnectionPool):
+    """Persistent connection pool which counts new and reused connections.
+
+    Counters are kept in stats, so pools sharing the collector are counted together.
+    """
+    STATS_CONNECTIONS = 'http_pool/connections'
+    STATS_CREATED = 'http_pool/created'
+    STATS_REUSED = 'http_pool/reused'
+    STATS_REUSE_RATE = 'http_pool/reuse_rate'
+
+    def __init__(self, reactor_, stats=None):
+        HTTPConnectionPool.__init__(self, reactor_, persistent=True)
+        self._factory.noisy = False
+        self.stats = stats
+
+    def getConnection(self, key, endpoint):
+        # New connections are counted by `_newConnection`, which is called before this returns
+        d = HTTPConnectionPool.getConnection(self, key, endpoint)
+        if self.stats is not None:
+            self.stats.inc_value(self.STATS_CONNECTIONS)
+            connections = self.stats.get_value(self.STATS_CONNECTIONS)
+            created = self.stats.get_value(self.STATS_CREATED, 0)
+            self.stats.set_value(self.STATS_CREATED, created)
+            self.stats.set_value(self.STATS_REUSED, connections - created)
+            self.stats.set_value(self.STATS_REUSE_RATE, round(1 - float(created) / connections, 3))
+        return d
+
+    def _newConnection(self, key, endpoint):
+        if self.stats is not None:
+            self.stats.inc_value(self.STATS_CREATED)
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+
+class SessionReusingTLSOptions(ScrapyClientTLSOptions):
+    """Connection creator which resumes the last TLS session of its host.
+
+    The session is taken from the last connection only when the next one is created, because
+    TLS 1.3 servers send session tickets after the handshake is done.
+    """
+
+    def __init__(self, hostname, ctx, cache):
+        ScrapyClientTLSOptions.__init__(self, hostname, ctx)
+        self.cache = cache
+        self.session = None
+        self.last_connection = None
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        if self.last_connection is not None:
+            self.session = self.last_connection.get_session() or self.session
+            self.last_connection = None
+        connection = ScrapyClientTLSOptions.clientConnectionForTLS(self, tlsProtocol)
+        if self.session is not None:
+            connection.set_session(self.session)
+        return connection
+
+    def _identityVerifyingInfoCallback(self, connection, where, ret):
+        ScrapyClientTLSOptions._identityVerifyingInfoCallback(self, connection, where, ret)
+        if where & SSL.SSL_CB_HANDSHAKE_DONE:
+            resumed = bool(ssl_lib.SSL_session_reused(connection._ssl))  # pylint: disable=protected-access
+            self.cache.handshake_done(resumed)
+            self.last_connection = connection
+
+
+@implementer(IPolicyForHTTPS)
+class SessionCachingContextFactory(object):
+    """Wraps the configured context factory and keeps a TLS context and the last session per host.
+
+    Contexts are not shared between hosts, because the info callback which sets SNI is bound to
+    the context. The least recently used hosts are dropped once there are more than `max_hosts`.
+    """
+    DEFAULT_MAX_HOSTS = 1000
+
+    STATS_HANDSHAKES = 'tls/handshakes'
+    STATS_RESUMED = 'tls/resumed'
+
+    def __init__(self, context_factory, max_hosts=DEFAULT_MAX_HOSTS, stats=None):
+        self.context_factory = context_factory
+        self.max_hosts = max_hosts
+        self.stats = stats
+        self.hosts = OrderedDict()
+
+    def creatorForNetloc(self, hostname, port):
+        key = (hostname, port)
+        options = self.hosts.pop(key, None)
+        if options is None:
+            options = SessionReusingTLSOptions(hostname.decode('ascii'), self.context_factory.getContext(), self)
+        self.hosts[key] = options
+        while len(self.hosts) > self.max_hosts:
+            self.hosts.popitem(last=False)
+        return options
+
+    def handshake_done(self, resumed):
+        if self.stats is not None:
+            self.stats.inc_value(self.STATS_HANDSHAKES)
+            if resumed:
+                self.stats.inc_value(self.STATS_RESUMED)
+
+
+class SharedHTTPResources(object):
+    """Connection pools and TLS session caches which are shared by all crawlers of the runner.
+
+    Pooled connections are keyed by scheme, host and port only, so crawlers whose settings select
+    another context factory or TLS method (e.g. in spider `custom_settings`) get their own pool and
+    session cache, shared with crawlers which have the same TLS settings.
+    """
+    DISCONNECT_TIMEOUT = 1
+
+    def __init__(self, settings, stats=None):
+        self.settings = settings
+        self.stats = stats
+        # (context factory, TLS method) -> (pool, context factory)
+        self.groups = {}
+        self.pool, self.context_factory = self.get(settings)
+
+    @staticmethod
+    def get_tls_key(settings):
+        return settings['DOWNLOADER_CLIENTCONTEXTFACTORY'], settings.get('DOWNLOADER_CLIENT_TLS_METHOD')
+
+    def get(self, settings):
+        """Returns the pool and context factory for TLS settings of a crawler."""
+        key = self.get_tls_key(settings)
+        if key not in self.groups:
+            self.groups[key] = (self.create_pool(), self.create_context_factory(*key))
+        return self.groups[key]
+
+    def create_pool(self):
+        pool = SharedConnectionPool(reactor, stats=self.stats)
+        pool.maxPersistentPerHost = self.settings.getint(
+            'HTTP_POOL_MAX_PER_HOST',
+            self.settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        )
+        pool.cachedConnectionTimeout = self.settings.getint(
+            'HTTP_POOL_IDLE_TIMEOUT',
+            pool.cachedConnectionTimeout
+        )
+        return pool
+
+    def create_context_factory(self, context_factory, method):
+        return SessionCachingContextFactory(
+            load_object(context_factory)(method=openssl_methods[method]),
+            max_hosts=self.settings.getint(
+                'HTTP_POOL_TLS_SESSION_HOSTS',
+                SessionCachingContextFactory.DEFAULT_MAX_HOSTS
+            ),
+            stats=self.stats
+        )
+
+    def close(self):
+        return defer.DeferredList([self.close_pool(pool) for pool, _ in self.groups.values()])
+
+    def close_pool(self, pool):
+        d = pool.closeCachedConnections()
+        # See `HTTP11DownloadHandler.close`, closing may hang on network issues
+        delayed_call = reactor.callLater(self.DISCONNECT_TIMEOUT, d.callback, [])
+
+        def cancel_delayed_call(result):
+            if delayed_call.active():
+                delayed_call.cancel()
+            return result
+
+        d.addBoth(cancel_delayed_call)
+        return d
+
+
+class SharedHTTP11DownloadHandler(HTTP11DownloadHandler):
+    """HTTP download handler which uses the runner's `SharedHTTPResources` if they are installed.
+
+    Scrapy creates download handlers with settings only, so the runner installs its resources
+    process-wide with `install`. Without them the handler is the same as Scrapy's one.
+    """
+    resources = None
+
+    def __init__(self, settings):  # pylint: disable=super-init-not-called
+        self.shared = self.resources is not None
+        if not self.shared:
+            super(SharedHTTP11DownloadHandler, self).__init__(settings)
+            return
+        # Same attributes as `HTTP11DownloadHandler.__init__` sets, without creating its own connection pool
+        self._pool, self._contextFactory = self.resources.get(settings)
+        self._default_maxsize = settings.getint('DOWNLOAD_MAXSIZE')
+        self._default_warnsize = settings.getint('DOWNLOAD_WARNSIZE')
+        self._fail_on_dataloss = settings.getbool('DOWNLOAD_FAIL_ON_DATALOSS')
+        self._disconnect_timeout = self.resources.DISCONNECT_TIMEOUT
+
+    @classmethod
+    def install(cls, resources):
+        cls.resources = resources
+
+    def close(self):
+        if self.shared:
+            # Cached connections are kept for the next crawlers and closed by the runner
+            return defer.succeed(None)
+        return super(SharedHTTP11DownloadHandler, self).close()
@@ -0,0 +1,35 @@
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
+
+
+class ThreadPoolExecutor(object):
+    """Runs blocking calls in a dedicated bounded thread pool.
+
+    Every call returns a `Deferred`, so the reactor thread never waits for blocking I/O. The pool is
+    started by the first call and stopped on reactor shutdown.
+    """
+    DEFAULT_MIN_THREADS = 1
+    DEFAULT_MAX_THREADS = 10
+
+    def __init__(self, reactor, min_threads=DEFAULT_MIN_THREADS, max_threads=DEFAULT_MAX_THREADS, name=None):
+        assert 0 < max_threads and 0 <= min_threads <= max_threads
+        self.reactor = reactor
+        self.threadpool = ThreadPool(minthreads=min_threads, maxthreads=max_threads, name=name)
+        self.started = False
+
+    def start(self):
+        if self.started:
+            return
+        self.threadpool.start()
+        self.started = True
+        self.reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def stop(self):
+        if self.started:
+            self.started = False
+            self.threadpool.stop()
+
+    def call(self, func, *args, **kwargs):
+        if not self.started:
+            self.start()
+        return threads.deferToThreadPool(self.reactor, self.threadpool, func, *args, **kwargs)
@@ -377,3 +377,10 @@ class CompatibleJsonLinesItemExporter(BaseItemExporter):
         data = self.encoder.encode(itemdict) + '\n'
         self.file.write(to_bytes(data, self.encoding))
         return itemdict
+
+    def export_status(self, batch_url, status, failure_type=None):
+        """Exports status line for url of batch task which did not give a product."""
+        statusdict = {'batch_url': batch_url, 'status': status, 'failure_type': failure_type}
+        data = self.encoder.encode(statusdict) + '\n'
+        self.file.write(to_bytes(data, self.encoding))
+        return statusdict
@@ -50,7 +50,9 @@ class FilebeatEntry(dict):
             'output_queue_name': None,
             'job_id': None,
             'slack_username': None,
-            'errors_traceback': None
+            'errors_traceback': None,
+            'runner_max_tasks': None,
+            'memory_delta': None
         })
 
 
@@ -64,6 +66,7 @@ class FilebeatExtension(object):
         self.scraped = False
         self.stats = stats
         self.entry = FilebeatEntry()
+        self.message = None
         self.path = settings.get('FILEBEAT_PATH', None)
         self.git_branch = os.environ.get('SCRAPERS_GIT_BRANCH')
         self.input_queue_name = settings.get('INPUT_QUEUE_NAME')
@@ -91,8 +94,7 @@ class FilebeatExtension(object):
         if not crawler.settings.getbool('FILEBEAT_ENABLED', False):
             return None
         extension = cls(crawler.stats, crawler.settings)
-        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
-        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        signals.connect_task_signals(crawler, opened=extension.spider_opened, closed=extension.spider_closed)
         crawler.signals.connect(extension.spider_error, signal=signals.spider_error)
 
         crawler.signals.connect(extension.request_scheduled, signal=signals.request_scheduled)
@@ -109,6 +111,11 @@ class FilebeatExtension(object):
         return extension
 
     def spider_opened(self, spider):
+        # Pooled crawlers write one entry per task
+        self.scraped = False
+        self.entry = FilebeatEntry()
+        self.message = getattr(spider, 'message', None)
+
         if hasattr(spider, 'product_url'):
             cond_set_value(self.entry, 'url', spider.product_url)
         if hasattr(spider, 'shelf_url'):
@@ -172,11 +179,13 @@ class FilebeatExtension(object):
     def item_dropped(self, item, response, exception, spider):
         cond_set_value(self.entry, 'failure_cause', exception.message)
 
-    def bucket_uploaded(self, filename, spider):
-        cond_set_value(self.entry, 's3_filepath', filename)
+    def bucket_uploaded(self, filename, spider, message=None):
+        if message is None or message is self.message:
+            cond_set_value(self.entry, 's3_filepath', filename)
 
-    def bucket_failed(self, failure, spider):
-        cond_set_value(self.entry, 'failure_cause', str(failure))
+    def bucket_failed(self, failure, spider, message=None):
+        if message is None or message is self.message:
+            cond_set_value(self.entry, 'failure_cause', str(failure))
 
     def spider_error(self, failure, response, spider):
         cond_set_value(self.entry, 'errors_traceback', str(failure.getTraceback(detail="default")))
@@ -188,8 +197,10 @@ class FilebeatExtension(object):
             self.entry[SimpleValidator.VALIDATION_FAILURE_FIELD] = stats.pop(SimpleValidator.VALIDATION_FAILURE_FIELD) or 0
 
         cond_set_value(self.entry, 'scrapy_stats', stats)
+        cond_set_value(self.entry, 'runner_max_tasks', stats.get('runner/max_tasks'))
         cond_set_value(self.entry, 'duration', stats.get('finish_time') - stats.get('start_time'))
         cond_set_value(self.entry, 's3_filepath', getattr(spider, 's3_filepath', None))
+        cond_set_value(self.entry, 'memory_delta', stats.get('memory/rss_delta'))
 
         if self.entry.get('failure_cause', None):
             cond_set_value(self.entry, 'status', self.STATUS_FAILED)
@@ -0,0 +1,34 @@
+from content_analytics import signals
+from content_analytics.concurrency import get_rss
+
+
+class MemoryDeltaExtension(object):
+    """Puts RSS of the worker at the start and the end of every task to its stats.
+
+    Tasks run concurrently, so a single delta is noisy, but deltas aggregated per spider
+    (e.g. from Filebeat entries) show which spiders leak. Must be enabled before
+    `FilebeatExtension`, so the stats are set when the entry is written.
+    """
+    STATS_RSS_START = 'memory/rss_start'
+    STATS_RSS_END = 'memory/rss_end'
+    STATS_RSS_DELTA = 'memory/rss_delta'
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.rss_start = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler.stats)
+        signals.connect_task_signals(crawler, opened=extension.spider_opened, closed=extension.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.rss_start = get_rss()
+        self.stats.set_value(self.STATS_RSS_START, self.rss_start)
+
+    def spider_closed(self, spider):
+        rss = get_rss()
+        self.stats.set_value(self.STATS_RSS_END, rss)
+        if self.rss_start is not None and rss is not None:
+            self.stats.set_value(self.STATS_RSS_DELTA, rss - self.rss_start)
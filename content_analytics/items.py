@@ -219,6 +219,7 @@ class Marketplace(dict):
 
 class BaseProductItem(Item):
     url = Field()							# (str) valid full product url
+    batch_url = Field()						# (str) url from batch task `urls` the product was requested for
     title = Field()							# (str) product title from page
 
 
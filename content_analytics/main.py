@@ -6,5 +6,13 @@ logging.basicConfig(level=logging.DEBUG)
 sys.path.append(path.join(path.dirname(path.realpath(__file__)), '..'))
 
 if __name__ == "__main__":
-    from content_analytics.runner import Runner
-    Runner()
+    from scrapy.utils.project import get_project_settings
+    settings = get_project_settings()
+    if settings.getbool('RUNNER_SUPERVISOR_ENABLED'):
+        from content_analytics.supervisor import Supervisor
+        Supervisor(settings).start()
+    else:
+        from content_analytics.memory import RECYCLE_EXIT_CODE
+        from content_analytics.runner import Runner
+        if Runner(settings).recycling:
+            sys.exit(RECYCLE_EXIT_CODE)
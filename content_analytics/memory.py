@@ -0,0 +1,59 @@
+import gc
+
+from twisted.internet import reactor
+
+from content_analytics.concurrency import get_rss
+
+# Worker exits with this code after recycling, so the supervisor (or container) starts a fresh one
+RECYCLE_EXIT_CODE = 75
+
+
+def get_heap_objects():
+    """Number of objects tracked by the garbage collector, costs a walk over the whole heap."""
+    return len(gc.get_objects())
+
+
+class MemoryWatchdog(object):
+    """Samples memory of the worker and tells when it is over the limits.
+
+    RSS is cheap to read and is sampled on every check. Python heap is measured as the number of
+    objects tracked by the garbage collector, which takes a walk over all of them, so it is sampled
+    at most once per `heap_interval` seconds. Limits of 0 are not checked.
+    """
+    DEFAULT_HEAP_INTERVAL = 60
+
+    STATS_RSS = 'memory/rss'
+    STATS_RSS_MAX = 'memory/rss_max'
+    STATS_HEAP_OBJECTS = 'memory/heap_objects'
+    STATS_EXCEEDED = 'memory/exceeded'
+
+    def __init__(self, rss_limit=0, heap_limit=0, heap_interval=DEFAULT_HEAP_INTERVAL, stats=None, clock=None):
+        self.rss_limit = rss_limit
+        self.heap_limit = heap_limit
+        self.heap_interval = heap_interval
+        self.stats = stats
+        self.clock = clock or reactor
+        self.heap_sampled = None
+
+    def check(self):
+        """Returns description of the exceeded limit, None if memory is within the limits."""
+        rss = get_rss()
+        if self.stats is not None and rss is not None:
+            self.stats.set_value(self.STATS_RSS, rss)
+            self.stats.max_value(self.STATS_RSS_MAX, rss)
+        if self.rss_limit and rss is not None and rss > self.rss_limit:
+            return self._exceeded('RSS {} MB is over {} MB'.format(rss >> 20, self.rss_limit >> 20))
+
+        now = self.clock.seconds()
+        if self.heap_limit and (self.heap_sampled is None or now - self.heap_sampled >= self.heap_interval):
+            self.heap_sampled = now
+            heap_objects = get_heap_objects()
+            if self.stats is not None:
+                self.stats.set_value(self.STATS_HEAP_OBJECTS, heap_objects)
+            if heap_objects > self.heap_limit:
+                return self._exceeded('{} heap objects are over {}'.format(heap_objects, self.heap_limit))
+
+    def _exceeded(self, reason):
+        if self.stats is not None:
+            self.stats.inc_value(self.STATS_EXCEEDED)
+        return reason
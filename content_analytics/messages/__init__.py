@@ -4,13 +4,41 @@ import json
 import logging
 
 
+def is_url_list(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(url, six.string_types) for url in value)
+
+
 class BaseInputMessage(dict):
     raw_message = None
+    # Per url results of batch task, filled in by export pipeline
+    url_results = None
 
     def __init__(self, raw_message, message):
         self.raw_message = raw_message
         super(BaseInputMessage, self).__init__(message)
 
+    def get_urls(self):
+        return self.get('urls') or []
+
+    def get_url_results(self, failure_type=None):
+        """Per url entries for the output message of batch task, all urls are failed if nothing was exported."""
+        if self.url_results is not None:
+            return self.url_results
+        return [{'url': url, 'status': 'failure', 'failure_type': failure_type} for url in self.get_urls()]
+
+    def get_timeout(self):
+        """Crawl time budget of the task in seconds, None if the message has no valid one."""
+        try:
+            timeout = float(self.get('timeout') or 0)
+        except (TypeError, ValueError):
+            return None
+        return timeout if timeout > 0 else None
+
+    def get_output_compression(self):
+        """Content-Encoding requested for the output object, None to use the worker default."""
+        compression = self.get('output_compression')
+        return compression if isinstance(compression, six.string_types) else None
+
     def get_spider_name(self):
         raise NotImplementedError
 
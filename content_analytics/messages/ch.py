@@ -7,7 +7,8 @@ from zlib import compress
 from base64 import b64encode
 from datetime import datetime
 
-from content_analytics.messages import BaseInputMessage, BaseOutputMessage as _BaseOutputMessage, BaseMessageResolver
+from content_analytics.messages import BaseInputMessage, BaseOutputMessage as _BaseOutputMessage, BaseMessageResolver, \
+    is_url_list
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +28,7 @@ class InputMessage(BaseInputMessage):
     def __init__(self, raw_message):
         try:
             message = json.loads(raw_message.body)
-            assert isinstance(message.get('url'), six.string_types)
+            assert isinstance(message.get('url'), six.string_types) or is_url_list(message.get('urls'))
             assert isinstance(message.get('site'), six.string_types)
             assert isinstance(message.get('result_queue'), six.string_types)
             assert isinstance(message.get('response_format'), six.string_types)
@@ -62,6 +63,13 @@ class SuccessMessage(BaseOutputMessage):
             'status': 'failure',
             'failure_type': 'Response too large'
         })
+        # Output is a byte range of an aggregated segment, see `content_analytics.segments`
+        if getattr(filename, 'offset', None) is not None:
+            self.update({'s3_key': filename, 's3_offset': filename.offset, 's3_length': filename.length})
+        if getattr(filename, 'content_encoding', None):
+            self['s3_content_encoding'] = filename.content_encoding
+        if input_message.get('urls'):
+            self['urls'] = input_message.get_url_results()
         self.queue_name = input_message.get('result_queue')
 
     def get_queue_name(self):
@@ -78,6 +86,8 @@ class FailureMessage(BaseOutputMessage):
             'date': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
             'status': 'failure'
         })
+        if input_message.get('urls'):
+            self['urls'] = input_message.get_url_results()
         self.queue_name = input_message.get('result_queue')
 
     def get_queue_name(self):
@@ -4,7 +4,7 @@ import logging
 
 from datetime import datetime
 
-from content_analytics.messages import BaseInputMessage, BaseOutputMessage, BaseMessageResolver
+from content_analytics.messages import BaseInputMessage, BaseOutputMessage, BaseMessageResolver, is_url_list
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +20,8 @@ class InputMessage(BaseInputMessage):
         try:
             message = json.loads(raw_message.body)
             assert isinstance(message.get('url'), six.string_types) or \
-                   isinstance(message.get('searchterms_str'), six.string_types)
+                   isinstance(message.get('searchterms_str'), six.string_types) or \
+                   is_url_list(message.get('urls'))
 
             assert isinstance(message.get('quantity'), six.string_types) or message.get('quantity') is None
             assert isinstance(message.get('pages_count'), (six.string_types, int)) or message.get('pages_count') is None
@@ -85,6 +86,13 @@ class SuccessMessage(BaseOutputMessage):
             'bucket_name': bucket_name,
             's3_key_data': bucket_key,
         })
+        # Output is a byte range of an aggregated segment, see `content_analytics.segments`
+        if getattr(bucket_key, 'offset', None) is not None:
+            self.update({'s3_key': bucket_key, 's3_offset': bucket_key.offset, 's3_length': bucket_key.length})
+        if getattr(bucket_key, 'content_encoding', None):
+            self['s3_content_encoding'] = bucket_key.content_encoding
+        if input_message.get('urls'):
+            self['urls'] = input_message.get_url_results()
         self.queue_name = input_message.get('result_queue')
 
     def get_queue_name(self):
@@ -104,6 +112,8 @@ class FailureMessage(BaseOutputMessage):
             'url': input_message.get('url') or input_message.get('shelf_url'),
             'searchterms_str': input_message.get('search_term'),
         })
+        if input_message.get('urls'):
+            self['urls'] = input_message.get_url_results()
         self.queue_name = input_message.get('result_queue')
 
     def get_queue_name(self):
@@ -0,0 +1,112 @@
+import logging
+
+from twisted.internet import reactor
+from scrapy.exceptions import IgnoreRequest
+
+from content_analytics import signals
+from content_analytics.middlewares.mergeitem import MergeItemMiddleware, MergeRequest
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_ATTRIBUTE_OPTIONAL = 'deadline_optional'
+
+
+class TaskDeadlineMiddleware(object):
+    """Downloader middleware which keeps every task within its time budget.
+
+    The budget comes from the `timeout` field of the task message, or from the `TASK_DEADLINE` setting,
+    which spiders can override in `custom_settings` (0 means no deadline). `TASK_DEADLINE_SHED_MARGIN`
+    seconds before the deadline optional requests are ignored: merge subrequests (e.g. reviews), which
+    leave their items without the data, and requests with `deadline_optional` meta set. Download timeouts
+    never exceed the deadline. At the deadline partial items are emitted and the spider is closed
+    with `deadline` reason.
+    """
+    STATS_TIMEOUT = 'deadline/timeout'
+    STATS_SHED = 'deadline/shed'
+    STATS_EXPIRED = 'deadline/expired'
+    STATS_PARTIAL_ITEMS = 'deadline/partial_items'
+
+    CLOSE_REASON = 'deadline'
+    MIN_DOWNLOAD_TIMEOUT = 1
+
+    def __init__(self, crawler, timeout, shed_margin, clock=None):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.timeout = timeout
+        self.shed_margin = shed_margin
+        self.clock = clock or reactor
+        self.deadline = None
+        self.shed_at = None
+        self.delayed_call = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(
+            crawler,
+            timeout=crawler.settings.getfloat('TASK_DEADLINE', 0),
+            shed_margin=crawler.settings.getfloat('TASK_DEADLINE_SHED_MARGIN', 30)
+        )
+        signals.connect_task_signals(crawler, opened=middleware.task_opened, closed=middleware.task_closed)
+        return middleware
+
+    def get_timeout(self, spider):
+        message = getattr(spider, 'message', None)
+        if message and hasattr(message, 'get_timeout'):
+            return message.get_timeout() or self.timeout
+        return self.timeout
+
+    def task_opened(self, spider):
+        self._cancel()
+        timeout = self.get_timeout(spider)
+        if not timeout:
+            self.deadline = self.shed_at = None
+            return
+        now = self.clock.seconds()
+        self.deadline = now + timeout
+        self.shed_at = self.deadline - min(self.shed_margin, timeout / 2.0)
+        self.delayed_call = self.clock.callLater(timeout, self.expire, spider)
+        self.stats.set_value(self.STATS_TIMEOUT, timeout)
+
+    def task_closed(self, spider):
+        self._cancel()
+        self.deadline = self.shed_at = None
+
+    def is_optional(self, request):
+        optional = request.meta.get(DEADLINE_ATTRIBUTE_OPTIONAL)
+        if optional is not None:
+            return optional
+        return isinstance(request, MergeRequest) and not request.meta.get(MergeItemMiddleware.INITIAL_ATTRIBUTE)
+
+    def process_request(self, request, spider):
+        if self.deadline is None:
+            return
+        now = self.clock.seconds()
+        if now >= self.shed_at and self.is_optional(request):
+            self.stats.inc_value(self.STATS_SHED)
+            raise IgnoreRequest('Task deadline is in {:.1f} seconds'.format(self.deadline - now))
+        remaining = max(self.deadline - now, self.MIN_DOWNLOAD_TIMEOUT)
+        download_timeout = request.meta.get('download_timeout')
+        if download_timeout is None or download_timeout > remaining:
+            request.meta['download_timeout'] = remaining
+
+    def expire(self, spider):
+        self.delayed_call = None
+        self.stats.inc_value(self.STATS_EXPIRED)
+        logger.warning('Task deadline of spider {} is reached, closing it'.format(spider.name))
+        engine = self.crawler.engine
+        for item in self.pop_partial_items():
+            self.stats.inc_value(self.STATS_PARTIAL_ITEMS)
+            # Same way as items yielded by callbacks, so pipelines and signals get them
+            engine.scraper._process_spidermw_output(item, None, None, spider)  # pylint: disable=protected-access
+        engine.close_spider(spider, reason=self.CLOSE_REASON)
+
+    def pop_partial_items(self):
+        for middleware in self.crawler.engine.scraper.spidermw.middlewares:
+            if isinstance(middleware, MergeItemMiddleware):
+                return middleware.pop_items()
+        return []
+
+    def _cancel(self):
+        if self.delayed_call is not None and self.delayed_call.active():
+            self.delayed_call.cancel()
+        self.delayed_call = None
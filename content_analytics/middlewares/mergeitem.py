@@ -97,7 +97,7 @@ class MergeItemMiddleware(object):
         logger.debug('{} called from crawler'.format(cls.__class__.__name__))
 
         middleware = cls()
-        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        signals.connect_task_signals(crawler, closed=middleware.spider_closed)
         return middleware
 
     def spider_closed(self, spider, reason):
@@ -108,6 +108,8 @@ class MergeItemMiddleware(object):
             spider.logger.warning(
                 'Spider stopped before finish! Some data left in memory {}: '.format(repr(self.memorized))
             )
+        # Pooled crawlers keep the middleware for the next task
+        self.memorized.clear()
 
     def process_spider_output(self, response, result, spider):
         logger.debug('Processing output response {}'.format(response))
@@ -122,6 +124,11 @@ class MergeItemMiddleware(object):
             if not guid:
                 logger.error('Item {} GUID is not presented in output response {}!'.format(item, response))
 
+            if guid not in self.memorized:
+                # Partial item has been emitted already, see `pop_items`
+                logger.debug('Dropping output of response {} for emitted item with GUID {}'.format(response, guid))
+                return
+
             self.__process_response(response)
             for r in arg_to_iter(result):
                 if isinstance(r, MergeRequest):
@@ -149,6 +156,12 @@ class MergeItemMiddleware(object):
                 else:
                     yield r
 
+    def pop_items(self):
+        """Returns partial items which still wait for their requests and forgets them."""
+        items = [memo['item'] for memo in self.memorized.values()]
+        self.memorized.clear()
+        return items
+
     def process_spider_exception(self, response, exception, spider):
         logger.warning('Processing exception {}'.format(exception))
         if isinstance(response.request, MergeRequest) and isinstance(exception, HttpError):
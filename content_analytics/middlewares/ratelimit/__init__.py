@@ -0,0 +1,390 @@
+import time
+import logging
+import threading
+
+from collections import deque
+
+from twisted.internet import defer, reactor, threads
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+
+from content_analytics import signals
+from content_analytics.stats import StatsMixin
+
+DOMAIN_LIMITER_ATTRIBUTE_SLOT = '_domain_limiter_slot'
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Token bucket refilled with `rate` tokens per second up to `burst` tokens, rate 0 means unlimited."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = now
+
+    def configure(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = min(self.tokens, self.burst)
+
+    def take(self, now):
+        """Takes a token and returns 0, or returns seconds to wait for the next token."""
+        if not self.rate:
+            return 0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class BaseTokenStore(object):
+    """Shared token buckets of all runner nodes, see `LeasedTokenBucket`."""
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls()
+
+    def lease(self, key, rate, burst, count, now):
+        """Takes up to `count` tokens from the shared bucket and returns the number of taken tokens."""
+        raise NotImplementedError
+
+    @staticmethod
+    def refill(tokens, updated, rate, burst, count, now):
+        """Returns tokens left in the bucket and the number of leased tokens."""
+        if tokens is None:
+            tokens = burst
+        else:
+            tokens = min(burst, tokens + max(now - updated, 0) * rate)
+        granted = min(count, int(tokens))
+        return tokens - granted, granted
+
+
+class LocalTokenStore(BaseTokenStore):
+    """Single-node stand-in for the shared token store, used in tests and local runs."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def lease(self, key, rate, burst, count, now):
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (None, None))
+            tokens, granted = self.refill(tokens, updated, rate, burst, count, now)
+            self.buckets[key] = (tokens, now)
+            return granted
+
+
+class LeasedTokenBucket(StatsMixin):
+    """Local part of a token bucket shared by all runner nodes.
+
+    Tokens are leased from the shared store in batches of up to `lease_size` tokens (but not more
+    than `rate * lease_ttl`), so there is no round trip per request. Leased tokens which are not
+    used during `lease_ttl` seconds are dropped, so idle nodes do not hoard the budget. The next
+    lease is requested in the background as soon as the local tokens run out, `on_refill` is called
+    once it is done. If the store is not available the bucket falls back to a local token bucket.
+    """
+    LEASE_WAIT = 1.0
+    FAILURE_RETRY_DELAY = 10
+
+    STATS_LEASES = 'domain_limiter/leases'
+    STATS_LEASED_TOKENS = 'domain_limiter/leased_tokens'
+    STATS_LEASES_DENIED = 'domain_limiter/leases_denied'
+    STATS_LEASE_ERRORS = 'domain_limiter/lease_errors'
+    STATS_EXPIRED_TOKENS = 'domain_limiter/expired_tokens'
+
+    def __init__(self, store, key, rate, burst, lease_size, lease_ttl, now, on_refill=None, stats=None,
+                 clock=None, executor=None):
+        self.store = store
+        self.key = key
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.on_refill = on_refill
+        self.stats = stats
+        self.clock = clock or reactor
+        self.executor = executor or threads.deferToThread
+        self.tokens = 0
+        self.expires = 0
+        self.leasing = None
+        self.retry_at = 0
+        self.fallback = None
+        self.fallback_until = 0
+        self.fallback_bucket = TokenBucket(rate, burst, now)
+
+    def configure(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.fallback_bucket.configure(rate, burst)
+
+    def take(self, now):
+        if not self.rate:
+            return 0
+        if now < self.fallback_until:
+            return self.fallback_bucket.take(now)
+        if self.tokens and now >= self.expires:
+            self._inc_stats(self.STATS_EXPIRED_TOKENS, self.tokens)
+            self.tokens = 0
+        if self.tokens < 1:
+            self.lease(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            if self.tokens < 1:
+                self.lease(now)
+            return 0
+        if self.leasing is not None:
+            # `on_refill` wakes the waiters up earlier once the lease is done
+            return self.LEASE_WAIT
+        return max(self.retry_at - now, 0.001)
+
+    def get_lease_count(self):
+        return int(max(1, min(self.lease_size, self.burst, self.rate * self.lease_ttl)))
+
+    def lease(self, now):
+        if self.leasing is not None or now < self.retry_at:
+            return
+        count = self.get_lease_count()
+        self.leasing = self.executor(self.store.lease, self.key, self.rate, self.burst, count, time.time())
+        self.leasing.addCallbacks(self._leased, self._lease_failed)
+
+    def _leased(self, granted):
+        self.leasing = None
+        now = self.clock.seconds()
+        self._inc_stats(self.STATS_LEASES)
+        if granted:
+            self._inc_stats(self.STATS_LEASED_TOKENS, granted)
+            self.tokens += granted
+            self.expires = now + self.lease_ttl
+        else:
+            # Budget of all nodes is spent, the next token appears in the shared bucket not earlier than that
+            self._inc_stats(self.STATS_LEASES_DENIED)
+            self.retry_at = now + 1 / self.rate
+        self._refilled()
+
+    def _lease_failed(self, failure):
+        self.leasing = None
+        self._inc_stats(self.STATS_LEASE_ERRORS)
+        logger.error('Error while leasing tokens for {}, falling back to local limits: {}'.format(
+            self.key,
+            failure.getErrorMessage()
+        ))
+        self.fallback_until = self.retry_at = self.clock.seconds() + self.FAILURE_RETRY_DELAY
+        self._refilled()
+
+    def _refilled(self):
+        if self.on_refill is not None:
+            self.on_refill()
+
+
+class DomainSlot(object):
+    def __init__(self, domain, bucket, concurrency):
+        self.domain = domain
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.active = 0
+        # (deferred, time of acquiring)
+        self.waiters = deque()
+        self.delayed_call = None
+
+
+class DomainLimiter(StatsMixin):
+    """Process-wide per-domain concurrency and rate limiter shared by all crawlers of the runner.
+
+    Requests to the same domain from different crawlers wait in a single FIFO queue. A request is
+    admitted once less than `concurrency` requests to the domain are in flight and the domain token
+    bucket has a token.
+
+    With a `store` domain token buckets are shared by all runner nodes (see `LeasedTokenBucket`),
+    concurrency is still limited per node.
+    """
+    DEFAULT_LEASE_SIZE = 10
+    DEFAULT_LEASE_TTL = 1.0
+
+    STATS_ACQUIRED = 'domain_limiter/acquired'
+    STATS_DELAYED = 'domain_limiter/delayed'
+    STATS_WAIT_TIME = 'domain_limiter/wait_time'
+
+    def __init__(self, stats=None, clock=None, store=None, lease_size=DEFAULT_LEASE_SIZE,
+                 lease_ttl=DEFAULT_LEASE_TTL):
+        self.stats = stats
+        self.clock = clock or reactor
+        self.store = store
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.slots = {}
+
+    def get_slot(self, domain, rate, burst, concurrency):
+        slot = self.slots.get(domain)
+        if slot is None:
+            slot = self.slots[domain] = DomainSlot(domain, self.create_bucket(domain, rate, burst), concurrency)
+        elif slot.concurrency != concurrency or slot.bucket.rate != rate or slot.bucket.burst != burst:
+            # The latest spider settings win if several spiders crawl the same domain
+            slot.concurrency = concurrency
+            slot.bucket.configure(rate, burst)
+        return slot
+
+    def create_bucket(self, domain, rate, burst):
+        if self.store is None:
+            return TokenBucket(rate, burst, self.clock.seconds())
+        return LeasedTokenBucket(
+            store=self.store,
+            key=domain,
+            rate=rate,
+            burst=burst,
+            lease_size=self.lease_size,
+            lease_ttl=self.lease_ttl,
+            now=self.clock.seconds(),
+            on_refill=lambda: self.wake(domain),
+            stats=self.stats,
+            clock=self.clock
+        )
+
+    def acquire(self, domain, rate=0, burst=1, concurrency=8):
+        """Returns `Deferred` fired with the number of seconds spent waiting once request can be sent."""
+        slot = self.get_slot(domain, rate, burst, concurrency)
+        waiter = defer.Deferred()
+        now = self.clock.seconds()
+        slot.waiters.append((waiter, now))
+        self._process(slot, now)
+        return waiter
+
+    def release(self, domain):
+        slot = self.slots.get(domain)
+        if slot is None or slot.active <= 0:
+            return
+        slot.active -= 1
+        self._process(slot)
+
+    def wake(self, domain):
+        """Processes waiters of the domain right away, e.g. once tokens are leased."""
+        slot = self.slots.get(domain)
+        if slot is None:
+            return
+        if slot.delayed_call is not None and slot.delayed_call.active():
+            slot.delayed_call.cancel()
+        slot.delayed_call = None
+        self._process(slot)
+
+    def discard(self, waiter):
+        """Forgets request which is not going to be sent, e.g. because its spider has been closed."""
+        for slot in self.slots.values():
+            for entry in slot.waiters:
+                if entry[0] is waiter:
+                    slot.waiters.remove(entry)
+                    return
+
+    def _process(self, slot, now=None):
+        if slot.delayed_call is not None:
+            return
+        if now is None:
+            now = self.clock.seconds()
+        while slot.waiters and slot.active < slot.concurrency:
+            delay = slot.bucket.take(now)
+            if delay > 0:
+                slot.delayed_call = self.clock.callLater(delay, self._delayed, slot)
+                return
+            waiter, started = slot.waiters.popleft()
+            slot.active += 1
+            wait_time = now - started
+            self._inc_stats(self.STATS_ACQUIRED)
+            if wait_time > 0:
+                self._inc_stats(self.STATS_DELAYED)
+                self._observe(self.STATS_WAIT_TIME, wait_time)
+            waiter.callback(wait_time)
+
+    def _delayed(self, slot):
+        slot.delayed_call = None
+        self._process(slot)
+
+
+class DomainLimiterMiddleware(object):
+    """Downloader middleware which sends requests through the process-wide `DomainLimiter`.
+
+    Limits are configured with `DOMAIN_LIMITER_CONCURRENCY`, `DOMAIN_LIMITER_RATE` (requests per second,
+    0 means unlimited) and `DOMAIN_LIMITER_BURST` settings, which can be overridden in spider
+    `custom_settings`. Crawlers started by the runner share its limiter, otherwise every crawler has its own.
+    Per-site budgets from `DOMAIN_LIMITER_BUDGETS` (`{"walmart": {"rate": 5, "burst": 10, "concurrency": 4}}`,
+    loaded by the runner from the settings bucket) take precedence over the settings.
+    """
+    STATS_DELAYED = 'domain_limiter/delayed'
+    STATS_WAIT_TIME = 'domain_limiter/wait_time'
+
+    def __init__(self, limiter, stats, concurrency, rate, burst):
+        self.limiter = limiter
+        self.stats = stats
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.waiters = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DOMAIN_LIMITER_ENABLED', False):
+            raise NotConfigured
+        budget = settings.getdict('DOMAIN_LIMITER_BUDGETS').get(cls.get_site(crawler.spider), {})
+        rate = float(budget.get('rate', settings.getfloat('DOMAIN_LIMITER_RATE', 0)))
+        limiter = getattr(crawler, 'domain_limiter', None) or DomainLimiter()
+        middleware = cls(
+            limiter=limiter,
+            stats=crawler.stats,
+            concurrency=int(budget.get('concurrency', settings.getint('DOMAIN_LIMITER_CONCURRENCY', 8))),
+            rate=rate,
+            burst=int(budget.get('burst', settings.getint('DOMAIN_LIMITER_BURST', 0))) or max(int(rate), 1)
+        )
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    @staticmethod
+    def get_site(spider):
+        name = getattr(spider, 'name', None) or ''
+        try:
+            return name[:name.rindex('_products')]
+        except ValueError:
+            return name
+
+    @staticmethod
+    def get_domain(request):
+        return request.meta.get('download_slot') or urlparse_cached(request).hostname or ''
+
+    def process_request(self, request, spider):
+        if DOMAIN_LIMITER_ATTRIBUTE_SLOT in request.meta:
+            return
+        domain = self.get_domain(request)
+        waiter = self.limiter.acquire(domain, self.rate, self.burst, self.concurrency)
+        if waiter.called:
+            request.meta[DOMAIN_LIMITER_ATTRIBUTE_SLOT] = domain
+            return
+
+        self.waiters.add(waiter)
+
+        def acquired(wait_time):
+            self.waiters.discard(waiter)
+            request.meta[DOMAIN_LIMITER_ATTRIBUTE_SLOT] = domain
+            self.stats.inc_value(self.STATS_DELAYED)
+            self.stats.inc_value(self.STATS_WAIT_TIME, round(wait_time, 3))
+            logger.debug('Request {} waited {:.3f} seconds for domain {}'.format(request, wait_time, domain))
+
+        return waiter.addCallback(acquired)
+
+    def process_response(self, request, response, spider):
+        self._release(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._release(request)
+
+    def spider_closed(self, spider):
+        for waiter in self.waiters:
+            self.limiter.discard(waiter)
+        self.waiters.clear()
+
+    def _release(self, request):
+        domain = request.meta.pop(DOMAIN_LIMITER_ATTRIBUTE_SLOT, None)
+        if domain is not None:
+            self.limiter.release(domain)
@@ -0,0 +1,80 @@
+import os
+import six
+import logging
+import aerospike
+
+from aerospike import exception  # pylint: disable=E0611
+
+from . import BaseTokenStore
+
+logger = logging.getLogger(__name__)
+
+
+class AerospikeTokenStore(BaseTokenStore):
+    """Token buckets shared by all runner nodes, stored in the Aerospike cluster of the cache.
+
+    Every bucket is a record with `tokens` and `updated` bins. Leases are compare-and-set writes
+    on the record generation, so concurrent leases of different nodes never grant the same tokens.
+    """
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, hosts, namespace, set_, ttl, username=None, password=None, policies=None):
+        self.namespace = namespace
+        self.set_ = set_
+        self.ttl = ttl
+        self.username = username
+        self.password = password
+        self.client = aerospike.client({
+            'hosts': hosts,
+            'policies': policies or {},
+            'use_shared_connection': True
+        })
+
+    @classmethod
+    def from_settings(cls, settings):
+        hosts = os.environ.get('CACHE_HOSTS') or settings.get('CACHE_HOSTS')
+        assert isinstance(hosts, six.string_types)
+        try:
+            hosts = [
+                (host.split(':')[0], int(host.split(':')[1]))
+                for host in hosts.split(',')
+            ]
+        except:
+            raise AssertionError('CACHE_URI should be in format "host1:3001,host2:3002"')
+        return cls(
+            hosts=hosts,
+            namespace=settings.get('CACHE_NAMESPACE'),
+            set_=settings.get('DOMAIN_LIMITER_SET', 'rate_limits'),
+            ttl=settings.getint('DOMAIN_LIMITER_RECORD_TTL', 3600),
+            username=settings.get('CACHE_USERNAME'),
+            password=settings.get('CACHE_PASSWORD'),
+            policies=settings.get('CACHE_DEFAULT_POLICIES')
+        )
+
+    def open(self):
+        if not self.client.is_connected():
+            self.client.connect(self.username, self.password)
+
+    def lease(self, key, rate, burst, count, now):
+        self.open()
+        record_key = (self.namespace, self.set_, key)
+        for _ in range(self.MAX_ATTEMPTS):
+            try:
+                _, meta, bins = self.client.get(record_key)
+            except exception.RecordNotFound:
+                meta, bins = None, {}
+            tokens, granted = self.refill(bins.get('tokens'), bins.get('updated'), rate, burst, count, now)
+            if meta is None:
+                write_meta = {'ttl': self.ttl}
+                policy = {'exists': aerospike.POLICY_EXISTS_CREATE}
+            else:
+                write_meta = {'ttl': self.ttl, 'gen': meta['gen']}
+                policy = {'gen': aerospike.POLICY_GEN_EQ}
+            try:
+                self.client.put(record_key, {'tokens': tokens, 'updated': now}, meta=write_meta, policy=policy)
+            except (exception.RecordGenerationError, exception.RecordExistsError):
+                logger.debug('Concurrent lease of tokens for {}, retrying'.format(key))
+                continue
+            return granted
+        logger.warning('Could not lease tokens for {} after {} attempts'.format(key, self.MAX_ATTEMPTS))
+        return 0
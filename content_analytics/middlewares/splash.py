@@ -4,7 +4,6 @@ import json
 
 from scrapy.downloadermiddlewares.retry import RetryMiddleware
 from io import BytesIO
-from PIL import Image
 
 from scrapy.utils.request import request_fingerprint
 from scrapy.http.request import Request
@@ -24,6 +23,9 @@ def get_splash_args(request):
 
 def crop_image(image, height, width, left, top):
     if height and width:
+        # Heavy, loaded on first use instead of the runner startup
+        from PIL import Image
+
         width = int(width)
         height = int(height)
 
@@ -1,90 +1,137 @@
-import boto3
 import logging
 
 from uuid import uuid4
 from datetime import datetime
-from cStringIO import StringIO
+from collections import OrderedDict
 from os.path import join
 
-from boto3.s3.transfer import TransferConfig
 from scrapy.exceptions import NotConfigured
-from twisted.internet import threads
+from twisted.internet import defer
 
 from content_analytics import signals
-from content_analytics.utils import aws_from_settings
+from content_analytics.compression import EncodedKey, get_compression
 from content_analytics.exporters import CompatibleJsonLinesItemExporter
+from content_analytics.segments import SegmentWriter
+from content_analytics.uploader import MultipartOutput, S3Uploader
 
 logger = logging.getLogger(__name__)
 
 
 class S3ExportPipeline(object):
     BUCKET_KEY_FORMAT = 'output/{}/{}.jl'
+    BATCH_URL_FAILURE_TYPE = 'No product scraped'
+    CONTENT_TYPE = 'application/x-ndjson'
 
-    s3 = None
     file = None
-    bucket = None
+    uploader = None
+    segments = None
+    compression = None
     settings = None
 
-    def __init__(self, stats, settings):
+    def __init__(self, stats, settings, uploader=None, segments=None):
         self.file = None
         self.filename = None
         self.bucket_name = None
         self.exporter = None
+        self.url_results = None
         self.stats = stats
         self.settings = settings
+        self.uploader = uploader
+        self.segments = segments
 
     @classmethod
     def from_crawler(cls, crawler):
-        pipeline = cls(crawler.stats, crawler.settings)
-        crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
-        crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
+        # Runner shares its uploader and segments with all crawlers, see `Runner.connect_crawler_signals`
+        pipeline = cls(
+            crawler.stats,
+            crawler.settings,
+            uploader=getattr(crawler, 's3_uploader', None),
+            segments=getattr(crawler, 's3_segments', None)
+        )
+        signals.connect_task_signals(crawler, opened=pipeline.spider_opened, closed=pipeline.spider_closed)
         return pipeline
 
-    def setup_bucket(self):
-        aws_settings = aws_from_settings(self.settings, prefix='OUTPUT_BUCKET_')
-        if aws_settings is None or not all(aws_settings.values()):
-            aws_settings = aws_from_settings(self.settings, prefix='INPUT_QUEUE_')
-
+    def setup_uploader(self):
         self.bucket_name = self.settings.get('OUTPUT_BUCKET_NAME')
         if not self.bucket_name:
             raise NotConfigured('S3 bucket export name must be set.')
-
-        self.s3 = boto3.resource('s3', **aws_settings)
-        self.bucket = self.s3.Bucket(self.bucket_name)
+        if self.uploader is None:
+            self.uploader = S3Uploader.from_settings(self.settings, stats=self.stats)
+        if self.segments is None and self.settings.getbool('S3_SEGMENTS_ENABLED'):
+            self.segments = SegmentWriter.from_settings(self.settings, self.uploader, stats=self.stats)
+        self.compression = get_compression(self.settings.get('S3_OUTPUT_COMPRESSION'),
+                                           self.settings.getint('S3_OUTPUT_COMPRESSION_LEVEL') or None)
+
+    def get_compression(self, message):
+        """Compression requested by the message or the default one, raises ValueError for unknown one."""
+        name = message.get_output_compression() if message is not None else None
+        if name is None:
+            return self.compression
+        try:
+            return get_compression(name, self.settings.getint('S3_OUTPUT_COMPRESSION_LEVEL') or None)
+        except ImportError as e:
+            raise ValueError('Output compression {} is not available: {}'.format(name, e))
 
     def spider_opened(self, spider):
         def generate_key():
             return self.BUCKET_KEY_FORMAT.format(datetime.utcnow().strftime('%Y/%m/%d'), uuid4())
 
-        self.setup_bucket()
-        self.file = StringIO()
+        if self.bucket_name is None:
+            self.setup_uploader()
         self.filename = generate_key()
+        try:
+            compression = self.get_compression(getattr(spider, '_message', None))
+        except ValueError:
+            # Task fails once it is closed, see `spider_closed`
+            compression = None
+        # Outputs appended to segments are compressed when they are stored
+        self.file = MultipartOutput.from_settings(self.settings, self.uploader, self.bucket_name, self.filename,
+                                                  stream=self.segments is None, content_type=self.CONTENT_TYPE,
+                                                  compression=compression if self.segments is None else None)
 
         # TODO: temporary fix related to CON-37613
-        setattr(spider, 's3_filepath', join(self.bucket_name, self.filename))
+        # Segment of the output is known only once it is uploaded, see `bucket_uploaded` signal
+        setattr(spider, 's3_filepath', join(self.bucket_name, self.filename) if self.segments is None else None)
 
         self.exporter = CompatibleJsonLinesItemExporter(self.file)
         self.exporter.start_exporting()
 
+        # Batch task gets a status for every url, see `process_item`
+        urls = getattr(spider, 'product_urls', None)
+        self.url_results = OrderedDict((url, None) for url in urls) if urls else None
+
     def spider_closed(self, spider, sender, *args, **kwargs):
+        # Pooled crawlers open the next task while this one is still uploading,
+        # so everything related to the task is bound here
+        output_file, filename, exporter = self.file, self.filename, self.exporter
+        message = kwargs.get('message') or spider._message
+        if self.url_results is not None:
+            self.finish_url_results(message)
+
         def store():
-            if not self.file.tell():
-                raise Exception('Item was scraped, but it is empty')
-            logger.debug('Storing results to {}'.format(self.filename))
-            self.file.seek(0)
-            self.bucket.upload_fileobj(
-                Fileobj=self.file,
-                Key=self.filename,
-                Config=TransferConfig(
-                    use_threads=False
-                )
-            )
-            return self.filename
+            if not output_file.size:
+                return defer.fail(Exception('Item was scraped, but it is empty'))
+            try:
+                compression = self.get_compression(message)
+            except ValueError as e:
+                return defer.fail(e)
+            if self.segments is not None:
+                logger.debug('Appending results to S3 segment')
+                if compression is None:
+                    return self.segments.append(output_file.getvalue())
+                output_file.seek(0)
+                dt = self.uploader.compress(output_file, compression)
+                return dt.addCallback(self.segments.append, compression.content_encoding)
+            logger.debug('Storing results to {}'.format(filename))
+            dt = output_file.finish()
+            if output_file.content_encoding is not None:
+                dt.addCallback(EncodedKey, output_file.content_encoding)
+            return dt
 
         def callback(filename, sender, **kwargs):
             logger.debug('Results were stored to {}'.format(filename))
-            self.file.close()
-            self.exporter.finish_exporting()
+            output_file.close()
+            exporter.finish_exporting()
             return sender.signals.send_catch_log(
                 signal=signals.bucket_uploaded,
                 filename=filename,
@@ -93,32 +140,49 @@ class S3ExportPipeline(object):
 
         def errback(failure, sender, **kwargs):
             logger.error('Error while storing results {}'.format(failure))
-            self.file.close()
-            self.exporter.finish_exporting()
+            output_file.close()
+            exporter.finish_exporting()
             return sender.signals.send_catch_log(
                 signal=signals.bucket_failed,
                 failure=failure,
                 **kwargs
             )
 
-        if spider._message and self.stats.get_value('item_scraped_count'):
-            dt = threads.deferToThread(store)
+        if message and self.stats.get_value('item_scraped_count'):
+            dt = store()
             dt.addCallback(
                 callback,
                 sender=sender,
-                spider=spider
+                spider=spider,
+                message=message
             )
             dt.addErrback(
                 errback,
                 sender=sender,
-                spider=spider
+                spider=spider,
+                message=message
             )
             return dt
 
         logger.debug('Spider did not return items')
-        self.exporter.finish_exporting()
-        self.file.close()
+        exporter.finish_exporting()
+        output_file.close()
+
+    def finish_url_results(self, message):
+        results = []
+        for url, result in self.url_results.items():
+            if result is None:
+                # Url did not give any product, status line is exported instead
+                result = self.exporter.export_status(url, 'failure', self.BATCH_URL_FAILURE_TYPE)
+                self.stats.inc_value('batch/failed_urls')
+            results.append({'url': url, 'status': result['status'], 'failure_type': result['failure_type']})
+        self.url_results = None
+        if message is not None and self.stats.get_value('item_scraped_count'):
+            message.url_results = results
 
     def process_item(self, item, spider):
         itemdict = self.exporter.export_item(item)
+        url = item.get('batch_url')
+        if self.url_results is not None and self.url_results.get(url, False) is None:
+            self.url_results[url] = {'status': itemdict.get('status'), 'failure_type': itemdict.get('failure_type')}
         return itemdict
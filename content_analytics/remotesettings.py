@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import calendar
+import logging
+
+from botocore.exceptions import ClientError
+from twisted.internet import reactor, threads
+from twisted.internet.task import LoopingCall
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteSettings(StatsMixin):
+    """JSON settings document in S3 which is refreshed in the background.
+
+    Refreshes are conditional GETs with the ETag of the current version, so unchanged documents are
+    not downloaded. `apply` is called with every new version in the reactor thread, so crawlers
+    created afterwards see the whole new version and running ones keep the old one. Every version
+    is saved to `cache_dir`, a restarted runner starts from the saved copy if S3 is not available.
+    """
+    DEFAULT_INTERVAL = 60
+
+    def __init__(self, name, client, bucket_name, key, apply, cache_dir=None, interval=DEFAULT_INTERVAL,
+                 stats=None, clock=None, executor=None):
+        self.name = name
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.apply = apply
+        self.cache_dir = cache_dir
+        self.interval = interval
+        self.stats = stats
+        self.stats_prefix = 'settings/{}'.format(name)
+        self.clock = clock or reactor
+        self.executor = executor or threads.deferToThread
+        self.etag = None
+        self.version = None
+        self.modified = None
+        self.refreshing = None
+        self.looping_call = None
+
+    @property
+    def cache_path(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, '{}_{}'.format(self.bucket_name, self.key.replace('/', '_')))
+
+    def load(self):
+        """Applies the current version synchronously, the saved copy is used if S3 is not available."""
+        try:
+            document = self.fetch()
+        except Exception as e:
+            document = self.read_copy()
+            if document is None:
+                raise
+            logger.warning('Can not fetch {} settings from S3 bucket {}, using saved copy {}: {}'.format(
+                self.name, self.bucket_name, document.get('etag'), e
+            ))
+            self._inc_stats('errors')
+            self._update(document, save=False)
+        else:
+            self._update(document)
+
+    def start(self):
+        if self.interval > 0 and self.looping_call is None:
+            self.looping_call = LoopingCall(self.refresh)
+            self.looping_call.clock = self.clock
+            self.looping_call.start(self.interval, now=False)
+
+    def stop(self):
+        if self.looping_call is not None and self.looping_call.running:
+            self.looping_call.stop()
+        self.looping_call = None
+
+    def refresh(self):
+        if self.refreshing is not None:
+            return self.refreshing
+        dt = self.refreshing = self.executor(self.fetch, self.etag)
+        dt.addCallback(self._refreshed)
+        dt.addErrback(self._refresh_failed)
+        dt.addBoth(self._refresh_finished)
+        return dt
+
+    def fetch(self, etag=None):
+        """Returns the document with settings and its metadata, None if its ETag is still `etag`."""
+        kwargs = {'Bucket': self.bucket_name, 'Key': self.key}
+        if etag:
+            kwargs['IfNoneMatch'] = etag
+        try:
+            response = self.client.get_object(**kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                return None
+            raise
+        modified = response.get('LastModified')
+        return {
+            'etag': response.get('ETag'),
+            'version': response.get('VersionId') or response.get('ETag', '').strip('"'),
+            'modified': calendar.timegm(modified.utctimetuple()) if modified else None,
+            'config': json.loads(response['Body'].read())
+        }
+
+    def read_copy(self):
+        path = self.cache_path
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            logger.error('Can not read saved copy of {} settings: {}'.format(self.name, e))
+            return None
+
+    def save_copy(self, document):
+        path = self.cache_path
+        if not path:
+            return
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # Written next to the copy and renamed, so a crash never leaves a partial file
+            temp_path = '{}.tmp'.format(path)
+            with open(temp_path, 'w') as f:
+                json.dump(document, f)
+            os.rename(temp_path, path)
+        except (IOError, OSError) as e:
+            logger.error('Can not save copy of {} settings: {}'.format(self.name, e))
+
+    def get_age(self):
+        if self.modified is None:
+            return None
+        return max(int(time.time() - self.modified), 0)
+
+    def _update(self, document, save=True):
+        self.apply(document['config'])
+        self.etag = document.get('etag')
+        self.version = document.get('version')
+        self.modified = document.get('modified')
+        if save:
+            self.save_copy(document)
+        self._inc_stats('updates')
+        self._set_stats()
+        logger.info('{} settings are updated to version {}'.format(self.name.capitalize(), self.version))
+
+    def _refreshed(self, document):
+        if document is None:
+            self._inc_stats('not_modified')
+        else:
+            self._update(document)
+        self._set_stats()
+
+    def _refresh_failed(self, failure):
+        self._inc_stats('errors')
+        logger.error('Error while refreshing {} settings from S3 bucket {}: {}'.format(
+            self.name,
+            self.bucket_name,
+            failure.getErrorMessage()
+        ))
+
+    def _refresh_finished(self, _):
+        self.refreshing = None
+
+    def _set_stats(self):
+        if self.stats is not None:
+            self.stats.set_value(self._stats_key('version'), self.version)
+            self.stats.set_value(self._stats_key('age'), self.get_age())
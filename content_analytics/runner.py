@@ -1,19 +1,35 @@
 import os
 import six
 import json
-import boto3
 import logging
 
-from uuid import uuid4
-from cStringIO import StringIO
-
-from twisted.internet import threads, task, reactor
+from twisted.internet import defer, reactor
+from twisted.internet.task import LoopingCall
 
 from scrapy.crawler import CrawlerProcess
 from scrapy.exceptions import NotConfigured
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.misc import load_object
 from scrapy.utils.project import get_project_settings
 
 from content_analytics import signals
+from content_analytics.backends import QUEUE, BLOB, create_resource
+from content_analytics.coalescing import TaskCoalescer
+from content_analytics.concurrency import AdaptiveConcurrency
+from content_analytics.crawlerpool import CrawlerPool
+from content_analytics.downloader import SharedHTTPResources, SharedHTTP11DownloadHandler
+from content_analytics.memory import MemoryWatchdog
+from content_analytics.remotesettings import RemoteSettings
+from content_analytics.segments import SegmentWriter
+from content_analytics.middlewares.ratelimit import DomainLimiter
+from content_analytics.sqs import SQSExecutor
+from content_analytics.sqs.batcher import SendMessageBatcher, DeleteMessageBatcher
+from content_analytics.sqs.cache import QueueHandleCache
+from content_analytics.sqs.heartbeat import VisibilityHeartbeat
+from content_analytics.sqs.poller import InputQueue, PriorityPoller
+from content_analytics.supervisor import URGENT, SupervisedQueue
+from content_analytics.tasks import TaskRegistry
+from content_analytics.uploader import S3Uploader
 from content_analytics.utils import aws_from_settings
 from content_analytics.messages import MessageResolverMixin, BaseInputMessage
 
@@ -22,6 +38,8 @@ class Runner(CrawlerProcess, MessageResolverMixin):
     DEFAULT_MAX_TASKS = 10
     DEFAULT_VISIBILITY_TIMEOUT = 300
     DEFAULT_VISIBILITY_TIMEOUT_OFFSET = 10
+    DEFAULT_RECEIVE_RETRY_DELAY = 5
+    DEFAULT_STATS_INTERVAL = 60
     SPIDER_NAME_FORMAT = '{}_products'
 
     logger = logging.getLogger(__name__)
@@ -31,30 +49,76 @@ class Runner(CrawlerProcess, MessageResolverMixin):
     input_queue_timeout = None
     input_queue_timeout_offset = None
     input_queue_resource = None
+    input_queues = None
+    poller = None
 
     output_queue = None
     output_queue_name = None
     output_queue_resource = None
+    output_queues = None
+
+    sqs = None
+    stats = None
+    heartbeat = None
+    send_batcher = None
+    delete_batcher = None
+    receiving = None
+    receive_requested = False
+    crawler_pool = None
+    supervisor = None
+    concurrency = None
+    tasks = None
+    coalescer = None
+    domain_limiter = None
+    http_resources = None
+    s3_uploader = None
+    s3_segments = None
+    memory_watchdog = None
+    remote_settings = None
+    spider_names = None
+    # Set once the worker is over its memory limits, it takes no new tasks and exits after the current ones
+    recycling = False
 
     max_tasks = None
     grace_period = None
-    in_progress_messages = []
-    finished_messages = []
-    visibility_update_pool = {}
 
-    def __init__(self, settings=None):
+    def __init__(self, settings=None, supervisor=None):
         super(Runner, self).__init__(settings or get_project_settings())
+        self.supervisor = supervisor
         self.git_branch = os.environ.get('SCRAPERS_GIT_BRANCH')
         self.max_tasks = self.settings.getint('RUNNER_MAX_TASKS', self.DEFAULT_MAX_TASKS)
         self.logger.debug('Runner will process {} maximum tasks'.format(self.max_tasks))
+        self.stats = StatsCollector(self)
+        self.tasks = TaskRegistry(stats=self.stats)
+        self.remote_settings = []
+        # Spider loader lists spiders without importing them, the list does not change while running
+        self.spider_names = frozenset(self.spider_loader.list())
+        self.sqs = SQSExecutor(
+            reactor,
+            max_threads=self.settings.getint('RUNNER_SQS_THREADPOOL_MAXSIZE', SQSExecutor.DEFAULT_MAX_THREADS)
+        )
 
         if self.settings.get('RUNNER_SETTINGS_BUCKET_ENABLED', None):
             self.set_proxy_settings_from_bucket()
         if self.settings.get('RUNNER_CACHE_SETTINGS_BUCKET_ENABLED', None):
             self.set_cache_settings_from_bucket()
+        if self.settings.get('RUNNER_RATE_LIMITS_BUCKET_ENABLED', None):
+            self.set_rate_limits_from_bucket()
         self.setup_input_queue()
+        self.setup_visibility_heartbeat()
+        self.setup_poller()
         self.setup_output_queue()
+        self.setup_batchers()
+        self.setup_crawler_pool()
+        self.setup_concurrency()
+        self.setup_coalescing()
+        self.setup_domain_limiter()
+        self.setup_http_resources()
+        self.setup_memory_watchdog()
         self.check_output_bucket()
+        self.setup_s3_uploader()
+        self.setup_s3_segments()
+        self.setup_stats_logging()
 
         self.process_input_queue()
         self.start(stop_after_crawl=False)
@@ -66,7 +130,7 @@ class Runner(CrawlerProcess, MessageResolverMixin):
         input_queue_settings = aws_from_settings(self.settings, prefix='INPUT_QUEUE_')
         if input_queue_settings is None or not all(input_queue_settings.values()):
             raise NotConfigured('AWS region, key and secret are required for input SQS queue!')
-        self.input_queue_resource = boto3.resource('sqs', **input_queue_settings)
+        self.input_queue_resource = create_resource(self.settings, QUEUE, input_queue_settings)
 
         # Setting up input SQS queue
         self.input_queue_name = self.settings.get('INPUT_QUEUE_NAME', None)
@@ -74,6 +138,10 @@ class Runner(CrawlerProcess, MessageResolverMixin):
             raise NotConfigured('SQS input queue name must be set!')
         self.logger.debug('Input SQS queue name is {}'.format(self.input_queue_name))
         self.input_queue = self.input_queue_resource.get_queue_by_name(QueueName=self.input_queue_name)
+        if self.supervisor is not None:
+            # Messages are received by the supervisor process and handed over to this worker
+            self.input_queue = SupervisedQueue(self.input_queue, self.supervisor)
+            self.logger.debug('Input SQS messages will be received from supervisor')
 
         # Setting up input SQS queue visibility timeout
         self.input_queue_timeout = int(self.input_queue.attributes.get(
@@ -91,6 +159,216 @@ class Runner(CrawlerProcess, MessageResolverMixin):
             'Input SQS queue visibility timeout offset is {} seconds'.format(self.input_queue_timeout_offset)
         )
 
+        self.input_queues = [InputQueue(
+            name=self.input_queue_name,
+            queue=self.input_queue,
+            weight=self.settings.getint('INPUT_QUEUE_WEIGHT', 1),
+            visibility_timeout=self.input_queue_timeout
+        )]
+
+        # Setting up urgent input SQS queue, its tasks are admitted before normal ones
+        urgent_queue_name = self.settings.get('INPUT_QUEUE_URGENT_NAME', None)
+        if urgent_queue_name:
+            urgent_queue = self.input_queue_resource.get_queue_by_name(QueueName=urgent_queue_name)
+            if self.supervisor is not None:
+                urgent_queue = SupervisedQueue(urgent_queue, self.supervisor, URGENT)
+            self.input_queues.append(InputQueue(
+                name=urgent_queue_name,
+                queue=urgent_queue,
+                weight=self.settings.getint('INPUT_QUEUE_URGENT_WEIGHT', 1),
+                urgent=True,
+                visibility_timeout=int(urgent_queue.attributes.get('VisibilityTimeout', self.input_queue_timeout))
+            ))
+            self.logger.debug('Urgent input SQS queue name is {}'.format(urgent_queue_name))
+
+    def setup_visibility_heartbeat(self):
+        for input_queue in self.input_queues:
+            input_queue.heartbeat = VisibilityHeartbeat(
+                executor=self.sqs,
+                queue=input_queue.queue,
+                visibility_timeout=input_queue.visibility_timeout,
+                offset=self.input_queue_timeout_offset,
+                stats=self.stats
+            )
+            input_queue.heartbeat.start()
+        self.heartbeat = self.input_queues[0].heartbeat
+        self.logger.debug('Visibility heartbeat will renew messages every {} seconds in batches of {}'.format(
+            self.heartbeat.interval,
+            self.heartbeat.BATCH_SIZE
+        ))
+
+    def setup_poller(self):
+        self.poller = PriorityPoller(
+            executor=self.sqs,
+            queues=self.input_queues,
+            mode=self.settings.get('INPUT_QUEUE_PRIORITY', PriorityPoller.STRICT),
+            prefetch=self.settings.getint('INPUT_QUEUE_PREFETCH', PriorityPoller.DEFAULT_PREFETCH),
+            wait_time=self.settings.getint('INPUT_QUEUE_WAIT_TIME', PriorityPoller.DEFAULT_WAIT_TIME),
+            release_margin=self.settings.getint(
+                'INPUT_QUEUE_PREFETCH_RELEASE_MARGIN',
+                PriorityPoller.DEFAULT_RELEASE_MARGIN
+            ),
+            free_slots=lambda: self.max_tasks - self.tasks.in_progress,
+            stats=self.stats
+        )
+        self.poller.start()
+        # Prefetched messages which were not started are given back before the SQS thread pool stops
+        reactor.addSystemEventTrigger('before', 'shutdown', self.poller.stop)
+        self.logger.debug('Input SQS queues {} will be polled with {} priority'.format(
+            self.poller.queues,
+            self.poller.mode
+        ))
+
+    def setup_batchers(self):
+        linger = self.settings.getfloat('RUNNER_SQS_BATCH_LINGER', SendMessageBatcher.DEFAULT_LINGER)
+        max_retries = self.settings.getint('RUNNER_SQS_BATCH_RETRIES', SendMessageBatcher.DEFAULT_MAX_RETRIES)
+        self.send_batcher = SendMessageBatcher(self.sqs, linger=linger, max_retries=max_retries, stats=self.stats)
+        self.delete_batcher = DeleteMessageBatcher(self.sqs, linger=linger, max_retries=max_retries, stats=self.stats)
+        # Flush whatever is buffered before the SQS thread pool stops
+        reactor.addSystemEventTrigger('before', 'shutdown', self.flush_outputs)
+        self.logger.debug('Output messages and acknowledgements will be batched with {} seconds linger'.format(linger))
+
+    def flush_outputs(self):
+        """Uploads the last S3 segment, then sends output messages of its tasks, then acknowledges them.
+
+        Every step adds work to the next one: uploaded segment finishes its tasks, and tasks are
+        deleted once their output messages are sent.
+        """
+        dt = self.s3_segments.flush() if self.s3_segments is not None else defer.succeed(None)
+        dt.addErrback(lambda failure: None)
+        dt.addCallback(lambda _: self.send_batcher.flush_all())
+        dt.addCallback(lambda _: self.delete_batcher.flush_all())
+        return dt
+
+    def setup_crawler_pool(self):
+        if not self.settings.getbool('RUNNER_CRAWLER_POOL_ENABLED', False):
+            return
+        self.crawler_pool = CrawlerPool(
+            runner=self,
+            idle_timeout=self.settings.getint('RUNNER_CRAWLER_POOL_IDLE_TIMEOUT', CrawlerPool.DEFAULT_IDLE_TIMEOUT),
+            max_crawler_tasks=self.settings.getint(
+                'RUNNER_CRAWLER_POOL_MAX_CRAWLER_TASKS',
+                CrawlerPool.DEFAULT_MAX_CRAWLER_TASKS
+            ),
+            stats=self.stats
+        )
+        self.logger.info('Crawlers will be reused for many tasks')
+
+    def setup_concurrency(self):
+        self.stats.set_value(AdaptiveConcurrency.STATS_TARGET, self.max_tasks)
+        if not self.settings.getbool('RUNNER_ADAPTIVE_MAX_TASKS_ENABLED', False):
+            return
+        max_rss = self.settings.getint('RUNNER_ADAPTIVE_MAX_RSS_MB', 0)
+        self.concurrency = AdaptiveConcurrency(
+            initial=self.max_tasks,
+            floor=self.settings.getint('RUNNER_MAX_TASKS_FLOOR', 1),
+            ceiling=self.settings.getint('RUNNER_MAX_TASKS_CEILING', self.max_tasks),
+            load=lambda: self.tasks.in_progress,
+            interval=self.settings.getfloat('RUNNER_ADAPTIVE_INTERVAL', AdaptiveConcurrency.DEFAULT_INTERVAL),
+            max_reactor_lag=self.settings.getfloat(
+                'RUNNER_ADAPTIVE_MAX_REACTOR_LAG',
+                AdaptiveConcurrency.DEFAULT_MAX_REACTOR_LAG
+            ) or None,
+            max_rss=max_rss * 1024 * 1024 or None,
+            max_task_latency=self.settings.getfloat('RUNNER_ADAPTIVE_MAX_TASK_LATENCY', 0) or None,
+            max_error_rate=self.settings.getfloat(
+                'RUNNER_ADAPTIVE_MAX_ERROR_RATE',
+                AdaptiveConcurrency.DEFAULT_MAX_ERROR_RATE
+            ) or None,
+            on_change=self.set_max_tasks,
+            stats=self.stats
+        )
+        self.max_tasks = self.concurrency.target
+        self.concurrency.start()
+        self.logger.info('Maximum tasks will be adjusted between {} and {}'.format(
+            self.concurrency.floor,
+            self.concurrency.ceiling
+        ))
+
+    def setup_coalescing(self):
+        if not self.settings.getbool('RUNNER_COALESCING_ENABLED', False):
+            return
+        self.coalescer = TaskCoalescer(
+            result_ttl=self.settings.getint('RUNNER_COALESCING_RESULT_TTL', TaskCoalescer.DEFAULT_RESULT_TTL),
+            stats=self.stats
+        )
+        self.logger.info('Duplicate tasks will be coalesced, their results will be reused during {} seconds'.format(
+            self.coalescer.result_ttl
+        ))
+
+    def setup_domain_limiter(self):
+        # Shared by all crawlers, spiders may enable `DomainLimiterMiddleware` in their custom settings
+        store = None
+        if self.settings.getbool('DOMAIN_LIMITER_DISTRIBUTED', False):
+            store = load_object(self.settings.get('DOMAIN_LIMITER_STORE')).from_settings(self.settings)
+            self.logger.info('Domain rate limits are shared through {}'.format(type(store).__name__))
+        self.domain_limiter = DomainLimiter(
+            stats=self.stats,
+            store=store,
+            lease_size=self.settings.getint('DOMAIN_LIMITER_LEASE_SIZE', DomainLimiter.DEFAULT_LEASE_SIZE),
+            lease_ttl=self.settings.getfloat('DOMAIN_LIMITER_LEASE_TTL', DomainLimiter.DEFAULT_LEASE_TTL)
+        )
+        if self.settings.getbool('DOMAIN_LIMITER_ENABLED', False):
+            self.logger.info('Requests of all crawlers will be limited per domain')
+
+    def setup_http_resources(self):
+        if not self.settings.getbool('RUNNER_SHARED_HTTP_POOL_ENABLED', False):
+            return
+        # Picked up by `SharedHTTP11DownloadHandler` of every crawler
+        self.http_resources = SharedHTTPResources(self.settings, stats=self.stats)
+        SharedHTTP11DownloadHandler.install(self.http_resources)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.http_resources.close)
+        self.logger.info('HTTP connections and TLS sessions are shared by all crawlers, {} per host'.format(
+            self.http_resources.pool.maxPersistentPerHost
+        ))
+
+    def setup_memory_watchdog(self):
+        rss_limit = self.settings.getint('RUNNER_MEMORY_LIMIT_MB', 0) << 20
+        heap_limit = self.settings.getint('RUNNER_MEMORY_HEAP_LIMIT', 0)
+        if not rss_limit and not heap_limit:
+            return
+        self.memory_watchdog = MemoryWatchdog(
+            rss_limit=rss_limit,
+            heap_limit=heap_limit,
+            heap_interval=self.settings.getint('RUNNER_MEMORY_HEAP_INTERVAL', MemoryWatchdog.DEFAULT_HEAP_INTERVAL),
+            stats=self.stats
+        )
+        self.logger.info('Worker will be recycled once its memory is over the limits')
+
+    def check_memory(self):
+        if self.memory_watchdog is None or self.recycling:
+            return
+        reason = self.memory_watchdog.check()
+        if reason is not None:
+            self.recycle(reason)
+
+    def recycle(self, reason):
+        self.logger.warning('{}, worker stops taking tasks and exits after {} in-flight ones'.format(
+            reason,
+            len(self.tasks)
+        ))
+        self.recycling = True
+        self.stats.inc_value('runner/recycled')
+        # Prefetched messages are given back to the queue right away
+        self.poller.stop()
+        self.process_input_queue()
+
+    def set_max_tasks(self, max_tasks):
+        self.logger.debug('Runner will process {} maximum tasks'.format(max_tasks))
+        self.max_tasks = max_tasks
+        self.process_input_queue()
+
+    def setup_stats_logging(self):
+        interval = self.settings.getint('RUNNER_STATS_INTERVAL', self.DEFAULT_STATS_INTERVAL)
+        if interval > 0:
+            LoopingCall(self.log_stats).start(interval, now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.log_stats)
+
+    def log_stats(self):
+        self.logger.info('Runner stats: {}'.format(json.dumps(self.stats.get_stats(), sort_keys=True)))
+        if self.supervisor is not None:
+            self.supervisor.send_stats(self.stats.get_stats())
+
     def setup_output_queue(self):
         self.logger.info('Setting up output SQS queue')
 
@@ -99,7 +377,7 @@ class Runner(CrawlerProcess, MessageResolverMixin):
         if output_queue_settings is None or not all(output_queue_settings.values()):
             output_queue_settings = aws_from_settings(self.settings, prefix='INPUT_QUEUE_')
             self.logger.info('AWS region, key and secret for output SQS queue will be used same as input SQS queue')
-        self.output_queue_resource = boto3.resource('sqs', **output_queue_settings)
+        self.output_queue_resource = create_resource(self.settings, QUEUE, output_queue_settings)
 
         # Setting up output SQS queue
         self.output_queue_name = self.settings.get('OUTPUT_QUEUE_NAME', None)
@@ -111,6 +389,18 @@ class Runner(CrawlerProcess, MessageResolverMixin):
                 'Output SQS queue name is not provided. '
                 'Will be used output SQS queue name from input message'
             )
+            self.output_queues = QueueHandleCache(
+                executor=self.sqs,
+                resolve=self.create_output_queue,
+                ttl=self.settings.getint('OUTPUT_QUEUE_CACHE_TTL', QueueHandleCache.DEFAULT_TTL),
+                negative_ttl=self.settings.getint('OUTPUT_QUEUE_CACHE_NEGATIVE_TTL', QueueHandleCache.DEFAULT_NEGATIVE_TTL),
+                stats=self.stats
+            )
+
+    def create_output_queue(self, queue_name):
+        queue = self.output_queue_resource.create_queue(QueueName=queue_name)
+        self.logger.debug('Got or created SQS output queue {}'.format(queue_name))
+        return queue
 
     def check_output_bucket(self):
         self.logger.info('Checking output S3 bucket')
@@ -126,13 +416,36 @@ class Runner(CrawlerProcess, MessageResolverMixin):
             raise NotConfigured('Output S3 bucket name and key must be set!')
         self.logger.debug('Output S3 bucket name is {}'.format(output_bucket_name))
 
+    def setup_s3_uploader(self):
+        self.s3_uploader = S3Uploader.from_settings(self.settings, stats=self.stats)
+        self.logger.debug('Output files will be uploaded to S3 in up to {} threads'.format(
+            self.s3_uploader.max_threads
+        ))
+        if self.s3_uploader.spool is not None:
+            self.s3_uploader.spool.recover()
+            reactor.addSystemEventTrigger('before', 'shutdown', self.s3_uploader.spool.stop)
+            self.logger.info('Failed uploads will be spooled to {} and retried up to {} times'.format(
+                self.s3_uploader.spool.path,
+                self.s3_uploader.spool.max_retries
+            ))
+
+    def setup_s3_segments(self):
+        if not self.settings.getbool('S3_SEGMENTS_ENABLED'):
+            return
+        self.s3_segments = SegmentWriter.from_settings(self.settings, self.s3_uploader, stats=self.stats)
+        # Tasks are acknowledged only after their segment is uploaded, see `flush_outputs`
+        self.logger.info('Outputs of tasks will be aggregated to S3 segments up to {} bytes or {} seconds'.format(
+            self.s3_segments.max_bytes,
+            self.s3_segments.max_age
+        ))
+
     def get_bucket_resource(self):
         # Setting up S3 bucket resource
         bucket_settings = aws_from_settings(self.settings, prefix='SETTINGS_BUCKET_')
         if bucket_settings is None or not all(bucket_settings.values()):
             bucket_settings = aws_from_settings(self.settings, prefix='INPUT_QUEUE_')
             self.logger.info('AWS region, key and secret for settings S3 bucket will be used same as input queue')
-        return boto3.resource('s3', **bucket_settings)
+        return create_resource(self.settings, BLOB, bucket_settings)
 
     def set_proxy_settings_from_bucket(self):
         self.logger.info('Getting proxy settings from S3 bucket')
@@ -153,10 +466,12 @@ class Runner(CrawlerProcess, MessageResolverMixin):
         self.logger.debug('Settings S3 bucket key for proxy is {}'.format(proxy_bucket_key))
 
         try:
-            proxies = self.get_settings(bucket_resource, bucket_name, proxy_bucket_key)
+            self.setup_remote_settings('proxy', bucket_resource, bucket_name, proxy_bucket_key,
+                                       self.apply_proxy_settings)
         except:
             raise NotConfigured("Couldn't fetch proxy settings from S3 bucket {}".format(bucket_name))
 
+    def apply_proxy_settings(self, proxies):
         self.settings.set('proxies', proxies)
         self.logger.debug('Proxy settings are updated from S3 bucket')
 
@@ -173,10 +488,12 @@ class Runner(CrawlerProcess, MessageResolverMixin):
             raise NotConfigured('Settings S3 bucket key for cache must be set')
 
         try:
-            cache = self.get_settings(bucket_resource, cache_bucket_name, cache_bucket_key)
+            self.setup_remote_settings('cache', bucket_resource, cache_bucket_name, cache_bucket_key,
+                                       self.apply_cache_settings)
         except:
             raise NotConfigured("Couldn't fetch cache settings from S3 bucket {}".format('cache_bucket_name'))
 
+    def apply_cache_settings(self, cache):
         if self.git_branch == 'production':
             config = cache.get('production')
         else:
@@ -186,120 +503,192 @@ class Runner(CrawlerProcess, MessageResolverMixin):
         self.settings.set('CACHE_ENABLED', True)
         self.logger.debug('Cache settings are updated from S3 bucket')
 
-    def get_settings(self, bucket_resource, bucket_name, bucket_key):
-        settings_raw_file = StringIO()
-        bucket_resource.Bucket(bucket_name).download_fileobj(
+    def set_rate_limits_from_bucket(self):
+        self.logger.info('Getting rate limits from S3 bucket')
+        bucket_resource = self.get_bucket_resource()
+
+        bucket_name = self.settings.get('SETTINGS_BUCKET_NAME', None)
+        if not bucket_name:
+            raise NotConfigured('Settings S3 bucket name must be set!')
+
+        rate_limits_bucket_key = self.settings.get('RATE_LIMITS_SETTINGS_BUCKET_KEY')
+        if not rate_limits_bucket_key:
+            raise NotConfigured('Settings S3 bucket key for rate limits must be set!')
+
+        try:
+            self.setup_remote_settings('rate_limits', bucket_resource, bucket_name, rate_limits_bucket_key,
+                                       self.apply_rate_limits)
+        except:
+            raise NotConfigured("Couldn't fetch rate limits from S3 bucket {}".format(bucket_name))
+
+    def apply_rate_limits(self, budgets):
+        self.settings.set('DOMAIN_LIMITER_BUDGETS', budgets)
+        self.logger.debug('Rate limits are updated from S3 bucket for sites: {}'.format(', '.join(sorted(budgets))))
+
+    def setup_remote_settings(self, name, bucket_resource, bucket_name, bucket_key, apply):
+        # Loaded before the start, then refreshed in the background for the crawlers created later
+        remote_settings = RemoteSettings(
+            name,
+            bucket_resource.meta.client,
+            bucket_name,
             bucket_key,
-            settings_raw_file
-        )
-        settings_raw_file.seek(0)
-        config = json.load(settings_raw_file)
-        settings_raw_file.close()
-        return config
-
-    def add_visibility_update_pool(self, message):
-        looping_call = task.LoopingCall(self.update_visibility, message.raw_message)
-        looping_call.start(
-            interval=self.input_queue_timeout - self.input_queue_timeout_offset,
-            now=False
-        )
-        self.visibility_update_pool.update({
-            message.raw_message: looping_call
-        })
-
-    def remove_visibility_update_pool(self, message):
-        looping_call = self.visibility_update_pool.pop(message.raw_message, None)
-        if looping_call:
-            looping_call.stop()
-
-    def update_visibility(self, message):
-        self.input_queue.change_message_visibility_batch(
-            Entries=[{
-                'Id': str(uuid4()),
-                'ReceiptHandle': message.receipt_handle,
-                'VisibilityTimeout': self.input_queue_timeout
-            }]
+            apply,
+            cache_dir=self.settings.get('RUNNER_SETTINGS_CACHE_DIR'),
+            interval=self.settings.getint('RUNNER_SETTINGS_REFRESH_INTERVAL', RemoteSettings.DEFAULT_INTERVAL),
+            stats=self.stats
         )
+        remote_settings.load()
+        remote_settings.start()
+        self.remote_settings.append(remote_settings)
+
+    def get_input_queue(self, raw_message):
+        task = self.tasks.get(raw_message)
+        if task is not None and task.input_queue is not None:
+            return task.input_queue
+        return self.input_queues[0]
+
+    def add_visibility_heartbeat(self, message, deadline=None):
+        self.get_input_queue(message.raw_message).heartbeat.register(message.raw_message.receipt_handle, deadline)
+
+    def remove_visibility_heartbeat(self, message):
+        self.get_input_queue(message.raw_message).heartbeat.unregister(message.raw_message.receipt_handle)
+
+    def delete_message(self, raw_message):
+        def callback(result):
+            task = self.tasks.get(raw_message)
+            if task is not None:
+                self.tasks.transition(task, TaskRegistry.ACKED)
+            return result
+
+        def errback(failure):
+            self.logger.error('Error while deleting message {}: {}'.format(
+                raw_message.receipt_handle,
+                failure.getErrorMessage()
+            ))
+
+        input_queue = self.get_input_queue(raw_message)
+        dt = self.delete_batcher.add(input_queue.queue, {'ReceiptHandle': raw_message.receipt_handle})
+        dt.addCallbacks(callback, errback)
+        return dt
 
     def process_input_queue(self):
-        def get_messages(number_of_messages=1, timeout=None, long_polling=False):
+        def get_messages(number_of_messages=1):
             assert isinstance(number_of_messages, int) and 0 < number_of_messages
-            assert (isinstance(timeout, int) and 0 <= timeout < 43200) or timeout is None
-            assert isinstance(long_polling, bool)
-
-            if number_of_messages > 10:
-                number_of_messages = 10
-
-            if not timeout:
-                timeout = self.input_queue_timeout
-
-            return self.input_queue.receive_messages(
-                MaxNumberOfMessages=number_of_messages,
-                VisibilityTimeout=timeout,
-                WaitTimeSeconds=20 if long_polling else 0
-            )
+            return self.poller.poll(number_of_messages)
 
         def process_messages(messages):
-            for raw_message in messages:
-                message = self.resolve(raw_message=raw_message)
+            if self.recycling:
+                # Received while the worker started recycling
+                for input_queue, raw_message, _ in messages:
+                    self.poller.release(input_queue, [raw_message])
+                return
+            for input_queue, raw_message, deadline in messages:
+                task = self.tasks.add(raw_message, input_queue, deadline)
+                if task is None:
+                    # Previous delivery of the same message is still processed and will acknowledge it
+                    continue
+                message = task.message = self.resolve(raw_message=raw_message)
                 if message:
-                    self.in_progress_messages.append(raw_message)
-                    self.add_visibility_update_pool(message)
+                    if self.concurrency is not None:
+                        self.concurrency.task_started()
+                    self.add_visibility_heartbeat(message, deadline)
                     self.process_input_message(message)
                 else:
                     self.logger.warning('Can not handle such message format: {}'.format(raw_message.body))
-                    raw_message.delete()
+                    self.delete_message(raw_message)
+                    self.tasks.remove(task)
                     self.process_input_queue()
 
         def process_grace_period():
             if not self.settings.get('RUNNER_GRACE_PERIOD_ENABLED', True):
                 self.logger.debug('Grace period is disabled')
-                return
+                return defer.succeed(None)
 
             grace_period = self.settings.getint(
                 'RUNNER_GRACE_PERIOD',
                 default=self.input_queue_timeout + self.input_queue_timeout_offset
             )
-            polling_attempts = int(grace_period / 20) + (grace_period % 20 > 0)
-            self.logger.info('Start long-polling for SQS messages during {} seconds (20 seconds x {} attempts)'.format(
+            wait_time = max(self.poller.wait_time, 1)
+            polling_attempts = int(grace_period / wait_time) + (grace_period % wait_time > 0)
+            self.logger.info('Start long-polling for SQS messages during {} seconds ({} seconds x {} attempts)'.format(
                 grace_period,
+                wait_time,
                 polling_attempts
             ))
 
-            while polling_attempts > 0:
-                self.logger.debug('Left {} long-polling attempts'.format(polling_attempts))
-                polling_attempts -= 1
-                messages = get_messages(
-                    number_of_messages=10,
-                    long_polling=True
-                )
+            def long_poll(messages, polling_attempts):
                 if messages:
                     self.logger.info('Got {} messages while long-polling. Continue crawling'.format(len(messages)))
                     return messages
+                if polling_attempts <= 0:
+                    return
+                self.logger.debug('Left {} long-polling attempts'.format(polling_attempts))
+                dt = get_messages(number_of_messages=10)
+                dt.addCallback(long_poll, polling_attempts - 1)
+                return dt
+
+            return long_poll(None, polling_attempts)
 
         def process_grace_period_callback(messages):
             if not messages:
+                if self.tasks:
+                    return
                 self.logger.info('There are no messages in SQS queue and in-progress tasks. Shutting down. Bye!')
-                reactor.callFromThread(self._graceful_stop_reactor)
+                self._graceful_stop_reactor()
                 return
             process_messages(messages)
+            return True
 
-        self.logger.debug('Processing input queue')
-        while len(self.in_progress_messages) < self.max_tasks:
-            number_of_messages = self.max_tasks - len(self.in_progress_messages)
-            self.logger.debug('Try to get {} messages'.format(number_of_messages))
-
-            messages = get_messages(number_of_messages)
+        def process_received_messages(messages):
             self.logger.debug('Got {} messages exactly'.format(len(messages)))
             if not messages:
-                if self.in_progress_messages:
+                # Finished tasks may still be uploading, `finish` polls again once they are done
+                if self.tasks:
                     return
 
-                dt = threads.deferToThread(process_grace_period)
+                # Grace period keeps the receive slot busy, so no other polling can start meanwhile
+                dt = process_grace_period()
                 dt.addCallback(process_grace_period_callback)
-                return
+                return dt
 
             process_messages(messages)
+            return True
+
+        def receive_finished(result):
+            self.receiving = None
+            # Keep polling while the queue returns messages and there are free slots,
+            # or if some slot has been freed while receiving was in progress
+            if result is True or self.receive_requested:
+                self.receive_requested = False
+                self.process_input_queue()
+            return result
+
+        def receive_failed(failure):
+            self.logger.error('Error while receiving SQS messages: {}'.format(failure.getErrorMessage()))
+            if not self.tasks.in_progress:
+                reactor.callLater(self.DEFAULT_RECEIVE_RETRY_DELAY, self.process_input_queue)
+
+        self.logger.debug('Processing input queue')
+        if self.recycling:
+            if not self.tasks:
+                self.logger.info('All in-flight tasks are done, recycling worker. Bye!')
+                self._graceful_stop_reactor()
+            return
+        if self.receiving is not None:
+            self.logger.debug('Receiving of SQS messages is already in progress')
+            self.receive_requested = True
+            return self.receiving
+        if self.tasks.in_progress >= self.max_tasks:
+            return
+
+        number_of_messages = self.max_tasks - self.tasks.in_progress
+        self.logger.debug('Try to get {} messages'.format(number_of_messages))
+
+        dt = self.receiving = get_messages(number_of_messages)
+        dt.addCallback(process_received_messages)
+        dt.addErrback(receive_failed)
+        dt.addBoth(receive_finished)
+        return dt
 
     def process_output_queue(self, input_message_body, filename=None):
         output_message = self.resolve(
@@ -307,77 +696,196 @@ class Runner(CrawlerProcess, MessageResolverMixin):
             bucket_key=filename,
             bucket_name=self.settings.get('OUTPUT_BUCKET_NAME')
         )
-        if not self.output_queue_name:
-            queue_name = output_message.get_queue_name()
-            if not queue_name:
-                self.logger.warning('There is no output queue name in SQS task message!')
-                return
-            self.output_queue = self.output_queue_resource.create_queue(QueueName=queue_name)
-            self.logger.debug('Got or created SQS output queue {}'.format(queue_name))
+        def send_message(queue):
+            self.logger.debug('Output message type {} with data {}'.format(type(output_message), output_message))
+            return self.send_batcher.add(queue, {'MessageBody': str(output_message)})
+
+        if self.output_queue_name:
+            return send_message(self.output_queue)
 
-        self.logger.debug('Output message type {} with data {}'.format(type(output_message), output_message))
-        self.output_queue.send_message(MessageBody=str(output_message))
+        queue_name = output_message.get_queue_name()
+        if not queue_name:
+            self.logger.warning('There is no output queue name in SQS task message!')
+            return defer.succeed(None)
 
-    def bucket_uploaded_callback(self, filename, spider):
+        dt = self.output_queues.get(queue_name)
+        dt.addCallback(send_message)
+        return dt
+
+    def bucket_uploaded_callback(self, filename, spider, message=None):
+        # Pooled crawlers may be busy with the next task when upload of the previous one finishes
+        message = message or spider.message
         self.logger.debug('Output result file {} was successfully uploaded'.format(filename))
-        if spider.message.raw_message in self.finished_messages:
-            self.finished_messages.remove(spider.message.raw_message)
-            self.finish(spider.message, filename)
+        task = self.tasks.get(message.raw_message)
+        if task is not None and not task.finished and self.tasks.transition(task, TaskRegistry.UPLOADED):
+            self.finish(message, filename)
 
-    def bucket_failed_callback(self, failure, spider):
+    def bucket_failed_callback(self, failure, spider, message=None):
+        message = message or spider.message
         self.logger.error('Error while uploading file output result file {}'.format(failure))
-        if spider.message.raw_message in self.finished_messages:
-            self.finished_messages.remove(spider.message.raw_message)
-            self.finish(spider.message)
+        task = self.tasks.get(message.raw_message)
+        if task is not None and task.state == TaskRegistry.SCRAPED and not task.finished:
+            self.finish(message)
 
     def item_scraped_callback(self, response, spider):
         self.logger.debug('Item scraped with response {}'.format(response))
-        if spider.message.raw_message in self.in_progress_messages:
-            self.in_progress_messages.remove(spider.message.raw_message)
-            self.finished_messages.append(spider.message.raw_message)
-
-    def spider_closed_callback(self, reason, spider):
-        if spider.message.raw_message in self.in_progress_messages:
-            self.logger.warning(
-                'For some reason raw_message still in in_progress list, it will be removed from queue'
-            )
-            self.in_progress_messages.remove(spider.message.raw_message)
-            self.finish(spider.message)
+        task = self.tasks.get(spider.message.raw_message)
+        if task is None:
+            return
+        task.items += 1
+        # Batch task keeps its slot until all its urls are crawled
+        if not spider.message.get_urls():
+            self.tasks.transition(task, TaskRegistry.SCRAPED, expected=TaskRegistry.IN_PROGRESS)
+
+    def spider_closed_callback(self, reason, spider, message=None):
+        message = message or spider.message
+        task = self.tasks.get(message.raw_message)
+        if task is not None and task.state in TaskRegistry.IN_PROGRESS:
+            self.tasks.transition(task, TaskRegistry.SCRAPED)
+            # Batch task with scraped items is finished by bucket callbacks once its output is uploaded
+            if not task.items:
+                self.logger.warning(
+                    'For some reason task {} is still in progress, it will be removed from queue'.format(task.id)
+                )
+                self.finish(message)
         self.process_input_queue()
 
     def finish(self, message, filename=None):
-        self.process_output_queue(message, filename)
-        self.remove_visibility_update_pool(message)
-        message.raw_message.delete()
+        def delete_message(_):
+            return self.delete_message(message.raw_message)
+
+        def errback(failure):
+            # The task is not acknowledged, so it becomes visible again after visibility timeout
+            self.logger.error('Error while sending output message, task will not be deleted: {}'.format(
+                failure.getErrorMessage()
+            ))
+
+        def poll(result):
+            if task is not None:
+                # Not acknowledged tasks are forgotten too, SQS will deliver them again
+                self.tasks.remove(task)
+            self.check_memory()
+            if not self.tasks.finishing:
+                self.process_input_queue()
+            return result
+
+        task = self.tasks.get(message.raw_message)
+        if task is not None:
+            task.finished = True
+            if self.concurrency is not None:
+                self.concurrency.task_finished(reactor.seconds() - task.started, failed=filename is None)
+        self.poller.task_finished(self.get_input_queue(message.raw_message), message.raw_message)
+
+        self.remove_visibility_heartbeat(message)
+        dt = self.process_output_queue(message, filename)
+        dt.addCallbacks(delete_message, errback)
+        dt.addBoth(poll)
+
+        if task is not None and task.key is not None:
+            self.finish_duplicates(task, filename)
+        return dt
+
+    def finish_duplicates(self, task, filename=None):
+        # Tasks attached to the crawl get their own output messages with the same result
+        for duplicate in self.coalescer.complete(task.key, task, filename):
+            self.tasks.transition(duplicate, TaskRegistry.UPLOADED if filename else TaskRegistry.SCRAPED)
+            self.finish(duplicate.message, filename)
+
+    def coalesce(self, message):
+        """Returns True if the task does not need its own crawl."""
+        task = self.tasks.get(message.raw_message)
+        if task is None:
+            return False
+        task.key = TaskCoalescer.get_key(message)
+        if task.key is None:
+            return False
+
+        filename = self.coalescer.get_result(task.key)
+        if filename:
+            self.logger.debug('Task {} reuses recent result {} of a duplicate task'.format(task.id, filename))
+            self.tasks.transition(task, TaskRegistry.UPLOADED)
+            self.finish(message, filename)
+            self.process_input_queue()
+            return True
+
+        if self.coalescer.attach(task.key, task):
+            self.tasks.transition(task, TaskRegistry.CRAWLING)
+            return True
+        return False
 
     def start_crawler(self, spider_name, message, options):
         assert isinstance(spider_name, six.string_types)
         assert isinstance(message, BaseInputMessage)
         assert isinstance(options, dict)
 
-        crawler = self.create_crawler(spider_name)
+        task = self.tasks.get(message.raw_message)
+        if task is not None:
+            self.tasks.transition(task, TaskRegistry.CRAWLING)
+        if self.crawler_pool is not None:
+            crawler = self.crawler_pool.submit(spider_name, message, options).crawler
+        else:
+            crawler = self.create_crawler(spider_name)
+            self.connect_crawler_signals(crawler)
+            self.crawl(
+                crawler_or_spidercls=crawler,
+                message=message,
+                **options
+            )
+        # Current concurrency target goes to task stats, e.g. Filebeat entries
+        crawler.stats.set_value(AdaptiveConcurrency.STATS_TARGET, self.max_tasks)
+        if task is not None:
+            self.watch_deadline(task, crawler, message)
+
+    def watch_deadline(self, task, crawler, message):
+        # Crawler closes the task at its deadline (see `TaskDeadlineMiddleware`), the runner is a backstop
+        timeout = message.get_timeout() or crawler.settings.getfloat('TASK_DEADLINE', 0)
+        if not timeout:
+            return
+        grace = self.settings.getfloat('TASK_DEADLINE_GRACE', 60)
+        # Cancelled once the task is removed from the registry
+        task.deadline_call = reactor.callLater(timeout + grace, self.task_overdue, task)
+
+    def task_overdue(self, task):
+        task.deadline_call = None
+        if self.tasks.get(task.raw_message) is not task or task.finished:
+            return
+        self.stats.inc_value('runner/tasks/overdue')
+        self.logger.error(
+            'Task {} is still {} after its deadline and grace period, it is abandoned'.format(task.id, task.state)
+        )
+        # Message becomes visible to other runners instead of being held by this one forever,
+        # so do messages of duplicates waiting for its crawl
+        abandoned = [task]
+        if task.key is not None:
+            abandoned.extend(self.coalescer.complete(task.key, task))
+        for abandoned_task in abandoned:
+            self.remove_visibility_heartbeat(abandoned_task.message)
+            self.tasks.remove(abandoned_task)
+        # Slot of the task is free, even if its crawler is still busy
+        self.process_input_queue()
 
+    def connect_crawler_signals(self, crawler):
+        crawler.domain_limiter = self.domain_limiter
+        crawler.s3_uploader = self.s3_uploader
+        crawler.s3_segments = self.s3_segments
         crawler.signals.connect(self.bucket_uploaded_callback, signals.bucket_uploaded)
         crawler.signals.connect(self.bucket_failed_callback, signals.bucket_failed)
 
         crawler.signals.connect(self.item_scraped_callback, signals.item_scraped)
-        crawler.signals.connect(self.spider_closed_callback, signals.spider_closed)
-
-        self.crawl(
-            crawler_or_spidercls=crawler,
-            message=message,
-            **options
-        )
+        signals.connect_task_signals(crawler, closed=self.spider_closed_callback)
 
     def process_input_message(self, message):
         spider_name = message.get_spider_name()
-        if spider_name not in self.spiders.list():
+        if spider_name not in self.spider_names:
             self.logger.warning('Unsupported spider name {}'.format(spider_name))
-            if message.raw_message in self.in_progress_messages:
-                self.in_progress_messages.remove(message.raw_message)
+            task = self.tasks.get(message.raw_message)
+            if task is not None:
+                self.tasks.transition(task, TaskRegistry.SCRAPED, expected=TaskRegistry.IN_PROGRESS)
             self.finish(message)
             self.process_input_queue()
             return
+        if self.coalescer is not None and self.coalesce(message):
+            return
         self.start_crawler(
             spider_name=message.get_spider_name(),
             message=message,
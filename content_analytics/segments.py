@@ -0,0 +1,124 @@
+import logging
+
+from uuid import uuid4
+from datetime import datetime
+from cStringIO import StringIO
+
+from twisted.internet import defer, reactor
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentRange(str):
+    """Key of the segment object with the byte range of a single task output in it.
+
+    It is the key string everywhere output filenames are passed around (signals, coalesced results,
+    Filebeat entries), output messages add the range, so consumers can use ranged GETs. Compressed
+    outputs are compressed on their own, so the range holds a whole stream with `content_encoding`.
+    """
+
+    def __new__(cls, key, offset, length, content_encoding=None):
+        segment_range = str.__new__(cls, key)
+        segment_range.offset = offset
+        segment_range.length = length
+        segment_range.content_encoding = content_encoding
+        return segment_range
+
+    @property
+    def http_range(self):
+        return 'bytes={}-{}'.format(self.offset, self.offset + self.length - 1)
+
+
+class SegmentWriter(StatsMixin):
+    """Appends outputs of many tasks to a rolling S3 object.
+
+    The segment is uploaded once it reaches `max_bytes`, or `max_age` seconds after its first output.
+    Deferreds returned by `append` fire with `SegmentRange` only when the segment is uploaded, so
+    tasks are acknowledged after their output is stored. If the upload fails, all tasks of the
+    segment fail.
+    """
+    KEY_FORMAT = 'output/{}/segments/{}.jl'
+    DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+    DEFAULT_MAX_AGE = 5
+
+    STATS_APPENDED = 'segments/appended'
+    STATS_FLUSHED = 'segments/flushed'
+    STATS_FAILED = 'segments/failed'
+    STATS_SIZE = 'segments/size'
+    STATS_OUTPUTS = 'segments/outputs'
+
+    def __init__(self, uploader, bucket_name, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, stats=None,
+                 clock=None):
+        self.uploader = uploader
+        self.bucket_name = bucket_name
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.stats = stats
+        self.clock = clock or reactor
+        self.buffer = None
+        self.key = None
+        self.waiting = []
+        self.delayed_call = None
+
+    @classmethod
+    def from_settings(cls, settings, uploader, stats=None):
+        return cls(
+            uploader,
+            settings.get('OUTPUT_BUCKET_NAME'),
+            max_bytes=settings.getint('S3_SEGMENTS_MAX_BYTES', cls.DEFAULT_MAX_BYTES),
+            max_age=settings.getfloat('S3_SEGMENTS_MAX_AGE', cls.DEFAULT_MAX_AGE),
+            stats=stats
+        )
+
+    @classmethod
+    def generate_key(cls):
+        return cls.KEY_FORMAT.format(datetime.utcnow().strftime('%Y/%m/%d'), uuid4())
+
+    def append(self, data, content_encoding=None):
+        """Returns Deferred which fires with `SegmentRange` of `data` once its segment is uploaded.
+
+        `content_encoding` is set for `data` which is compressed already.
+        """
+        if self.buffer is None:
+            self.buffer = StringIO()
+            self.key = self.generate_key()
+            self.delayed_call = self.clock.callLater(self.max_age, self.flush)
+        d = defer.Deferred()
+        self.waiting.append((d, SegmentRange(self.key, self.buffer.tell(), len(data), content_encoding)))
+        self.buffer.write(data)
+        self._inc_stats(self.STATS_APPENDED)
+        if self.buffer.tell() >= self.max_bytes:
+            self.flush()
+        return d
+
+    def flush(self):
+        if self.delayed_call is not None and self.delayed_call.active():
+            self.delayed_call.cancel()
+        self.delayed_call = None
+        if self.buffer is None:
+            return defer.succeed(None)
+        buffer, key, waiting = self.buffer, self.key, self.waiting
+        self.buffer, self.key, self.waiting = None, None, []
+        self._observe(self.STATS_SIZE, buffer.tell())
+        self._observe(self.STATS_OUTPUTS, len(waiting))
+        logger.debug('Uploading segment {} with {} outputs'.format(key, len(waiting)))
+
+        def uploaded(_):
+            buffer.close()
+            self._inc_stats(self.STATS_FLUSHED)
+            for d, segment_range in waiting:
+                d.callback(segment_range)
+
+        def failed(failure):
+            buffer.close()
+            self._inc_stats(self.STATS_FAILED)
+            logger.error('Error while uploading segment {}: {}'.format(key, failure.getErrorMessage()))
+            for d, _ in waiting:
+                d.errback(failure)
+
+        buffer.seek(0)
+        dt = self.uploader.upload(buffer, self.bucket_name, key)
+        dt.addCallbacks(uploaded, failed)
+        return dt
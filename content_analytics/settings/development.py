@@ -2,6 +2,8 @@ BOT_NAME = 'content_analytics'
 
 SPIDER_MODULES = ['content_analytics.spiders']
 NEWSPIDER_MODULE = 'content_analytics.spiders'
+SPIDER_LOADER_CLASS = 'content_analytics.spiderloader.ManifestSpiderLoader'
+SPIDER_MANIFEST = None  # content_analytics/spiders/manifest.json, rebuilt with python -m content_analytics.spiderloader
 
 LOG_LEVEL = 'DEBUG'
 # LOG_FILE = '/tmp/scrapy.log'
@@ -40,6 +42,8 @@ SPIDER_MIDDLEWARES = {
 
 DOWNLOADER_MIDDLEWARES = {
     'content_analytics.middlewares.splash.SplashRetryMiddleware': 555,
+    'content_analytics.middlewares.deadline.TaskDeadlineMiddleware': 700,
+    'content_analytics.middlewares.ratelimit.DomainLimiterMiddleware': 710,
     'scrapy_splash.SplashCookiesMiddleware': 723,
     'content_analytics.middlewares.splash.CustomSplashMiddleware': 725,
     'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 810,
@@ -52,6 +56,10 @@ EXTENSIONS = {}
 ITEM_PIPELINES = {'content_analytics.pipelines.simple_validator.SimpleValidator': 998}
 
 DOWNLOADER_CLIENTCONTEXTFACTORY = 'content_analytics.utils.CustomClientContextFactory'
+DOWNLOAD_HANDLERS = {
+    'http': 'content_analytics.downloader.SharedHTTP11DownloadHandler',
+    'https': 'content_analytics.downloader.SharedHTTP11DownloadHandler',
+}
 
 FEED_FORMAT = 'jsonlines'
 FEED_EXPORT_ENCODING = 'utf8'
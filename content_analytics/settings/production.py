@@ -2,13 +2,47 @@ BOT_NAME = 'content_analytics'
 
 SPIDER_MODULES = ['content_analytics.spiders']
 NEWSPIDER_MODULE = 'content_analytics.spiders'
+SPIDER_LOADER_CLASS = 'content_analytics.spiderloader.ManifestSpiderLoader'
+SPIDER_MANIFEST = None  # content_analytics/spiders/manifest.json, rebuilt with python -m content_analytics.spiderloader
 
 RUNNER_MAX_TASKS = 20
 RUNNER_GRACE_PERIOD = 310
 RUNNER_GRACE_PERIOD_ENABLED = True
 RUNNER_SETTINGS_BUCKET_ENABLED = True
 RUNNER_CACHE_SETTINGS_BUCKET_ENABLED = True
+RUNNER_RATE_LIMITS_BUCKET_ENABLED = False
+RUNNER_SETTINGS_REFRESH_INTERVAL = 60  # settings from S3 buckets are re-checked with conditional GETs
+RUNNER_SETTINGS_CACHE_DIR = '/tmp/settings'  # nosec, saved copies of S3 settings for restarts without S3
 REACTOR_THREADPOOL_MAXSIZE = 50
+RUNNER_SQS_THREADPOOL_MAXSIZE = 10
+RUNNER_STATS_INTERVAL = 60
+RUNNER_SQS_BATCH_LINGER = 0.2
+RUNNER_SQS_BATCH_RETRIES = 3
+RUNNER_CRAWLER_POOL_ENABLED = False
+RUNNER_CRAWLER_POOL_IDLE_TIMEOUT = 300
+RUNNER_CRAWLER_POOL_MAX_CRAWLER_TASKS = 1000
+RUNNER_SUPERVISOR_ENABLED = False
+RUNNER_SHARED_HTTP_POOL_ENABLED = False
+RUNNER_MEMORY_LIMIT_MB = 0  # worker is recycled once its RSS is over the limit, 0 means no limit
+RUNNER_MEMORY_HEAP_LIMIT = 0  # objects tracked by the garbage collector, 0 means no limit
+RUNNER_MEMORY_HEAP_INTERVAL = 60  # seconds between heap samples, each one walks the whole heap
+HTTP_POOL_MAX_PER_HOST = 8  # idle persistent connections kept per host (or proxy)
+HTTP_POOL_IDLE_TIMEOUT = 240
+HTTP_POOL_TLS_SESSION_HOSTS = 1000
+RUNNER_WORKERS = 0  # number of CPUs
+RUNNER_SUPERVISOR_PREFETCH = 10
+RUNNER_SUPERVISOR_WAIT_TIME = 20
+RUNNER_ADAPTIVE_MAX_TASKS_ENABLED = False
+RUNNER_MAX_TASKS_FLOOR = 2
+RUNNER_MAX_TASKS_CEILING = 50
+RUNNER_ADAPTIVE_INTERVAL = 10
+RUNNER_ADAPTIVE_MAX_REACTOR_LAG = 0.5
+RUNNER_ADAPTIVE_MAX_RSS_MB = 0  # disabled
+RUNNER_ADAPTIVE_MAX_TASK_LATENCY = 0  # disabled
+RUNNER_ADAPTIVE_MAX_ERROR_RATE = 0.5
+RUNNER_SUPERVISOR_RESTART_DELAY = 5
+RUNNER_COALESCING_ENABLED = False
+RUNNER_COALESCING_RESULT_TTL = 120
 
 RETRY_TIMES = 20
 
@@ -17,13 +51,29 @@ LOG_LEVEL = 'WARNING'
 FILEBEAT_ENABLED = True
 FILEBEAT_PATH = '/tmp/filebeat'  # nosec
 
+# Backends of SQS queues and S3 buckets, local ones run the scraper without AWS (see content_analytics.backends)
+QUEUE_BACKEND = 'content_analytics.backends.BotoBackend'  # or memory.MemoryBackend, disk.DiskBackend
+BLOB_BACKEND = 'content_analytics.backends.BotoBackend'
+LOCAL_BACKEND_PATH = '/tmp/local_backend'  # nosec
+LOCAL_BACKEND_QUEUE_LATENCY = 0
+LOCAL_BACKEND_BLOB_LATENCY = 0
+
 INPUT_QUEUE_VISIBILITY_TIMEOUT_OFFSET = 10
 INPUT_QUEUE_NAME = ''
+INPUT_QUEUE_URGENT_NAME = ''
+INPUT_QUEUE_PRIORITY = 'strict'  # or 'weighted'
+INPUT_QUEUE_WEIGHT = 1
+INPUT_QUEUE_URGENT_WEIGHT = 4
+INPUT_QUEUE_PREFETCH = 10
+INPUT_QUEUE_WAIT_TIME = 20
+INPUT_QUEUE_PREFETCH_RELEASE_MARGIN = 30
 INPUT_QUEUE_AWS_REGION_NAME = 'us-east-1'
 INPUT_QUEUE_AWS_ACCESS_KEY_ID = ''
 INPUT_QUEUE_AWS_SECRET_ACCESS_KEY = ''
 
 OUTPUT_QUEUE_NAME = None
+OUTPUT_QUEUE_CACHE_TTL = 3600
+OUTPUT_QUEUE_CACHE_NEGATIVE_TTL = 60
 OUTPUT_QUEUE_AWS_REGION_NAME = 'us-east-1'
 OUTPUT_QUEUE_AWS_ACCESS_KEY_ID = ''
 OUTPUT_QUEUE_AWS_SECRET_ACCESS_KEY = ''
@@ -32,12 +82,27 @@ OUTPUT_BUCKET_NAME = 'ch-responses'
 OUTPUT_BUCKET_AWS_REGION_NAME = 'us-east-1'
 OUTPUT_BUCKET_AWS_ACCESS_KEY_ID = ''
 OUTPUT_BUCKET_AWS_SECRET_ACCESS_KEY = ''
+S3_UPLOAD_THREADS = 10  # also the size of S3 connection pool
+S3_SEGMENTS_ENABLED = False  # outputs of many tasks go to one object, messages get s3_key, s3_offset, s3_length
+S3_SEGMENTS_MAX_BYTES = 8388608
+S3_SEGMENTS_MAX_AGE = 5  # seconds, tasks are acknowledged after their segment is uploaded
+S3_OUTPUT_COMPRESSION = None  # gzip or zstd (needs zstandard), messages can override it by output_compression
+S3_OUTPUT_COMPRESSION_LEVEL = None
+S3_EXPORT_SPOOL_BYTES = 1048576  # output buffer is spooled to temporary file past this size
+S3_MULTIPART_PART_BYTES = 8388608  # outputs are uploaded in parts while crawling, 0 to upload at close only
+S3_UPLOAD_RETRIES = 3  # multipart upload calls are retried, then the output is uploaded at once
+S3_UPLOAD_RETRY_DELAY = 1  # seconds, doubled after every retry
+S3_UPLOAD_SPOOL_PATH = None  # failed uploads are kept there and retried, tasks are acknowledged after retry
+S3_UPLOAD_SPOOL_RETRIES = 5
+S3_UPLOAD_SPOOL_RETRY_DELAY = 5  # seconds, doubled after every retry
+S3_UPLOAD_SPOOL_MAX_RETRY_DELAY = 300
 
 # Same key names, as in old architecture
 CACHE_BUCKET_NAME = 'settings.contentanalyticsinc.com'
 CACHE_SETTINGS_BUCKET_KEY = 'cache.json'
 PROXY_SETTINGS_PRODUCTION_BUCKET_KEY = 'global_proxy_config.cfg'
 PROXY_SETTINGS_DEVELOPMENT_BUCKET_KEY = 'master_proxy_config.cfg'
+RATE_LIMITS_SETTINGS_BUCKET_KEY = 'rate_limits.json'
 SETTINGS_BUCKET_NAME = 'scraper-settings'
 SETTINGS_BUCKET_AWS_REGION_NAME = 'us-east-1'
 SETTINGS_BUCKET_AWS_ACCESS_KEY_ID = ''
@@ -58,6 +123,23 @@ TELNETCONSOLE_ENABLED = False
 
 SPLASH_URL = 'http://splash:8050'
 
+TASK_DEADLINE = 0  # seconds per task, 0 means no deadline, message `timeout` field takes precedence
+TASK_DEADLINE_SHED_MARGIN = 30  # optional requests are ignored that many seconds before the deadline
+TASK_DEADLINE_GRACE = 60  # after the deadline the runner stops extending visibility of a stuck task
+
+DOMAIN_LIMITER_ENABLED = False
+DOMAIN_LIMITER_CONCURRENCY = 8
+DOMAIN_LIMITER_RATE = 0  # requests per second, unlimited
+DOMAIN_LIMITER_BURST = 0  # same as rate
+DOMAIN_LIMITER_BUDGETS = {}  # per site, see RUNNER_RATE_LIMITS_BUCKET_ENABLED
+# Share rate limits between runner nodes, concurrency is still limited per node
+DOMAIN_LIMITER_DISTRIBUTED = False
+DOMAIN_LIMITER_STORE = 'content_analytics.middlewares.ratelimit.aero.AerospikeTokenStore'
+DOMAIN_LIMITER_SET = 'rate_limits'
+DOMAIN_LIMITER_RECORD_TTL = 3600
+DOMAIN_LIMITER_LEASE_SIZE = 10  # tokens leased at once
+DOMAIN_LIMITER_LEASE_TTL = 1  # seconds, unused leased tokens are dropped after that
+
 DUPEFILTER_CLASS = 'scrapy.dupefilters.BaseDupeFilter'
 
 SPIDER_MIDDLEWARES = {
@@ -73,6 +155,10 @@ DOWNLOADER_MIDDLEWARES = {
     'content_analytics.middlewares.cache.CacheMiddleware': 1,
     'content_analytics.middlewares.proxy.ProxyRetryDownloaderMiddleware': 550,
     'content_analytics.middlewares.splash.SplashRetryMiddleware': 555,
+    # After download timeout middleware, so download timeouts are capped by the deadline
+    'content_analytics.middlewares.deadline.TaskDeadlineMiddleware': 700,
+    # After cache, so cached responses are not limited, and before splash, which changes request urls
+    'content_analytics.middlewares.ratelimit.DomainLimiterMiddleware': 710,
     'scrapy_splash.SplashCookiesMiddleware': 723,
     'content_analytics.middlewares.splash.CustomSplashMiddleware': 725,
     'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 810,
@@ -82,6 +168,8 @@ DOWNLOADER_MIDDLEWARES = {
 EXTENSIONS = {
     'scrapy.extensions.telnet.TelnetConsole': None,
     'scrapy.extensions.statsmailer.StatsMailer': None,
+    # Before Filebeat, so memory stats get to its entries
+    'content_analytics.extensions.memory.MemoryDeltaExtension': 5,
     'content_analytics.extensions.filebeat.FilebeatExtension': 10,
 }
 
@@ -91,6 +179,10 @@ ITEM_PIPELINES = {
 }
 
 DOWNLOADER_CLIENTCONTEXTFACTORY = 'content_analytics.utils.CustomClientContextFactory'
+DOWNLOAD_HANDLERS = {
+    'http': 'content_analytics.downloader.SharedHTTP11DownloadHandler',
+    'https': 'content_analytics.downloader.SharedHTTP11DownloadHandler',
+}
 
 FEED_FORMAT = 'jsonlines'
 FEED_EXPORT_ENCODING = 'utf8'
@@ -4,3 +4,20 @@ from scrapy.signals import *
 bucket_uploaded = object()
 bucket_failed = object()
 
+# Sent by crawlers reused for many tasks (see `content_analytics.crawlerpool`)
+task_opened = object()
+task_closed = object()
+
+
+def connect_task_signals(crawler, opened=None, closed=None):
+    """Connects per-task handlers of a crawler component.
+
+    Pooled crawlers process many tasks between `spider_opened` and `spider_closed`, so per-task
+    handlers are connected to `task_opened` and `task_closed` instead. Task signals are sent with
+    the same arguments as spider ones plus the task `message`.
+    """
+    pooled = crawler.settings.getbool('RUNNER_CRAWLER_POOL_ENABLED', False)
+    if opened:
+        crawler.signals.connect(opened, signal=task_opened if pooled else spider_opened)
+    if closed:
+        crawler.signals.connect(closed, signal=task_closed if pooled else spider_closed)
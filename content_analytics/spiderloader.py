@@ -0,0 +1,131 @@
+"""Spider loader which imports spider modules on first use.
+
+Scrapy's `SpiderLoader` imports every module of `SPIDER_MODULES` (and everything they import) when
+the runner starts. `ManifestSpiderLoader` reads spider names and their modules from a prebuilt JSON
+manifest instead, so only the spiders which get tasks are imported. Rebuild the manifest whenever
+spiders are added, renamed or moved:
+
+    python -m content_analytics.spiderloader
+"""
+import os
+import json
+import logging
+import argparse
+
+import six
+
+from importlib import import_module
+
+from zope.interface import implementer
+from scrapy.interfaces import ISpiderLoader
+from scrapy.spiderloader import SpiderLoader
+from scrapy.utils.misc import walk_modules
+from scrapy.utils.spider import iter_spider_classes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'spiders', 'manifest.json')
+
+
+def build_manifest(spider_modules):
+    """Returns manifest of spiders in `spider_modules`, importing all of them."""
+    spiders = {}
+    for name in spider_modules:
+        for module in walk_modules(name):
+            for spider_class in iter_spider_classes(module):
+                # Abstract base spiders have no name of their own
+                if isinstance(spider_class.name, six.string_types):
+                    spiders[spider_class.name] = module.__name__
+    return {
+        'spider_modules': sorted(spider_modules),
+        'spiders': spiders
+    }
+
+
+def read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        logger.warning('Can not read spider manifest {}: {}'.format(path, e))
+        return None
+
+
+def write_manifest(path, manifest):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+
+@implementer(ISpiderLoader)
+class ManifestSpiderLoader(object):
+    """Loads spider classes by name from the modules listed in the manifest.
+
+    Falls back to Scrapy's `SpiderLoader` if the manifest is missing or was built for other spider
+    modules, and for spiders which are not found where the manifest says they are.
+    """
+
+    def __init__(self, settings, manifest=None):
+        self.settings = settings
+        self.spider_modules = settings.getlist('SPIDER_MODULES')
+        self.manifest = manifest or {}
+        self._spiders = {}
+        self._full_loader = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        path = settings.get('SPIDER_MANIFEST') or DEFAULT_MANIFEST_PATH
+        manifest = read_manifest(path) if os.path.exists(path) else None
+        if manifest is None or manifest.get('spider_modules') != sorted(settings.getlist('SPIDER_MODULES')):
+            logger.warning('Spider manifest {} does not match SPIDER_MODULES, importing all spiders'.format(path))
+            return SpiderLoader.from_settings(settings)
+        return cls(settings, manifest=manifest)
+
+    @property
+    def full_loader(self):
+        if self._full_loader is None:
+            self._full_loader = SpiderLoader.from_settings(self.settings)
+        return self._full_loader
+
+    def load(self, spider_name):
+        spider_class = self._spiders.get(spider_name)
+        if spider_class is None:
+            spider_class = self._spiders[spider_name] = self._load(spider_name)
+        return spider_class
+
+    def _load(self, spider_name):
+        module_name = self.manifest['spiders'].get(spider_name)
+        if module_name is None:
+            raise KeyError('Spider not found: {}'.format(spider_name))
+        for spider_class in iter_spider_classes(import_module(module_name)):
+            if spider_class.name == spider_name:
+                return spider_class
+        logger.warning('Spider {} is not found in module {}, spider manifest is outdated'.format(
+            spider_name,
+            module_name
+        ))
+        return self.full_loader.load(spider_name)
+
+    def find_by_request(self, request):
+        return self.full_loader.find_by_request(request)
+
+    def list(self):
+        return list(self.manifest['spiders'].keys())
+
+
+def main():
+    from scrapy.utils.project import get_project_settings
+
+    parser = argparse.ArgumentParser(description='Builds spider manifest for ManifestSpiderLoader')
+    parser.add_argument('--output', default=None, help='manifest path, SPIDER_MANIFEST setting by default')
+    options = parser.parse_args()
+
+    settings = get_project_settings()
+    path = options.output or settings.get('SPIDER_MANIFEST') or DEFAULT_MANIFEST_PATH
+    manifest = build_manifest(settings.getlist('SPIDER_MODULES'))
+    write_manifest(path, manifest)
+    print('{} spiders are written to {}'.format(len(manifest['spiders']), path))
+
+
+if __name__ == '__main__':
+    main()
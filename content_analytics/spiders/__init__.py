@@ -51,11 +51,16 @@ class RankingComponent(Component):
 
 class SingleProductComponent(Component):
     _product_url = None
+    _product_urls = None
 
     @property
     def product_url(self):
         return self._product_url
 
+    @property
+    def product_urls(self):
+        return self._product_urls
+
     @abstractmethod
     def parse_product(self, response):
         return
@@ -63,20 +68,41 @@ class SingleProductComponent(Component):
 
     def __init__(self, *args, **kwargs):
         self._product_url = kwargs.get('product_url')
+        self._product_urls = kwargs.get('product_urls')
 
         if self._message:
             self._product_url = self._message.get('url')
+            self._product_urls = self._message.get('urls')
 
         super(SingleProductComponent, self).__init__(*args, **kwargs)
 
     def get_single_product_item(self, *args, **kwargs):
         return self.get_default_item(*args, **kwargs)
 
+    def normalize_product_url(self, url):
+        """Url to request for the input product url, spiders which request other pages (e.g. APIs) override it.
+
+        Spiders apply it to the single product url in `__init__`, urls of batch tasks go through it in `make_requests`.
+        """
+        return url
+
     def make_requests(self, *args, **kwargs):
         if self._product_url:
             for request in self.make_single_product_requests(url=self._product_url):
                 yield request
 
+        # Batch task, all products are crawled concurrently and exported to the same output
+        for url in self._product_urls or []:
+            item = self.get_single_product_item()
+            item['batch_url'] = url
+            product_url = self.normalize_product_url(url)
+            if not product_url:
+                # Url gets failure status line, see `S3ExportPipeline.finish_url_results`
+                self.logger.warning('Batch url {} is not supported'.format(url))
+                continue
+            for request in self.make_single_product_requests(url=product_url, item=item):
+                yield request
+
         for request in super(SingleProductComponent, self).make_requests(*args, **kwargs):
             yield request
 
@@ -548,6 +574,18 @@ class BaseProductsSpider(with_metaclass(
     def start_requests(self):
         return super(BaseProductsSpider, self).make_requests()
 
+    def reset_task(self, *args, **kwargs):
+        """Re-initializes the spider for the next task of a pooled crawler.
+
+        All instance attributes are dropped, so nothing is left from the previous task,
+        except the bound crawler and its settings.
+        """
+        crawler = self.crawler
+        self.__dict__.clear()
+        self.__init__(*args, **kwargs)
+        self.crawler = crawler
+        self.settings = crawler.settings
+
     def get_default_item(self, *args, **kwargs):
         return SiteProductItem()
 
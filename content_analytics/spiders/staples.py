@@ -38,7 +38,7 @@ class StaplesProductsSpider(BaseProductsSpider):
         if getattr(self, '_shelf_url', None):
             self._shelf_url = self.get_shelf_url(self._shelf_url, 1)
         elif getattr(self, '_product_url', None):
-            self._product_url = self.get_product_url(self._product_url)
+            self._product_url = self.normalize_product_url(self._product_url)
 
     def get_default_item(self, *args, **kwargs):
         return StaplesProductItem()
@@ -115,6 +115,9 @@ class StaplesProductsSpider(BaseProductsSpider):
                     callback=self.parse_variant_data
                 )
 
+    def normalize_product_url(self, url):
+        return self.get_product_url(url)
+
     def get_product_url(self, url):
         sku = re.search('product_([^/]+)', url)
         if sku:
@@ -70,11 +70,14 @@ class TargetProductsSpider(BaseProductsSpider):
         self._original_product_url = self._product_url
 
         if getattr(self, '_product_url', None):
-            self._product_url = self.get_product_url(self._product_url)
+            self._product_url = self.normalize_product_url(self._product_url)
         elif getattr(self, '_shelf_url', None):
             self._shelf_url = self.get_shelf_url(self._shelf_url)
 
     # Single component
+    def normalize_product_url(self, url):
+        return self.get_product_url(url)
+
     def get_product_url(self, product_url):
         tcin = self._get_product_id_from_input_product_url(product_url)
         return self.PRODUCT_URL.format(
@@ -237,7 +240,10 @@ class TargetProductsSpider(BaseProductsSpider):
     def _parse_initial_product(self, response, product, data):
         # write for department and image_url pipeline to autofill these fields
         product_main_data = data['item']
-        product_id = self._get_product_id_from_input_product_url(self._original_product_url or response.url)
+        # Product of batch task is identified by its own input url
+        product_id = self._get_product_id_from_input_product_url(
+            product.get('batch_url') or self._original_product_url or response.url
+        )
         upc = self._parse_upc(product_main_data)
         image_urls = self._parse_image_urls(product_main_data)
 
@@ -0,0 +1,255 @@
+import os
+import json
+import errno
+import time
+import shutil
+import logging
+
+from uuid import uuid4
+
+from twisted.internet import defer, reactor
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolEntry(object):
+    def __init__(self, path, bucket_name, key, content_type=None, content_encoding=None, created=None, name=None):
+        self.name = name or str(uuid4())
+        self.path = path
+        self.bucket_name = bucket_name
+        self.key = key
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.created = created or time.time()
+        self.attempts = 0
+        # Fires once the entry is uploaded or dropped, entries recovered from other processes have nobody waiting
+        self.waiting = defer.Deferred()
+        self.delayed_call = None
+
+    @property
+    def data_path(self):
+        return os.path.join(self.path, '{}.data'.format(self.name))
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.path, '{}.json'.format(self.name))
+
+    def to_dict(self):
+        return {
+            'bucket_name': self.bucket_name,
+            'key': self.key,
+            'content_type': self.content_type,
+            'content_encoding': self.content_encoding,
+            'created': self.created
+        }
+
+
+class UploadSpool(StatsMixin):
+    """Keeps outputs which failed to upload in a local directory and retries them with backoff.
+
+    Deferred of the failed upload fires only when a retry succeeds, so the task is acknowledged
+    after its output is stored, or fails after `max_retries` retries. Every process spools to its
+    own subdirectory, entries left by previous processes are taken over by `recover` and uploaded,
+    though nobody waits for them. Data is spooled compressed, as it is uploaded.
+    """
+    DEFAULT_MAX_RETRIES = 5
+    DEFAULT_RETRY_DELAY = 5
+    DEFAULT_MAX_RETRY_DELAY = 300
+
+    STATS_SPOOLED = 'spool/spooled'
+    STATS_RECOVERED = 'spool/recovered'
+    STATS_RETRIED = 'spool/retried'
+    STATS_UPLOADED = 'spool/uploaded'
+    STATS_DROPPED = 'spool/dropped'
+    STATS_DEPTH = 'spool/depth'
+    STATS_DEPTH_MAX = 'spool/depth_max'
+    STATS_AGE = 'spool/oldest_age'
+
+    def __init__(self, uploader, path, max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY,
+                 max_retry_delay=DEFAULT_MAX_RETRY_DELAY, stats=None, clock=None, pid=None):
+        self.uploader = uploader
+        self.path = path
+        self.pid = pid or os.getpid()
+        self.own_path = os.path.join(path, str(self.pid))
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stats = stats
+        self.clock = clock or reactor
+        self.entries = {}
+        if not os.path.isdir(self.own_path):
+            os.makedirs(self.own_path)
+
+    @classmethod
+    def from_settings(cls, settings, uploader, stats=None):
+        return cls(
+            uploader,
+            settings.get('S3_UPLOAD_SPOOL_PATH'),
+            max_retries=settings.getint('S3_UPLOAD_SPOOL_RETRIES', cls.DEFAULT_MAX_RETRIES),
+            retry_delay=settings.getfloat('S3_UPLOAD_SPOOL_RETRY_DELAY', cls.DEFAULT_RETRY_DELAY),
+            max_retry_delay=settings.getfloat('S3_UPLOAD_SPOOL_MAX_RETRY_DELAY', cls.DEFAULT_MAX_RETRY_DELAY),
+            stats=stats
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    def store(self, fileobj, position, bucket_name, key, content_type=None, compression=None, content_encoding=None):
+        """Spools file object from `position`, returns Deferred which fires with the key once it is uploaded.
+
+        File object is compressed by `compression`, or it is compressed already with `content_encoding`.
+        """
+        entry = SpoolEntry(self.own_path, bucket_name, key, content_type,
+                           compression.content_encoding if compression is not None else content_encoding)
+
+        def write():
+            fileobj.seek(position)
+            temp_path = '{}.tmp'.format(entry.data_path)
+            with open(temp_path, 'wb') as f:
+                if compression is not None:
+                    compression.copy(fileobj, f)
+                else:
+                    shutil.copyfileobj(fileobj, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temp_path, entry.data_path)
+            # Entry exists once its metadata is written
+            with open(entry.meta_path, 'w') as f:
+                json.dump(entry.to_dict(), f)
+
+        def spooled(_):
+            logger.warning('Upload of {} is spooled, retry in {} seconds'.format(key, self.get_retry_delay(entry)))
+            self._inc_stats(self.STATS_SPOOLED)
+            self._add(entry)
+            return entry.waiting
+
+        # Outputs can be large, disk is written in the upload thread pool
+        dt = self.uploader.executor.call(write)
+        dt.addCallback(spooled)
+        return dt
+
+    def recover(self):
+        """Takes over entries left by processes which are not running, returns the number of entries.
+
+        It is called at startup, before anything is spooled. Entries in the directory of this process
+        are loaded too, as the process of a restarted container usually gets the same pid.
+        """
+        recovered = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            own = name == str(self.pid)
+            if not name.isdigit() or not os.path.isdir(path) or (not own and is_running(int(name))):
+                continue
+            for filename in os.listdir(path):
+                if filename.endswith('.tmp'):
+                    # Spooling was interrupted, its task failed without acknowledgement
+                    self._remove_file(os.path.join(path, filename))
+                    continue
+                entry_name = filename[:-len('.json')]
+                if not filename.endswith('.json') or entry_name in self.entries:
+                    continue
+                try:
+                    with open(os.path.join(path, filename)) as f:
+                        entry = SpoolEntry(self.own_path, name=entry_name, **json.load(f))
+                    if not own:
+                        # Data is moved first, so a crash in between leaves a complete entry in one of directories
+                        os.rename(os.path.join(path, '{}.data'.format(entry_name)), entry.data_path)
+                        os.rename(os.path.join(path, filename), entry.meta_path)
+                except (IOError, OSError, ValueError, TypeError) as e:
+                    logger.error('Can not recover spooled upload {}: {}'.format(entry_name, e))
+                    continue
+                entry.waiting.addErrback(lambda failure: None)
+                self._add(entry)
+                recovered += 1
+            if not own and not os.listdir(path):
+                os.rmdir(path)
+        if recovered:
+            logger.info('Recovered {} spooled uploads'.format(recovered))
+            self._inc_stats(self.STATS_RECOVERED, recovered)
+        return recovered
+
+    def get_retry_delay(self, entry):
+        return min(self.retry_delay * 2 ** entry.attempts, self.max_retry_delay)
+
+    def _add(self, entry):
+        self.entries[entry.name] = entry
+        entry.delayed_call = self.clock.callLater(self.get_retry_delay(entry), self.retry, entry)
+        self._set_stats()
+
+    def retry(self, entry):
+        entry.delayed_call = None
+        entry.attempts += 1
+        self._inc_stats(self.STATS_RETRIED)
+
+        def uploaded(key):
+            logger.info('Spooled upload of {} succeeded after {} retries'.format(entry.key, entry.attempts))
+            self._inc_stats(self.STATS_UPLOADED)
+            self._remove(entry)
+            entry.waiting.callback(key)
+
+        def failed(failure):
+            if entry.attempts < self.max_retries:
+                logger.warning('Retry {} of spooled upload {} failed: {}'.format(
+                    entry.attempts, entry.key, failure.getErrorMessage()))
+                entry.delayed_call = self.clock.callLater(self.get_retry_delay(entry), self.retry, entry)
+                self._set_stats()
+                return
+            logger.error('Spooled upload of {} is dropped after {} retries: {}'.format(
+                entry.key, entry.attempts, failure.getErrorMessage()))
+            self._inc_stats(self.STATS_DROPPED)
+            self._remove(entry)
+            entry.waiting.errback(failure)
+
+        dt = defer.maybeDeferred(self._upload, entry)
+        dt.addCallbacks(uploaded, failed)
+        return dt
+
+    def _upload(self, entry):
+        data_file = open(entry.data_path, 'rb')
+
+        def close(result):
+            data_file.close()
+            return result
+
+        # Spooled uploads must not be spooled again
+        dt = self.uploader.upload(data_file, entry.bucket_name, entry.key, content_type=entry.content_type,
+                                  content_encoding=entry.content_encoding, spool=False)
+        return dt.addBoth(close)
+
+    def _remove(self, entry):
+        del self.entries[entry.name]
+        for path in (entry.meta_path, entry.data_path):
+            self._remove_file(path)
+        self._set_stats()
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning('Can not remove spooled file {}: {}'.format(path, e))
+
+    def stop(self):
+        """Stops retries, spooled entries stay on disk for the next process."""
+        for entry in self.entries.values():
+            if entry.delayed_call is not None and entry.delayed_call.active():
+                entry.delayed_call.cancel()
+            entry.delayed_call = None
+
+    def _set_stats(self):
+        if self.stats is not None:
+            self.stats.set_value(self.STATS_DEPTH, len(self.entries))
+            self.stats.max_value(self.STATS_DEPTH_MAX, len(self.entries))
+            oldest = min([entry.created for entry in self.entries.values()] or [None])
+            self.stats.set_value(self.STATS_AGE, round(time.time() - oldest, 3) if oldest else 0)
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # Process of another user is running too
+        return e.errno == errno.EPERM
+    return True
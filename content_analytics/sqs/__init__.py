@@ -0,0 +1,9 @@
+from content_analytics.executor import ThreadPoolExecutor
+
+
+class SQSExecutor(ThreadPoolExecutor):
+    """Runs blocking boto3 SQS calls, so the reactor thread never waits for an SQS round trip."""
+
+    def __init__(self, reactor, min_threads=ThreadPoolExecutor.DEFAULT_MIN_THREADS,
+                 max_threads=ThreadPoolExecutor.DEFAULT_MAX_THREADS, name='sqs'):
+        super(SQSExecutor, self).__init__(reactor, min_threads=min_threads, max_threads=max_threads, name=name)
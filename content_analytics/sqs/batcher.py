@@ -0,0 +1,167 @@
+import logging
+
+from twisted.internet import defer, reactor
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class SQSBatchEntryError(Exception):
+    def __init__(self, code, message=None, sender_fault=False):
+        super(SQSBatchEntryError, self).__init__('{}: {}'.format(code, message))
+        self.code = code
+        self.sender_fault = sender_fault
+
+
+class PendingEntry(object):
+    def __init__(self, entry):
+        self.entry = entry
+        self.deferred = defer.Deferred()
+        self.attempts = 0
+
+
+class Batch(object):
+    def __init__(self, queue):
+        self.queue = queue
+        self.entries = []
+        self.size = 0
+        self.timer = None
+
+
+class BaseBatcher(StatsMixin):
+    """Groups SQS entries per queue into batch API calls.
+
+    A batch is flushed when it reaches `MAX_ENTRIES` entries or `MAX_BYTES` bytes, or `linger`
+    seconds after its first entry was added. `add` returns a `Deferred` fired for that entry only,
+    so a failed entry does not affect other entries in the batch. Failed entries are retried
+    individually up to `max_retries` times, unless SQS reports a sender fault.
+    """
+    MAX_ENTRIES = 10
+    MAX_BYTES = 256 * 1024
+    DEFAULT_LINGER = 0.2
+    DEFAULT_MAX_RETRIES = 3
+
+    def __init__(self, executor, linger=DEFAULT_LINGER, max_retries=DEFAULT_MAX_RETRIES, stats=None, clock=None):
+        self.executor = executor
+        self.linger = linger
+        self.max_retries = max_retries
+        self.stats = stats
+        self.clock = clock or reactor
+        self.batches = {}
+
+    def request(self, queue, entries):
+        raise NotImplementedError
+
+    def get_entry_size(self, entry):
+        return 0
+
+    def add(self, queue, entry):
+        pending = PendingEntry(entry)
+        self._enqueue(queue, pending)
+        return pending.deferred
+
+    def flush(self, key):
+        batch = self.batches.pop(key, None)
+        if batch is None:
+            return defer.succeed(None)
+        if batch.timer and batch.timer.active():
+            batch.timer.cancel()
+
+        entries = [dict(pending.entry, Id=str(number)) for number, pending in enumerate(batch.entries)]
+        self._inc_stats('calls')
+        self._inc_stats('entries', len(entries))
+        self._set_fill_ratio()
+
+        dt = self.executor.call(self.request, batch.queue, entries)
+        dt.addCallbacks(
+            self._process_response, self._process_error,
+            callbackArgs=(batch,), errbackArgs=(batch,)
+        )
+        return dt
+
+    def flush_all(self):
+        return defer.DeferredList([self.flush(key) for key in list(self.batches)])
+
+    def __len__(self):
+        return sum(len(batch.entries) for batch in self.batches.values())
+
+    def _enqueue(self, queue, pending):
+        key = queue.url
+        size = self.get_entry_size(pending.entry)
+
+        batch = self.batches.get(key)
+        if batch is not None and batch.size + size > self.MAX_BYTES:
+            self.flush(key)
+            batch = None
+
+        if batch is None:
+            batch = self.batches[key] = Batch(queue)
+            batch.timer = self.clock.callLater(self.linger, self.flush, key)
+
+        batch.entries.append(pending)
+        batch.size += size
+        if len(batch.entries) >= self.MAX_ENTRIES:
+            self.flush(key)
+
+    def _process_response(self, response, batch):
+        failed = dict((entry.get('Id'), entry) for entry in (response or {}).get('Failed', []))
+        for number, pending in enumerate(batch.entries):
+            entry = failed.get(str(number))
+            if entry is None:
+                pending.deferred.callback(pending.entry)
+                continue
+            self._inc_stats('failed')
+            self._retry(batch.queue, pending, SQSBatchEntryError(
+                entry.get('Code'),
+                entry.get('Message'),
+                entry.get('SenderFault', False)
+            ))
+
+    def _process_error(self, failure, batch):
+        logger.error('Error while sending batch of {} entries to {}: {}'.format(
+            len(batch.entries),
+            batch.queue.url,
+            failure.getErrorMessage()
+        ))
+        self._inc_stats('errors')
+        for pending in batch.entries:
+            self._retry(batch.queue, pending, failure)
+
+    def _retry(self, queue, pending, error):
+        pending.attempts += 1
+        if getattr(error, 'sender_fault', False) or pending.attempts > self.max_retries:
+            logger.error('Entry {} for {} failed after {} attempts: {}'.format(
+                pending.entry, queue.url, pending.attempts, error
+            ))
+            pending.deferred.errback(error)
+            return
+        self._inc_stats('retried')
+        self._enqueue(queue, pending)
+
+    def _set_fill_ratio(self):
+        if self.stats is not None:
+            calls = self.stats.get_value(self._stats_key('calls'), 0)
+            entries = self.stats.get_value(self._stats_key('entries'), 0)
+            if calls:
+                self.stats.set_value(
+                    self._stats_key('fill_ratio'),
+                    round(float(entries) / (calls * self.MAX_ENTRIES), 3)
+                )
+
+
+class SendMessageBatcher(BaseBatcher):
+    stats_prefix = 'sqs/batch/send'
+
+    def request(self, queue, entries):
+        return queue.send_messages(Entries=entries)
+
+    def get_entry_size(self, entry):
+        return len(entry.get('MessageBody', ''))
+
+
+class DeleteMessageBatcher(BaseBatcher):
+    stats_prefix = 'sqs/batch/delete'
+
+    def request(self, queue, entries):
+        return queue.delete_messages(Entries=entries)
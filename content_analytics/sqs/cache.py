@@ -0,0 +1,78 @@
+import logging
+
+from twisted.internet import defer, reactor
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class QueueHandleCache(StatsMixin):
+    """Keyed cache of resolved SQS queue handles.
+
+    Resolved handles are kept for `ttl` seconds, resolution errors for `negative_ttl` seconds.
+    Concurrent lookups of the same queue name share a single resolution call.
+    """
+    DEFAULT_TTL = 3600
+    DEFAULT_NEGATIVE_TTL = 60
+
+    STATS_HIT = 'sqs/queue_cache/hit'
+    STATS_MISS = 'sqs/queue_cache/miss'
+    STATS_NEGATIVE_HIT = 'sqs/queue_cache/negative_hit'
+    STATS_ERRORS = 'sqs/queue_cache/errors'
+
+    def __init__(self, executor, resolve, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, stats=None, clock=None):
+        self.executor = executor
+        self.resolve = resolve
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stats = stats
+        self.clock = clock or reactor
+        self.entries = {}
+        self.waiters = {}
+
+    def get(self, name):
+        now = self.clock.seconds()
+        entry = self.entries.get(name)
+        if entry is not None:
+            expires, queue, failure = entry
+            if expires > now:
+                if failure is not None:
+                    self._inc_stats(self.STATS_NEGATIVE_HIT)
+                    return defer.fail(failure)
+                self._inc_stats(self.STATS_HIT)
+                return defer.succeed(queue)
+            del self.entries[name]
+
+        result = defer.Deferred()
+        waiters = self.waiters.get(name)
+        if waiters is not None:
+            # Resolution is already in flight, just wait for it
+            self._inc_stats(self.STATS_HIT)
+            waiters.append(result)
+            return result
+
+        self._inc_stats(self.STATS_MISS)
+        self.waiters[name] = [result]
+        dt = self.executor.call(self.resolve, name)
+        dt.addCallbacks(self._resolved, self._failed, callbackArgs=(name,), errbackArgs=(name,))
+        return result
+
+    def invalidate(self, name):
+        self.entries.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def _resolved(self, queue, name):
+        logger.debug('SQS queue {} resolved to {}'.format(name, getattr(queue, 'url', queue)))
+        self.entries[name] = (self.clock.seconds() + self.ttl, queue, None)
+        for waiter in self.waiters.pop(name, []):
+            waiter.callback(queue)
+
+    def _failed(self, failure, name):
+        logger.error('Error while resolving SQS queue {}: {}'.format(name, failure.getErrorMessage()))
+        self._inc_stats(self.STATS_ERRORS)
+        self.entries[name] = (self.clock.seconds() + self.negative_ttl, None, failure)
+        for waiter in self.waiters.pop(name, []):
+            waiter.errback(failure)
@@ -0,0 +1,147 @@
+import random
+import logging
+
+from twisted.internet import task
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class VisibilityHeartbeat(StatsMixin):
+    """Single scheduler that extends visibility timeout of every in-flight SQS message.
+
+    Receipt handles which become due are coalesced into `change_message_visibility_batch` calls
+    of up to `BATCH_SIZE` entries. A handle is renewed once it is within `window` seconds of its
+    due time, so handles registered close to each other share the same call. Batches of one tick
+    are sent `spread` seconds apart to avoid bursts of API calls.
+    """
+    BATCH_SIZE = 10
+    INVALID_HANDLE_CODES = ('ReceiptHandleIsInvalid', 'MessageNotInflight', 'InvalidParameterValue')
+
+    STATS_CALLS = 'sqs/heartbeat/calls'
+    STATS_ENTRIES = 'sqs/heartbeat/entries'
+    STATS_FAILED = 'sqs/heartbeat/failed'
+    STATS_ERRORS = 'sqs/heartbeat/errors'
+
+    def __init__(self, executor, queue, visibility_timeout, offset, stats=None, clock=None, on_failure=None):
+        assert 0 < offset < visibility_timeout
+        self.executor = executor
+        self.queue = queue
+        self.stats = stats
+        self.on_failure = on_failure
+        self.visibility_timeout = visibility_timeout
+        self.interval = visibility_timeout - offset
+        self.tick_interval = max(offset / 4.0, 0.5)
+        self.window = offset / 2.0
+        self.spread = min(self.tick_interval / self.BATCH_SIZE, 0.2)
+        self.handles = {}
+
+        self.looping_call = task.LoopingCall(self.tick)
+        if clock is not None:
+            self.looping_call.clock = clock
+        self.clock = self.looping_call.clock
+
+    def start(self):
+        if not self.looping_call.running:
+            # Random phase, so several runner processes do not tick at the same moments
+            self.clock.callLater(random.uniform(0, self.tick_interval), self._start)
+
+    def _start(self):
+        if not self.looping_call.running:
+            self.looping_call.start(self.tick_interval, now=False)
+
+    def stop(self):
+        if self.looping_call.running:
+            self.looping_call.stop()
+
+    def register(self, receipt_handle, deadline=None):
+        """Starts renewing the message, `deadline` is when its current visibility timeout ends."""
+        if deadline is None:
+            self.handles[receipt_handle] = self.clock.seconds() + self.interval
+        else:
+            self.handles[receipt_handle] = deadline - (self.visibility_timeout - self.interval)
+
+    def unregister(self, receipt_handle):
+        return self.handles.pop(receipt_handle, None) is not None
+
+    def __contains__(self, receipt_handle):
+        return receipt_handle in self.handles
+
+    def __len__(self):
+        return len(self.handles)
+
+    def tick(self):
+        now = self.clock.seconds()
+        due = sorted(
+            (due_time, receipt_handle)
+            for receipt_handle, due_time in self.handles.items()
+            if due_time <= now + self.window
+        )
+        if not due:
+            return
+
+        receipt_handles = [receipt_handle for _, receipt_handle in due]
+        for receipt_handle in receipt_handles:
+            # Renewed optimistically; failed calls put handles back as due
+            self.handles[receipt_handle] = now + self.interval
+
+        for number, start in enumerate(range(0, len(receipt_handles), self.BATCH_SIZE)):
+            batch = receipt_handles[start:start + self.BATCH_SIZE]
+            if number:
+                self.clock.callLater(number * self.spread, self.send, batch)
+            else:
+                self.send(batch)
+
+    def send(self, receipt_handles):
+        receipt_handles = [receipt_handle for receipt_handle in receipt_handles if receipt_handle in self.handles]
+        if not receipt_handles:
+            return
+
+        entries = [{
+            'Id': str(number),
+            'ReceiptHandle': receipt_handle,
+            'VisibilityTimeout': self.visibility_timeout
+        } for number, receipt_handle in enumerate(receipt_handles)]
+
+        self._inc_stats(self.STATS_CALLS)
+        self._inc_stats(self.STATS_ENTRIES, len(entries))
+        dt = self.executor.call(self.queue.change_message_visibility_batch, Entries=entries)
+        dt.addCallback(self.process_response, receipt_handles)
+        dt.addErrback(self.process_error, receipt_handles)
+        return dt
+
+    def process_response(self, response, receipt_handles):
+        for failed in (response or {}).get('Failed', []):
+            try:
+                receipt_handle = receipt_handles[int(failed.get('Id'))]
+            except (TypeError, ValueError, IndexError):
+                logger.warning('Unknown entry in visibility batch response {}'.format(failed))
+                continue
+
+            code = failed.get('Code')
+            self._inc_stats(self.STATS_FAILED)
+            self._inc_stats('{}/{}'.format(self.STATS_FAILED, code))
+            if code in self.INVALID_HANDLE_CODES or failed.get('SenderFault'):
+                logger.warning('Visibility of message {} can not be changed anymore ({}: {}), stop updating it'.format(
+                    receipt_handle, code, failed.get('Message')
+                ))
+                if self.unregister(receipt_handle) and self.on_failure:
+                    self.on_failure(receipt_handle, code)
+            else:
+                logger.warning('Visibility of message {} was not changed ({}), will retry'.format(receipt_handle, code))
+                self._retry(receipt_handle)
+        return response
+
+    def process_error(self, failure, receipt_handles):
+        self._inc_stats(self.STATS_ERRORS)
+        logger.error('Error while updating visibility timeout of {} messages: {}'.format(
+            len(receipt_handles),
+            failure.getErrorMessage()
+        ))
+        for receipt_handle in receipt_handles:
+            self._retry(receipt_handle)
+
+    def _retry(self, receipt_handle):
+        if receipt_handle in self.handles:
+            self.handles[receipt_handle] = self.clock.seconds()
@@ -0,0 +1,338 @@
+import time
+import logging
+
+from collections import deque
+
+from twisted.internet import defer, reactor, task
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class InputQueue(object):
+    """Input SQS queue consumed by `PriorityPoller` together with its local prefetch buffer."""
+
+    def __init__(self, name, queue, weight=1, urgent=False, visibility_timeout=300, heartbeat=None):
+        assert weight > 0
+        self.name = name
+        self.queue = queue
+        self.weight = weight
+        self.urgent = urgent
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat = heartbeat
+        # (visibility deadline, raw message)
+        self.buffer = deque()
+        self.receiving = None
+        self.receives = 0
+        self.current_weight = 0
+
+    @property
+    def kind(self):
+        return 'urgent' if self.urgent else 'normal'
+
+    def __repr__(self):
+        return '<InputQueue {} ({}, weight {})>'.format(self.name, self.kind, self.weight)
+
+
+class PriorityPoller(StatsMixin):
+    """Receives messages from several input queues in the background and admits them by priority.
+
+    Every queue has a local buffer of up to `prefetch` received messages, which is kept topped up
+    with long polling (`wait_time` seconds) once the poller is started. With `strict` priority
+    urgent queues are always drained first, so urgent tasks are admitted before any buffered normal
+    task. With `weighted` priority messages are taken from non-empty buffers by smooth weighted
+    round-robin.
+
+    Visibility deadline of every buffered message is tracked. Messages which can not be started
+    at least `release_margin` seconds before their deadline are released with visibility 0,
+    so another consumer can take them right away instead of waiting for the timeout. If the runner
+    has no free slots (see `free_slots`), a message starts once enough tasks have finished, so its
+    start is estimated from the interval between finished tasks. Busy runners buffer only as many
+    messages beyond their free slots as they can start in time.
+
+    `poll` returns a `Deferred` fired with a list of `(input_queue, raw_message, deadline)` tuples,
+    or with an empty list once every queue has been checked since the call and had nothing.
+    """
+    STRICT = 'strict'
+    WEIGHTED = 'weighted'
+
+    DEFAULT_PREFETCH = 10
+    DEFAULT_WAIT_TIME = 20
+    DEFAULT_RELEASE_MARGIN = 30
+    RECEIVE_RETRY_DELAY = 5
+    MAX_MESSAGES = 10
+    # Weight of the last interval in the moving average of intervals between finished tasks
+    FINISH_INTERVAL_WEIGHT = 0.2
+
+    stats_prefix = 'sqs/poller'
+
+    def __init__(self, executor, queues, mode=STRICT, prefetch=DEFAULT_PREFETCH, wait_time=DEFAULT_WAIT_TIME,
+                 release_margin=DEFAULT_RELEASE_MARGIN, free_slots=None, stats=None, clock=None):
+        assert queues and mode in (self.STRICT, self.WEIGHTED)
+        assert all(release_margin < queue.visibility_timeout for queue in queues)
+        self.executor = executor
+        self.queues = sorted(queues, key=lambda queue: (not queue.urgent, -queue.weight))
+        self.mode = mode
+        self.prefetch = prefetch
+        self.wait_time = wait_time
+        self.release_margin = release_margin
+        # Callable returning the number of tasks the runner can start now, unlimited if not set
+        self.free_slots = free_slots
+        # Moving average of seconds between finished tasks, i.e. how often a slot gets free
+        self.finish_interval = None
+        self.last_finished = None
+        self.stats = stats
+        self.clock = clock or reactor
+        self.running = False
+        self.waiters = []
+
+        self.looping_call = task.LoopingCall(self.tick)
+        self.looping_call.clock = self.clock
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.looping_call.start(max(self.release_margin / 4.0, 1), now=False)
+        self.refill()
+
+    def stop(self):
+        """Stops receiving and releases buffered messages once in-flight receives are done."""
+        self.running = False
+        if self.looping_call.running:
+            self.looping_call.stop()
+        receiving = [queue.receiving for queue in self.queues if queue.receiving is not None]
+        dt = defer.DeferredList(receiving)
+        dt.addCallback(lambda _: self.release_all())
+        return dt
+
+    def poll(self, count):
+        assert count > 0
+        if self.buffered():
+            taken = self.take(count)
+            # Taken messages occupy slots as soon as the runner gets them
+            self.refill(reserved=len(taken))
+            return defer.succeed(taken)
+
+        waiter = defer.Deferred()
+        waiter.receives = dict((queue, queue.receives) for queue in self.queues)
+        waiter.addCallback(lambda _: self.take(count))
+        self.waiters.append(waiter)
+        self.refill()
+        return waiter
+
+    def tick(self):
+        self.release_expiring()
+        if self.running:
+            self.refill()
+
+    def buffered(self):
+        self.release_expiring()
+        return sum(len(queue.buffer) for queue in self.queues)
+
+    def take(self, count):
+        self.release_expiring()
+        if self.mode == self.STRICT:
+            taken = self._take_strict(count)
+        else:
+            taken = self._take_weighted(count)
+        now = time.time()
+        for queue, raw_message, _ in taken:
+            self._inc_stats('{}/admitted'.format(queue.kind))
+            sent_time = self.get_sent_time(raw_message)
+            if sent_time is not None:
+                self._observe('{}/admission_latency'.format(queue.kind), now - sent_time)
+        self._set_buffered_stats()
+        return taken
+
+    def refill(self, reserved=0):
+        free_slots = self.get_free_slots(reserved)
+        for queue in self.queues:
+            prefetch = self.prefetch
+            if free_slots is not None and self.finish_interval:
+                # Messages beyond free slots wait for finished tasks, only those which can start in time are kept
+                startable = int((queue.visibility_timeout - self.release_margin) / self.finish_interval)
+                prefetch = min(prefetch, free_slots + startable)
+            free = prefetch - len(queue.buffer)
+            if queue.receiving is not None or free <= 0:
+                continue
+            # Until the poller is started receives are plain short polls
+            wait_time = self.wait_time if self.running else 0
+            dt = queue.receiving = self.executor.call(
+                queue.queue.receive_messages,
+                MaxNumberOfMessages=min(free, self.MAX_MESSAGES),
+                VisibilityTimeout=queue.visibility_timeout,
+                WaitTimeSeconds=wait_time,
+                AttributeNames=['SentTimestamp']
+            )
+            dt.addCallbacks(self._received, self._receive_failed, callbackArgs=(queue,), errbackArgs=(queue,))
+
+    def release_expiring(self):
+        now = self.clock.seconds()
+        free_slots = self.get_free_slots()
+        # Messages of earlier queues are admitted first, so they take free slots first
+        position = 0
+        for queue in self.queues:
+            kept, expiring = deque(), []
+            for deadline, raw_message in queue.buffer:
+                if now + self.get_start_delay(position, free_slots) + self.release_margin >= deadline:
+                    expiring.append(raw_message)
+                else:
+                    kept.append((deadline, raw_message))
+                    position += 1
+            queue.buffer = kept
+            if expiring:
+                logger.info('{} prefetched messages from {} were not started in time, releasing them'.format(
+                    len(expiring), queue.name
+                ))
+                self.release(queue, expiring)
+
+    def release_all(self):
+        calls = []
+        for queue in self.queues:
+            messages = [raw_message for _, raw_message in queue.buffer]
+            queue.buffer.clear()
+            calls.append(self.release(queue, messages))
+        self._set_buffered_stats()
+        return defer.DeferredList(calls)
+
+    def release(self, queue, raw_messages):
+        """Makes messages visible again right away."""
+        calls = []
+        for start in range(0, len(raw_messages), self.MAX_MESSAGES):
+            entries = [{
+                'Id': str(number),
+                'ReceiptHandle': raw_message.receipt_handle,
+                'VisibilityTimeout': 0
+            } for number, raw_message in enumerate(raw_messages[start:start + self.MAX_MESSAGES])]
+            self._inc_stats('{}/released'.format(queue.kind), len(entries))
+            dt = self.executor.call(queue.queue.change_message_visibility_batch, Entries=entries)
+            dt.addErrback(self._release_failed, queue, len(entries))
+            calls.append(dt)
+        return defer.DeferredList(calls)
+
+    def get_free_slots(self, reserved=0):
+        if self.free_slots is None:
+            return None
+        return max(self.free_slots() - reserved, 0)
+
+    def get_start_delay(self, position, free_slots):
+        """Estimated seconds until a buffered message at `position` can start."""
+        if free_slots is None or position < free_slots or not self.finish_interval:
+            return 0
+        return (position - free_slots + 1) * self.finish_interval
+
+    def task_finished(self, queue, raw_message):
+        now = self.clock.seconds()
+        if self.last_finished is not None:
+            interval = now - self.last_finished
+            if self.finish_interval is None:
+                self.finish_interval = interval
+            else:
+                self.finish_interval += (interval - self.finish_interval) * self.FINISH_INTERVAL_WEIGHT
+        self.last_finished = now
+        sent_time = self.get_sent_time(raw_message)
+        if sent_time is not None:
+            self._observe('{}/task_latency'.format(queue.kind), time.time() - sent_time)
+
+    @staticmethod
+    def get_sent_time(raw_message):
+        try:
+            return int((raw_message.attributes or {}).get('SentTimestamp')) / 1000.0
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def get_received_time(raw_message):
+        # Messages handed by the supervisor have been received before, see `SupervisedMessage`
+        received = getattr(raw_message, 'received', None)
+        return received if isinstance(received, (int, float)) else None
+
+    def _take_strict(self, count):
+        taken = []
+        for queue in self.queues:
+            while queue.buffer and len(taken) < count:
+                deadline, raw_message = queue.buffer.popleft()
+                taken.append((queue, raw_message, deadline))
+        return taken
+
+    def _take_weighted(self, count):
+        taken = []
+        while len(taken) < count:
+            candidates = [queue for queue in self.queues if queue.buffer]
+            if not candidates:
+                break
+            total = sum(queue.weight for queue in candidates)
+            for queue in candidates:
+                queue.current_weight += queue.weight
+            selected = max(candidates, key=lambda queue: queue.current_weight)
+            selected.current_weight -= total
+            deadline, raw_message = selected.buffer.popleft()
+            taken.append((selected, raw_message, deadline))
+        return taken
+
+    def _received(self, messages, queue):
+        queue.receiving = None
+        queue.receives += 1
+        messages = messages or []
+        now = self.clock.seconds()
+        if not self.running and not self.waiters:
+            # Nobody is going to take them anymore
+            self.release(queue, messages)
+        else:
+            queue.buffer.extend(
+                ((self.get_received_time(raw_message) or now) + queue.visibility_timeout, raw_message)
+                for raw_message in messages
+            )
+        self._inc_stats('{}/received'.format(queue.kind), len(messages))
+        if not messages:
+            self._inc_stats('{}/empty_receives'.format(queue.kind))
+        self._set_buffered_stats()
+        self._notify()
+        if self.running:
+            self.refill()
+
+    def _receive_failed(self, failure, queue):
+        queue.receives += 1
+        self._inc_stats('{}/errors'.format(queue.kind))
+        logger.error('Error while receiving SQS messages from {}: {}'.format(queue.name, failure.getErrorMessage()))
+        self._notify(failure)
+        if self.running:
+            # Keep the queue marked as receiving meanwhile, so it is not retried in a hot loop
+            queue.receiving = task.deferLater(self.clock, self.RECEIVE_RETRY_DELAY, self._retry, queue)
+        else:
+            queue.receiving = None
+
+    def _retry(self, queue):
+        queue.receiving = None
+        if self.running:
+            self.refill()
+
+    def _release_failed(self, failure, queue, count):
+        self._inc_stats('{}/release_errors'.format(queue.kind))
+        logger.error('Error while releasing {} prefetched messages from {}: {}'.format(
+            count, queue.name, failure.getErrorMessage()
+        ))
+
+    def _notify(self, failure=None):
+        # Waiters get messages as soon as any queue has them,
+        # or nothing once every queue has been checked since they started to wait
+        if not self.waiters:
+            return
+        buffered = self.buffered()
+        ready = []
+        for waiter in self.waiters:
+            if buffered or all(queue.receives > receives for queue, receives in waiter.receives.items()):
+                ready.append(waiter)
+        for waiter in ready:
+            self.waiters.remove(waiter)
+            if failure is not None and not self.buffered():
+                waiter.errback(failure)
+            else:
+                waiter.callback(None)
+
+    def _set_buffered_stats(self):
+        if self.stats is not None:
+            for queue in self.queues:
+                self.stats.set_value(self._stats_key('{}/buffered'.format(queue.kind)), len(queue.buffer))
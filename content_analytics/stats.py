@@ -0,0 +1,26 @@
+class StatsMixin(object):
+    """Stats helpers for components with optional `stats` collector.
+
+    Keys are prefixed with `stats_prefix` if it is set.
+    """
+    stats = None
+    stats_prefix = None
+
+    def _stats_key(self, key):
+        if self.stats_prefix:
+            return '{}/{}'.format(self.stats_prefix, key)
+        return key
+
+    def _inc_stats(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(self._stats_key(key), count)
+
+    def _observe(self, key, value):
+        """Keeps count, running average and maximum of observed values."""
+        if self.stats is not None:
+            key = self._stats_key(key)
+            count = self.stats.get_value('{}_count'.format(key), 0) + 1
+            average = self.stats.get_value('{}_avg'.format(key), 0.0)
+            self.stats.set_value('{}_count'.format(key), count)
+            self.stats.set_value('{}_avg'.format(key), round(average + (value - average) / count, 3))
+            self.stats.max_value('{}_max'.format(key), round(value, 3))
@@ -0,0 +1,441 @@
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import logging
+import threading
+import multiprocessing
+
+from collections import deque
+
+from scrapy.exceptions import NotConfigured
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.project import get_project_settings
+
+from content_analytics.backends import QUEUE, create_resource
+from content_analytics.memory import RECYCLE_EXIT_CODE
+from content_analytics.utils import aws_from_settings
+
+
+NORMAL = 'normal'
+URGENT = 'urgent'
+
+
+class SupervisedMessage(object):
+    """Picklable copy of boto3 SQS message which is handed from supervisor to a worker."""
+
+    def __init__(self, message_id, receipt_handle, body, attributes=None, message_attributes=None, received=None):
+        self.message_id = message_id
+        self.receipt_handle = receipt_handle
+        self.body = body
+        self.attributes = attributes or {}
+        self.message_attributes = message_attributes or {}
+        # Visibility timeout of the message runs since the supervisor received it, not since the hand-off
+        self.received = received
+
+    @classmethod
+    def from_message(cls, message, received=None):
+        return cls(message.message_id, message.receipt_handle, message.body,
+                   message.attributes, message.message_attributes, received)
+
+    def __repr__(self):
+        return '<SupervisedMessage {}>'.format(self.message_id)
+
+
+class WorkerConnection(object):
+    """Worker side of the supervisor pipes, one per input queue. Safe to use from the reactor and SQS threads.
+
+    Receives wait for the answer of the supervisor, which comes only at the end of the long poll,
+    so they are serialized by the lock of their queue and a long poll of the normal queue never
+    delays urgent messages. Sends only share the lock of the write end, so stats sent from the
+    reactor thread never wait for a pending receive.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.receive_locks = dict((kind, threading.Lock()) for kind in connections)
+        self.send_locks = dict((kind, threading.Lock()) for kind in connections)
+
+    def receive(self, kind, number_of_messages, wait_time=0):
+        with self.receive_locks[kind]:
+            try:
+                self.send(kind, ('receive', number_of_messages, wait_time))
+                return self.connections[kind].recv()
+            except (EOFError, IOError) as e:
+                # Supervisor is gone, runner shuts down as soon as it has no tasks left
+                self.logger.error('Supervisor connection is closed: {}'.format(e))
+                return []
+
+    def send(self, kind, request):
+        with self.send_locks[kind]:
+            self.connections[kind].send(request)
+
+    def send_stats(self, stats):
+        try:
+            self.send(NORMAL, ('stats', stats))
+        except (EOFError, IOError) as e:
+            self.logger.error('Can not send stats to supervisor: {}'.format(e))
+
+
+class SupervisedQueue(object):
+    """Input SQS queue of a worker: messages come from the supervisor, everything else goes to SQS."""
+
+    def __init__(self, queue, connection, kind=NORMAL):
+        self.queue = queue
+        self.connection = connection
+        self.kind = kind
+
+    def __getattr__(self, name):
+        return getattr(self.queue, name)
+
+    def receive_messages(self, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        return self.connection.receive(self.kind, MaxNumberOfMessages, WaitTimeSeconds)
+
+
+def run_worker(connections, settings):
+    # Reactor is imported only in the worker process, the supervisor does not use it
+    from content_analytics.runner import Runner
+    if Runner(settings, supervisor=WorkerConnection(connections)).recycling:
+        sys.exit(RECYCLE_EXIT_CODE)
+
+
+class Worker(object):
+    def __init__(self, number, process, connections):
+        self.number = number
+        self.process = process
+        # Pipe and pending receive request per input queue kind
+        self.connections = connections
+        self.requests = {}
+        self.stats = {}
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+
+class PrefetchedQueue(object):
+    """Input SQS queue of the supervisor with its buffer of prefetched messages."""
+
+    def __init__(self, kind, queue, visibility_timeout, visibility_timeout_offset):
+        self.kind = kind
+        self.queue = queue
+        self.visibility_timeout = visibility_timeout
+        self.visibility_timeout_offset = visibility_timeout_offset
+        # (time of receiving, message)
+        self.buffer = deque()
+        self.receives = 0
+
+    def __repr__(self):
+        return '<PrefetchedQueue {}>'.format(self.kind)
+
+
+def aggregate_stats(snapshots):
+    """Combines numeric stats of all workers.
+
+    Maximums and minimums are taken over workers, running averages (see `StatsMixin._observe`) are
+    weighted by their counts and other float values (ratios) are averaged. Everything else is a
+    counter or gauge and is summed.
+    """
+    values = {}
+    for snapshot in snapshots:
+        for key, value in snapshot.items():
+            if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+                continue
+            values.setdefault(key, []).append((value, snapshot))
+
+    aggregated = {}
+    for key, pairs in values.items():
+        numbers = [value for value, _ in pairs]
+        if key.endswith('_max'):
+            aggregated[key] = max(numbers)
+        elif key.endswith('_min'):
+            aggregated[key] = min(numbers)
+        elif key.endswith('_avg'):
+            count_key = '{}_count'.format(key[:-len('_avg')])
+            weights = [snapshot.get(count_key, 1) for _, snapshot in pairs]
+            if sum(weights):
+                aggregated[key] = round(float(sum(v * w for v, w in zip(numbers, weights))) / sum(weights), 3)
+            else:
+                aggregated[key] = round(float(sum(numbers)) / len(numbers), 3)
+        elif any(isinstance(value, float) for value in numbers):
+            aggregated[key] = round(float(sum(numbers)) / len(numbers), 3)
+        else:
+            aggregated[key] = sum(numbers)
+    return aggregated
+
+
+class Supervisor(object):
+    """Runs several `Runner` worker processes fed from a single SQS receiver per input queue.
+
+    The supervisor prefetches messages from the input queue (and the urgent queue, if it is set) in
+    background threads and hands them over pipes to workers which ask for them. Workers do everything
+    else by themselves (visibility heartbeat, output messages, acknowledgements), since receipt
+    handles are valid for any client. Crashed and recycled workers are restarted, workers which
+    stopped after the grace period are not.
+    """
+    DEFAULT_PREFETCH = 10
+    DEFAULT_RESTART_DELAY = 5
+    DEFAULT_STATS_INTERVAL = 60
+    DEFAULT_VISIBILITY_TIMEOUT = 300
+    DEFAULT_VISIBILITY_TIMEOUT_OFFSET = 10
+    DEFAULT_WAIT_TIME = 20
+    POLL_INTERVAL = 0.1
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, settings=None):
+        self.settings = settings or get_project_settings()
+        self.stats = StatsCollector(self)
+        self.workers_count = self.settings.getint('RUNNER_WORKERS', 0) or multiprocessing.cpu_count()
+        self.prefetch = self.settings.getint('RUNNER_SUPERVISOR_PREFETCH', self.DEFAULT_PREFETCH)
+        self.restart_delay = self.settings.getfloat('RUNNER_SUPERVISOR_RESTART_DELAY', self.DEFAULT_RESTART_DELAY)
+        self.wait_time = self.settings.getint('RUNNER_SUPERVISOR_WAIT_TIME', self.DEFAULT_WAIT_TIME)
+        self.stats_interval = self.settings.getint('RUNNER_STATS_INTERVAL', self.DEFAULT_STATS_INTERVAL)
+        self.workers = {}
+        self.restarts = []
+        self.finished_stats = []
+        # Input queues by kind, see `setup_input_queues`
+        self.queues = {}
+        self.buffer_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.prefetchers = []
+
+    def start(self):
+        self.setup_input_queues()
+        self.logger.info('Starting {} runner workers'.format(self.workers_count))
+        for number in range(self.workers_count):
+            self.start_worker(number)
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for queue in self.queues.values():
+            prefetcher = threading.Thread(target=self.prefetch_messages, args=(queue,),
+                                          name='sqs-prefetch-{}'.format(queue.kind))
+            prefetcher.daemon = True
+            prefetcher.start()
+            self.prefetchers.append(prefetcher)
+
+        last_stats = time.time()
+        while self.workers or self.restarts:
+            self.process_requests()
+            self.serve_requests()
+            self.check_workers()
+            if self.stats_interval > 0 and time.time() - last_stats >= self.stats_interval:
+                self.log_stats()
+                last_stats = time.time()
+
+        self.stopping.set()
+        self.release_buffer()
+        self.log_stats()
+
+    def stop(self, signum=None, frame=None):
+        self.logger.info('Stopping runner workers')
+        self.stopping.set()
+        self.restarts = []
+        for worker in self.workers.values():
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def setup_input_queues(self):
+        input_queue_settings = aws_from_settings(self.settings, prefix='INPUT_QUEUE_')
+        if input_queue_settings is None or not all(input_queue_settings.values()):
+            raise NotConfigured('AWS region, key and secret are required for input SQS queue!')
+        input_queue_name = self.settings.get('INPUT_QUEUE_NAME', None)
+        if not input_queue_name:
+            raise NotConfigured('SQS input queue name must be set!')
+        resource = create_resource(self.settings, QUEUE, input_queue_settings)
+        timeout_offset = self.settings.getint(
+            'INPUT_QUEUE_VISIBILITY_TIMEOUT_OFFSET',
+            self.DEFAULT_VISIBILITY_TIMEOUT_OFFSET
+        )
+        input_queue = resource.get_queue_by_name(QueueName=input_queue_name)
+        timeout = int(input_queue.attributes.get('VisibilityTimeout', self.DEFAULT_VISIBILITY_TIMEOUT))
+        self.queues[NORMAL] = PrefetchedQueue(NORMAL, input_queue, timeout, timeout_offset)
+
+        # Workers receive urgent messages through the supervisor too, so they do not race for them
+        urgent_queue_name = self.settings.get('INPUT_QUEUE_URGENT_NAME', None)
+        if urgent_queue_name:
+            urgent_queue = resource.get_queue_by_name(QueueName=urgent_queue_name)
+            self.queues[URGENT] = PrefetchedQueue(
+                URGENT,
+                urgent_queue,
+                int(urgent_queue.attributes.get('VisibilityTimeout', timeout)),
+                timeout_offset
+            )
+
+    def start_worker(self, number):
+        connections, child_connections = {}, {}
+        for kind in self.queues:
+            connections[kind], child_connections[kind] = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(child_connections, self.settings),
+            name='runner-{}'.format(number)
+        )
+        process.daemon = True
+        process.start()
+        for child_connection in child_connections.values():
+            child_connection.close()
+        self.workers[number] = Worker(number, process, connections)
+        self.stats.inc_value('supervisor/workers/started')
+        self.logger.info('Runner worker {} started with pid {}'.format(number, process.pid))
+
+    def check_workers(self):
+        for number, worker in list(self.workers.items()):
+            if worker.process.is_alive():
+                continue
+            worker.process.join()
+            del self.workers[number]
+            for kind in worker.connections:
+                self.read_requests(worker, kind)
+            self.finished_stats.append(worker.stats)
+            if worker.process.exitcode == 0 or self.stopping.is_set():
+                self.logger.info('Runner worker {} finished'.format(number))
+                continue
+            if worker.process.exitcode == RECYCLE_EXIT_CODE:
+                # Worker has drained its tasks after crossing its memory limits
+                self.stats.inc_value('supervisor/workers/recycled')
+                self.logger.info('Runner worker {} recycled, restarting'.format(number))
+                self.start_worker(number)
+                continue
+            self.stats.inc_value('supervisor/workers/crashed')
+            self.logger.error('Runner worker {} crashed with exit code {}, restarting in {} seconds'.format(
+                number, worker.process.exitcode, self.restart_delay
+            ))
+            self.restarts.append((time.time() + self.restart_delay, number))
+
+        for restart in list(self.restarts):
+            restart_time, number = restart
+            if restart_time <= time.time() and not self.stopping.is_set():
+                self.restarts.remove(restart)
+                self.start_worker(number)
+
+    def process_requests(self):
+        connections = {}
+        for worker in self.workers.values():
+            for kind, connection in worker.connections.items():
+                connections[connection] = (worker, kind)
+        try:
+            readable, _, _ = select.select(list(connections), [], [], self.POLL_INTERVAL)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+
+        for connection in readable:
+            self.read_requests(*connections[connection])
+
+    def read_requests(self, worker, kind):
+        connection = worker.connections[kind]
+        try:
+            while connection.poll():
+                request = connection.recv()
+                if request[0] == 'receive':
+                    _, number_of_messages, wait_time = request
+                    worker.requests[kind] = (
+                        min(number_of_messages, 10), time.time() + wait_time, self.queues[kind].receives
+                    )
+                elif request[0] == 'stats':
+                    worker.stats = request[1]
+        except (EOFError, IOError):
+            # Worker is gone, `check_workers` takes care of it
+            worker.requests.pop(kind, None)
+
+    def serve_requests(self):
+        now = time.time()
+        for worker in self.workers.values():
+            for kind, (number_of_messages, deadline, receives) in list(worker.requests.items()):
+                queue = self.queues[kind]
+                messages = self.take_messages(queue, number_of_messages)
+                # Like SQS, empty response is given only after the queue has been checked at least once
+                # since the request, long-polling workers wait until their wait time is over
+                if not messages and (deadline > now or receives == queue.receives) and not self.stopping.is_set():
+                    continue
+                del worker.requests[kind]
+                try:
+                    worker.connections[kind].send(messages)
+                except (EOFError, IOError) as e:
+                    self.logger.error('Can not send messages to runner worker {}: {}'.format(worker.number, e))
+                    self.release_messages(queue, messages)
+                    continue
+                self.stats.inc_value('supervisor/prefetch/served', len(messages))
+
+    def take_messages(self, queue, number_of_messages):
+        messages = []
+        # Messages which stayed too long in the buffer may be already received by somebody else
+        expires = time.time() - queue.visibility_timeout + queue.visibility_timeout_offset
+        with self.buffer_lock:
+            while queue.buffer and len(messages) < number_of_messages:
+                received, message = queue.buffer.popleft()
+                if received < expires:
+                    self.stats.inc_value('supervisor/prefetch/expired')
+                    continue
+                messages.append(message)
+        return messages
+
+    def prefetch_messages(self, queue):
+        while not self.stopping.is_set():
+            with self.buffer_lock:
+                free = self.prefetch - len(queue.buffer)
+            if free <= 0:
+                self.stopping.wait(self.POLL_INTERVAL)
+                continue
+            try:
+                messages = queue.queue.receive_messages(
+                    MaxNumberOfMessages=min(free, 10),
+                    WaitTimeSeconds=self.wait_time,
+                    AttributeNames=['SentTimestamp']
+                )
+            except Exception as e:
+                self.stats.inc_value('supervisor/prefetch/errors')
+                self.logger.error('Error while receiving {} SQS messages: {}'.format(queue.kind, e))
+                queue.receives += 1
+                self.stopping.wait(self.restart_delay)
+                continue
+
+            received = time.time()
+            messages = [SupervisedMessage.from_message(message, received) for message in messages]
+            self.stats.inc_value('supervisor/prefetch/received', len(messages))
+            with self.buffer_lock:
+                queue.buffer.extend((received, message) for message in messages)
+            queue.receives += 1
+            if self.stopping.is_set():
+                self.release_buffer()
+
+    def release_buffer(self):
+        for queue in self.queues.values():
+            with self.buffer_lock:
+                messages = [message for _, message in queue.buffer]
+                queue.buffer.clear()
+            self.release_messages(queue, messages)
+
+    def release_messages(self, queue, messages):
+        """Makes messages visible again right away, so other runners do not wait for visibility timeout."""
+        for start in range(0, len(messages), 10):
+            entries = [{
+                'Id': str(number),
+                'ReceiptHandle': message.receipt_handle,
+                'VisibilityTimeout': 0
+            } for number, message in enumerate(messages[start:start + 10])]
+            try:
+                queue.queue.change_message_visibility_batch(Entries=entries)
+            except Exception as e:
+                self.logger.error('Error while releasing {} prefetched {} messages: {}'.format(
+                    len(entries), queue.kind, e))
+            else:
+                self.stats.inc_value('supervisor/prefetch/released', len(entries))
+
+    def get_stats(self):
+        stats = aggregate_stats([worker.stats for worker in self.workers.values()] + self.finished_stats)
+        stats.update(self.stats.get_stats())
+        stats['supervisor/workers/alive'] = len(self.workers)
+        with self.buffer_lock:
+            for queue in self.queues.values():
+                stats['supervisor/prefetch/{}/buffered'.format(queue.kind)] = len(queue.buffer)
+        return stats
+
+    def log_stats(self):
+        self.logger.info('Supervisor stats: {}'.format(json.dumps(self.get_stats(), sort_keys=True)))
@@ -0,0 +1,152 @@
+import logging
+
+from twisted.internet import reactor
+
+from content_analytics.stats import StatsMixin
+
+logger = logging.getLogger(__name__)
+
+
+class Task(object):
+    """Input SQS message processed by the runner together with its lifecycle state.
+
+    Task moves only forward through `TaskRegistry.STATES`, some states may be skipped, e.g.
+    a task which has not scraped any item is acknowledged right after crawling. Time of every
+    transition is kept in `timestamps`.
+    """
+
+    def __init__(self, raw_message, input_queue=None, deadline=None):
+        self.raw_message = raw_message
+        self.input_queue = input_queue
+        self.deadline = deadline
+        self.message = None
+        self.state = None
+        # Set once the runner starts to send output of the task
+        self.finished = False
+        self.items = 0
+        # Key of duplicate tasks coalesced into a single crawl (see `content_analytics.coalescing`)
+        self.key = None
+        self.timestamps = {}
+        # Backstop of the runner at the task deadline, see `Runner.watch_deadline`
+        self.deadline_call = None
+
+    @property
+    def id(self):
+        return TaskRegistry.get_id(self.raw_message)
+
+    @property
+    def started(self):
+        return self.timestamps.get(TaskRegistry.RECEIVED)
+
+    def __repr__(self):
+        return '<Task {} ({})>'.format(self.id, self.state)
+
+
+class TaskRegistry(StatsMixin):
+    """In-flight tasks of the runner keyed by SQS message id.
+
+    Lookups and transitions are O(1), the number of tasks in every state is kept up to date.
+    Time spent by a task in every state goes to `runner/tasks/<state>_time` stats (average,
+    maximum and count), so the task latency is broken down by phases.
+    """
+    RECEIVED = 'received'
+    CRAWLING = 'crawling'
+    SCRAPED = 'scraped'
+    UPLOADED = 'uploaded'
+    ACKED = 'acked'
+    STATES = (RECEIVED, CRAWLING, SCRAPED, UPLOADED, ACKED)
+
+    # Tasks which still occupy a runner slot
+    IN_PROGRESS = (RECEIVED, CRAWLING)
+    # Tasks which are crawled but whose output is not sent yet
+    FINISHING = (SCRAPED, UPLOADED)
+
+    STATS_PREFIX = 'runner/tasks'
+
+    def __init__(self, stats=None, clock=None):
+        self.stats = stats
+        self.clock = clock or reactor
+        self.tasks = {}
+        self.counts = dict((state, 0) for state in self.STATES)
+
+    @staticmethod
+    def get_id(raw_message):
+        return getattr(raw_message, 'message_id', None) or raw_message.receipt_handle
+
+    def add(self, raw_message, input_queue=None, deadline=None):
+        """Registers received message, returns None if the same message is already in flight."""
+        task_id = self.get_id(raw_message)
+        if task_id in self.tasks:
+            self._inc_stats('{}/duplicates'.format(self.STATS_PREFIX))
+            logger.warning('Message {} has been received again while it is still in progress'.format(task_id))
+            return None
+        task = Task(raw_message, input_queue, deadline)
+        self.tasks[task_id] = task
+        self.transition(task, self.RECEIVED)
+        return task
+
+    def get(self, raw_message):
+        """Task of this exact message delivery or None."""
+        task = self.tasks.get(self.get_id(raw_message))
+        if task is not None and task.raw_message is raw_message:
+            return task
+        return None
+
+    def transition(self, task, state, expected=None):
+        """Moves task forward to the state and returns True.
+
+        Nothing happens and False is returned if the task is not registered, is not in one of
+        `expected` states or is already past the state.
+        """
+        if self.tasks.get(task.id) is not task:
+            return False
+        if expected is not None and task.state not in expected:
+            return False
+        if task.state is not None and self.STATES.index(state) <= self.STATES.index(task.state):
+            return False
+
+        now = self.clock.seconds()
+        if task.state is not None:
+            self.counts[task.state] -= 1
+            self._observe('{}/{}_time'.format(self.STATS_PREFIX, task.state), now - task.timestamps[task.state])
+        task.state = state
+        task.timestamps[state] = now
+        self.counts[state] += 1
+        self._inc_stats('{}/{}'.format(self.STATS_PREFIX, state))
+
+        if state == self.ACKED:
+            self._observe('{}/total_time'.format(self.STATS_PREFIX), now - task.started)
+            self.remove(task)
+        self._set_stats()
+        return True
+
+    def remove(self, task):
+        if task.deadline_call is not None and task.deadline_call.active():
+            task.deadline_call.cancel()
+        task.deadline_call = None
+        if self.tasks.get(task.id) is task:
+            del self.tasks[task.id]
+            self.counts[task.state] -= 1
+            self._set_stats()
+
+    def count(self, *states):
+        return sum(self.counts[state] for state in states)
+
+    @property
+    def in_progress(self):
+        return self.count(*self.IN_PROGRESS)
+
+    @property
+    def finishing(self):
+        return self.count(*self.FINISHING)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, raw_message):
+        return self.get(raw_message) is not None
+
+    def _set_stats(self):
+        if self.stats is not None:
+            self.stats.set_value('{}/in_progress'.format(self.STATS_PREFIX), self.in_progress)
+            self.stats.set_value('{}/finishing'.format(self.STATS_PREFIX), self.finishing)
@@ -0,0 +1,506 @@
+import time
+import shutil
+import logging
+
+from tempfile import SpooledTemporaryFile
+
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from twisted.internet import defer, reactor
+
+from content_analytics.backends import BLOB, create_resource
+from content_analytics.compression import Compression
+from content_analytics.executor import ThreadPoolExecutor
+from content_analytics.spool import UploadSpool
+from content_analytics.stats import StatsMixin
+from content_analytics.utils import aws_from_settings
+
+logger = logging.getLogger(__name__)
+
+
+def create_s3_client(settings, max_pool_connections):
+    aws_settings = aws_from_settings(settings, prefix='OUTPUT_BUCKET_')
+    if aws_settings is None or not all(aws_settings.values()):
+        aws_settings = aws_from_settings(settings, prefix='INPUT_QUEUE_') or {}
+    aws_settings['config'] = Config(max_pool_connections=max_pool_connections)
+    return create_resource(settings, BLOB, aws_settings).meta.client
+
+
+class S3Uploader(StatsMixin):
+    """Uploads files to S3 with a single client in a dedicated bounded thread pool.
+
+    The runner creates one uploader and shares it with all its crawlers, so S3 connections are
+    reused between tasks and upload bursts do not occupy the reactor thread pool. Uploads which
+    wait for a free thread are counted as queued. Multipart upload calls are retried with backoff
+    up to `retries` times, failed single uploads are retried by the spool instead.
+    """
+    DEFAULT_MAX_THREADS = 10
+    DEFAULT_RETRIES = 3
+    DEFAULT_RETRY_DELAY = 1
+
+    STATS_PENDING = 'uploads/pending'
+    STATS_QUEUED = 'uploads/queued'
+    STATS_QUEUED_MAX = 'uploads/queued_max'
+    STATS_UPLOADED = 'uploads/uploaded'
+    STATS_PARTS = 'uploads/parts'
+    STATS_FAILED = 'uploads/failed'
+    STATS_RETRIED = 'uploads/retried'
+    STATS_WAIT_TIME = 'uploads/wait_time'
+    STATS_UPLOAD_TIME = 'uploads/upload_time'
+    STATS_RAW_BYTES = 'uploads/raw_bytes'
+    STATS_COMPRESSED_BYTES = 'uploads/compressed_bytes'
+
+    def __init__(self, client, executor, max_threads=DEFAULT_MAX_THREADS, retries=DEFAULT_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY, stats=None, clock=None):
+        self.client = client
+        self.executor = executor
+        self.max_threads = max_threads
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.stats = stats
+        self.clock = clock or reactor
+        self.pending = 0
+        # Failed uploads are retried from local spool if it is configured, see `UploadSpool`
+        self.spool = None
+
+    @classmethod
+    def from_settings(cls, settings, stats=None):
+        max_threads = settings.getint('S3_UPLOAD_THREADS', cls.DEFAULT_MAX_THREADS)
+        uploader = cls(
+            # Every upload thread gets its own connection
+            client=create_s3_client(settings, max_pool_connections=max_threads),
+            executor=ThreadPoolExecutor(reactor, max_threads=max_threads, name='s3_uploads'),
+            max_threads=max_threads,
+            retries=settings.getint('S3_UPLOAD_RETRIES', cls.DEFAULT_RETRIES),
+            retry_delay=settings.getfloat('S3_UPLOAD_RETRY_DELAY', cls.DEFAULT_RETRY_DELAY),
+            stats=stats
+        )
+        if settings.get('S3_UPLOAD_SPOOL_PATH'):
+            uploader.spool = UploadSpool.from_settings(settings, uploader, stats=stats)
+        return uploader
+
+    def upload(self, fileobj, bucket_name, key, content_type=None, compression=None, content_encoding=None,
+               spool=True):
+        """Uploads file object from its current position, returns Deferred which fires with the key.
+
+        Optional `compression` (see `content_analytics.compression`) is applied in the upload thread
+        and sets Content-Encoding of the object, `content_encoding` is set for file objects which are
+        compressed already. If the upload fails and `spool` is allowed, the file is retried from the
+        spool and Deferred fires once a retry succeeds.
+        """
+        assert compression is None or content_encoding is None
+        position = fileobj.tell()
+
+        def upload():
+            extra_args = {'ContentType': content_type} if content_type else {}
+            if content_encoding:
+                extra_args['ContentEncoding'] = content_encoding
+            sizes = None
+            body = fileobj
+            if compression is not None:
+                raw_start = fileobj.tell()
+                body = compression.compress(fileobj)
+                body.seek(0, 2)
+                sizes = (fileobj.tell() - raw_start, body.tell())
+                body.seek(0)
+                extra_args['ContentEncoding'] = compression.content_encoding
+            try:
+                self.client.upload_fileobj(
+                    Fileobj=body,
+                    Bucket=bucket_name,
+                    Key=key,
+                    ExtraArgs=extra_args or None,
+                    # Single part upload in the calling thread, the thread pool bounds concurrency
+                    Config=TransferConfig(use_threads=False)
+                )
+            finally:
+                if body is not fileobj:
+                    body.close()
+            return sizes
+
+        def uploaded(sizes):
+            self._inc_stats(self.STATS_UPLOADED)
+            if sizes is not None:
+                self.add_compressed(*sizes)
+            return key
+
+        def spooled(failure):
+            logger.warning('Error while uploading {}: {}'.format(key, failure.getErrorMessage()))
+            return self.spool.store(fileobj, position, bucket_name, key, content_type, compression,
+                                    content_encoding)
+
+        dt = self._submit(upload).addCallback(uploaded)
+        if spool and self.spool is not None:
+            dt.addErrback(spooled)
+        return dt
+
+    def compress(self, fileobj, compression):
+        """Compresses file object from its current position in the upload thread pool.
+
+        Returns Deferred which fires with the compressed data.
+        """
+        def compress():
+            raw_start = fileobj.tell()
+            compressed = compression.compress(fileobj)
+            try:
+                return fileobj.tell() - raw_start, compressed.read()
+            finally:
+                compressed.close()
+
+        def compressed(result):
+            raw_size, data = result
+            self.add_compressed(raw_size, len(data))
+            return data
+
+        return self.executor.call(compress).addCallback(compressed)
+
+    def add_compressed(self, raw_size, compressed_size):
+        """Counts bytes of a compressed output, stats are updated in the reactor thread only."""
+        self._inc_stats(self.STATS_RAW_BYTES, raw_size)
+        self._inc_stats(self.STATS_COMPRESSED_BYTES, compressed_size)
+
+    def create_multipart_upload(self, bucket_name, key, content_type=None, content_encoding=None):
+        """Returns Deferred which fires with id of the new multipart upload."""
+        extra_args = {'ContentType': content_type} if content_type else {}
+        if content_encoding:
+            extra_args['ContentEncoding'] = content_encoding
+        dt = self._submit_retrying(key, self.client.create_multipart_upload, Bucket=bucket_name, Key=key,
+                                   **extra_args)
+        return dt.addCallback(lambda response: response['UploadId'])
+
+    def upload_part(self, fileobj, bucket_name, key, upload_id, part_number):
+        """Uploads file object from its current position as a part.
+
+        Returns Deferred which fires with the part entry for completion.
+        """
+        position = fileobj.tell()
+
+        def upload_part():
+            # Retries read the part again
+            fileobj.seek(position)
+            return self.client.upload_part(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                                           PartNumber=part_number, Body=fileobj)
+
+        def uploaded(response):
+            self._inc_stats(self.STATS_PARTS)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+        return self._submit_retrying(key, upload_part).addCallback(uploaded)
+
+    def complete_multipart_upload(self, bucket_name, key, upload_id, parts):
+        """Returns Deferred which fires with the key once the object is assembled from `parts`."""
+        def completed(_):
+            self._inc_stats(self.STATS_UPLOADED)
+            return key
+
+        dt = self._submit_retrying(key, self.client.complete_multipart_upload, Bucket=bucket_name, Key=key,
+                                   UploadId=upload_id, MultipartUpload={'Parts': parts})
+        return dt.addCallback(completed)
+
+    def abort_multipart_upload(self, bucket_name, key, upload_id):
+        return self._submit(self.client.abort_multipart_upload, Bucket=bucket_name, Key=key, UploadId=upload_id)
+
+    def _submit(self, func, *args, **kwargs):
+        """Calls S3 client in the upload thread pool, returns Deferred with the result of the call."""
+        queued = time.time()
+        self.pending += 1
+        self._set_stats()
+
+        def call():
+            started = time.time()
+            return started, func(*args, **kwargs)
+
+        def called(result):
+            started, value = result
+            self._observe(self.STATS_WAIT_TIME, started - queued)
+            self._observe(self.STATS_UPLOAD_TIME, time.time() - started)
+            return value
+
+        def failed(failure):
+            self._inc_stats(self.STATS_FAILED)
+            return failure
+
+        def finished(result):
+            self.pending -= 1
+            self._set_stats()
+            return result
+
+        dt = self.executor.call(call)
+        dt.addCallbacks(called, failed)
+        dt.addBoth(finished)
+        return dt
+
+    def _submit_retrying(self, key, func, *args, **kwargs):
+        """Same as `_submit`, but failed calls are retried with exponential backoff."""
+        result = defer.Deferred()
+
+        def submit(attempt):
+            dt = self._submit(func, *args, **kwargs)
+            dt.addCallbacks(result.callback, failed, errbackArgs=(attempt,))
+
+        def failed(failure, attempt):
+            if attempt >= self.retries:
+                result.errback(failure)
+                return
+            delay = self.retry_delay * 2 ** attempt
+            logger.warning('Error while calling {} for {}, retry in {} seconds: {}'.format(
+                func.__name__, key, delay, failure.getErrorMessage()))
+            self._inc_stats(self.STATS_RETRIED)
+            self.clock.callLater(delay, submit, attempt + 1)
+
+        submit(0)
+        return result
+
+    @property
+    def queued(self):
+        return max(self.pending - self.max_threads, 0)
+
+    def stop(self):
+        self.executor.stop()
+
+    def _set_stats(self):
+        if self.stats is not None:
+            self.stats.set_value(self.STATS_PENDING, self.pending)
+            self.stats.set_value(self.STATS_QUEUED, self.queued)
+            self.stats.max_value(self.STATS_QUEUED_MAX, self.queued)
+
+
+class MultipartOutput(object):
+    """Export file which is spooled to disk and uploaded in multipart parts while the task is crawling.
+
+    Every part is written to its own spooled temporary file, which keeps up to `max_memory` bytes in
+    memory, and is uploaded as soon as it reaches `part_size`. Parts of one output are uploaded one
+    after another, so the output takes at most one upload thread. Output smaller than a part is
+    uploaded with a single request by `finish`, as are all outputs when `part_size` is 0.
+
+    With `compression` output smaller than a part is compressed by the single upload. Otherwise
+    every filled part is compressed in the upload thread pool into one compressed stream, which is
+    uploaded in parts of `part_size` compressed bytes.
+
+    Part files are kept until the output is closed. If the multipart upload fails after its retries,
+    it is aborted and the whole output is uploaded with a single request, which goes to the upload
+    spool if that fails too.
+    """
+    # S3 rejects smaller parts except the last one
+    MIN_PART_SIZE = 5 * 1024 * 1024
+    DEFAULT_PART_SIZE = 8 * 1024 * 1024
+    DEFAULT_MAX_MEMORY = 1024 * 1024
+
+    def __init__(self, uploader, bucket_name, key, part_size=DEFAULT_PART_SIZE, max_memory=DEFAULT_MAX_MEMORY,
+                 content_type=None, compression=None):
+        self.uploader = uploader
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = max(part_size, self.MIN_PART_SIZE) if part_size else 0
+        self.max_memory = max_memory
+        self.content_type = content_type
+        self.compression = compression
+        self.part = self._new_part()
+        self.size = 0
+        # Deferred chain of part compression, compressed stream is written to `encoded`
+        self.encoding = None
+        self.compressor = None
+        self.encoded = None
+        self.encoded_size = 0
+        self.upload_id = None
+        # Deferred chain of the multipart upload, every uploaded part is added to `parts`
+        self.uploading = None
+        self.parts = []
+        self.part_number = 0
+        # Files of parts passed to the multipart upload
+        self.part_files = []
+
+    @classmethod
+    def from_settings(cls, settings, uploader, bucket_name, key, stream=True, content_type=None, compression=None):
+        return cls(
+            uploader,
+            bucket_name,
+            key,
+            part_size=settings.getint('S3_MULTIPART_PART_BYTES', cls.DEFAULT_PART_SIZE) if stream else 0,
+            max_memory=settings.getint('S3_EXPORT_SPOOL_BYTES', cls.DEFAULT_MAX_MEMORY),
+            content_type=content_type,
+            compression=compression
+        )
+
+    def _new_part(self):
+        return SpooledTemporaryFile(max_size=self.max_memory)
+
+    def _take_part(self):
+        part, self.part = self.part, self._new_part()
+        part.seek(0)
+        return part
+
+    @property
+    def multipart(self):
+        return self.uploading is not None or self.encoding is not None
+
+    @property
+    def content_encoding(self):
+        return self.compression.content_encoding if self.compression is not None else None
+
+    def write(self, data):
+        self.part.write(data)
+        self.size += len(data)
+        if self.part_size and self.part.tell() >= self.part_size:
+            if self.compression is None:
+                self._upload_part(self._take_part())
+            else:
+                self._encode_part(self._take_part())
+
+    def seek(self, offset, whence=0):
+        self.part.seek(offset, whence)
+
+    def tell(self):
+        return self.part.tell()
+
+    def read(self, size=-1):
+        return self.part.read(size)
+
+    def getvalue(self):
+        """Whole output, available only while nothing was uploaded in parts."""
+        assert not self.multipart, 'Output was uploaded in parts'
+        self.part.seek(0)
+        return self.part.read()
+
+    def close(self):
+        self.part.close()
+        if self.encoded is not None:
+            self.encoded.close()
+        for part in self.part_files:
+            part.close()
+
+    def _encode_part(self, part, last=False):
+        if self.encoding is None:
+            self.compressor = self.compression.compressobj()
+            self.encoded = self._new_part()
+            self.encoding = defer.succeed(None)
+
+        def encode():
+            # Parts are compressed one after another, so the compressor is not used by two threads at once
+            size = 0
+            for chunk in iter(lambda: part.read(Compression.CHUNK_SIZE), ''):
+                data = self.compressor.compress(chunk)
+                self.encoded.write(data)
+                size += len(data)
+            if last:
+                data = self.compressor.flush()
+                self.encoded.write(data)
+                size += len(data)
+            return size
+
+        def encoded(size):
+            self.encoded_size += size
+            # The last compressed part is uploaded by `finish`
+            if not last and self.encoded.tell() >= self.part_size:
+                encoded_part, self.encoded = self.encoded, self._new_part()
+                encoded_part.seek(0)
+                self._upload_part(encoded_part)
+
+        def close(result):
+            part.close()
+            return result
+
+        self.encoding.addCallback(lambda _: self.uploader.executor.call(encode))
+        self.encoding.addBoth(close)
+        self.encoding.addCallback(encoded)
+
+    def _upload_part(self, part):
+        self.part_files.append(part)
+        self.part_number += 1
+        part_number = self.part_number
+        if self.uploading is None:
+            logger.debug('Starting multipart upload of {}'.format(self.key))
+            self.uploading = self.uploader.create_multipart_upload(self.bucket_name, self.key, self.content_type,
+                                                                   self.content_encoding)
+            self.uploading.addCallback(self._created)
+
+        def upload(upload_id):
+            part.seek(0)
+            dt = self.uploader.upload_part(part, self.bucket_name, self.key, upload_id, part_number)
+            dt.addCallback(self.parts.append)
+            return dt.addCallback(lambda _: upload_id)
+
+        # Part is not uploaded after a failure of the previous one
+        self.uploading.addCallback(upload)
+
+    def _created(self, upload_id):
+        self.upload_id = upload_id
+        return upload_id
+
+    def finish(self):
+        """Uploads the rest of the output, returns Deferred which fires with the key."""
+        if self.encoding is None:
+            return self._finish()
+        self._encode_part(self._take_part(), last=True)
+
+        def counted(key):
+            self.uploader.add_compressed(self.size, self.encoded_size)
+            return key
+
+        def failed(failure):
+            if self.uploading is None:
+                return failure
+            # Output can not be completed, parts uploaded so far are dropped
+            self.uploading.addBoth(lambda _: self._abort())
+            return self.uploading.addCallback(lambda _: failure)
+
+        self.encoding.addCallbacks(lambda _: self._finish(), failed)
+        return self.encoding.addCallback(counted)
+
+    def _finish(self):
+        # Output is either compressed already or raw, which the single upload compresses
+        encoded = self.encoding is not None
+        last_part = self.encoded if encoded else self.part
+        if self.uploading is None:
+            last_part.seek(0)
+            return self.uploader.upload(
+                last_part if encoded else self,
+                self.bucket_name,
+                self.key,
+                content_type=self.content_type,
+                compression=None if encoded else self.compression,
+                content_encoding=self.content_encoding if encoded else None
+            )
+        if last_part.tell():
+            self._upload_part(last_part)
+
+        def complete(upload_id):
+            return self.uploader.complete_multipart_upload(self.bucket_name, self.key, upload_id, self.parts)
+
+        def fallback(failure):
+            logger.warning('Multipart upload of {} failed, uploading it at once: {}'.format(
+                self.key, failure.getErrorMessage()))
+            self._abort()
+            # Joining parts may take a while for large outputs
+            dt = self.uploader.executor.call(self._join_parts)
+            dt.addCallback(upload)
+            return dt
+
+        def upload(output):
+            dt = self.uploader.upload(output, self.bucket_name, self.key, content_type=self.content_type,
+                                      content_encoding=self.content_encoding)
+
+            def close(result):
+                output.close()
+                return result
+
+            return dt.addBoth(close)
+
+        self.uploading.addCallback(complete)
+        self.uploading.addErrback(fallback)
+        return self.uploading
+
+    def _abort(self):
+        if self.upload_id is None:
+            return
+        dt = self.uploader.abort_multipart_upload(self.bucket_name, self.key, self.upload_id)
+        dt.addErrback(lambda f: logger.warning('Error while aborting multipart upload {}: {}'.format(
+            self.key, f.getErrorMessage())))
+
+    def _join_parts(self):
+        output = SpooledTemporaryFile(max_size=self.max_memory)
+        for part in self.part_files:
+            part.seek(0)
+            shutil.copyfileobj(part, output)
+        output.seek(0)
+        return output
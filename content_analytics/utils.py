@@ -8,7 +8,6 @@ from os import path
 
 from scrapy.item import Item
 from scrapy.http.request import Request
-from fuzzywuzzy import fuzz, process
 from OpenSSL import SSL
 from scrapy.core.downloader.contextfactory import ScrapyClientContextFactory
 from twisted.internet._sslverify import ClientTLSOptions
@@ -183,6 +182,9 @@ def guess_brand(text):
     if not text or not isinstance(text, basestring):
         return
 
+    # Heavy, loaded on first use instead of the runner startup
+    from fuzzywuzzy import fuzz, process
+
     if 'brands' not in globals():
         # read brands once in a dict: key=brand, value=brand group
         brands = {}
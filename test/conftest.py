@@ -0,0 +1,14 @@
+import mock
+import pytest
+from twisted.internet.task import Clock
+from scrapy.statscollectors import StatsCollector
+
+
+@pytest.fixture()
+def clock():
+    return Clock()
+
+
+@pytest.fixture()
+def stats():
+    return StatsCollector(mock.MagicMock())
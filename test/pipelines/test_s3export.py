@@ -0,0 +1,161 @@
+import gzip
+import json
+from cStringIO import StringIO
+
+import mock
+import pytest
+from scrapy.settings import Settings
+from twisted.internet import defer
+
+from content_analytics.items import SiteProductItem
+from content_analytics.messages.sc import InputMessage, MessageResolver
+from content_analytics.pipelines.s3export import S3ExportPipeline
+from content_analytics.segments import SegmentRange
+
+# pylint:disable=redefined-outer-name
+
+URLS = ['http://www.example.com/1', 'http://www.example.com/2', 'http://www.example.com/3']
+
+
+@pytest.fixture()
+def pipeline(stats):
+    pipeline = S3ExportPipeline(stats, Settings({'OUTPUT_BUCKET_NAME': 'bucket'}))
+    pipeline.uploader = mock.MagicMock()
+    pipeline.bucket_name = 'bucket'
+    return pipeline
+
+
+def batch_message(**kwargs):
+    body = {
+        'urls': URLS,
+        'site': 'example',
+        'task_id': 7,
+        'result_queue': 'scraper_out',
+        'response_format': 'sc',
+    }
+    body.update(kwargs)
+    raw_message = mock.MagicMock()
+    raw_message.body = json.dumps(body)
+    return InputMessage(raw_message)
+
+
+def spider(message):
+    spider = mock.MagicMock()
+    spider._message = message
+    spider.product_urls = message.get_urls()
+    return spider
+
+
+def scrape(pipeline, stats, spider, url, **fields):
+    item = SiteProductItem(batch_url=url, **fields)
+    pipeline.process_item(item, spider)
+    stats.inc_value('item_scraped_count')
+
+
+def test_batch_message_is_parsed():
+    message = batch_message()
+    assert message.get_spider_name() == 'example_products'
+    assert message.get_urls() == URLS
+
+
+def test_every_url_gets_status(pipeline, stats):
+    message = batch_message()
+    batch_spider = spider(message)
+    pipeline.spider_opened(batch_spider)
+    output_file = pipeline.file
+    scrape(pipeline, stats, batch_spider, URLS[2], title='Third')
+    scrape(pipeline, stats, batch_spider, URLS[0], title='First', not_found=True)
+
+    pipeline.spider_closed(batch_spider, mock.MagicMock())
+    pipeline.uploader.upload.assert_called_once_with(output_file, 'bucket', pipeline.filename,
+                                                     content_type=S3ExportPipeline.CONTENT_TYPE, compression=None,
+                                                     content_encoding=None)
+
+    lines = [json.loads(line) for line in output_file.getvalue().splitlines()]
+    assert [line['batch_url'] for line in lines] == [URLS[2], URLS[0], URLS[1]]
+    assert lines[2] == {'batch_url': URLS[1], 'status': 'failure', 'failure_type': 'No product scraped'}
+    assert message.url_results == [
+        {'url': URLS[0], 'status': 'failure', 'failure_type': '404'},
+        {'url': URLS[1], 'status': 'failure', 'failure_type': 'No product scraped'},
+        {'url': URLS[2], 'status': 'success', 'failure_type': None},
+    ]
+    assert stats.get_value('batch/failed_urls') == 1
+
+    output = MessageResolver.resolve(message=message, bucket_name='bucket', bucket_key='output/key.jl')
+    assert output['status'] == 'success'
+    assert output['urls'] == message.url_results
+
+
+def test_failed_batch_reports_every_url(pipeline):
+    message = batch_message()
+    batch_spider = spider(message)
+    pipeline.spider_opened(batch_spider)
+    pipeline.spider_closed(batch_spider, mock.MagicMock())
+
+    assert message.url_results is None
+    output = MessageResolver.resolve(message=message)
+    assert output['status'] == 'failure'
+    assert [entry['url'] for entry in output['urls']] == URLS
+    assert all(entry['status'] == 'failure' for entry in output['urls'])
+
+
+def test_single_url_task_has_no_url_results(pipeline, stats):
+    message = batch_message(url=URLS[0], urls=None)
+    single_spider = spider(message)
+    pipeline.spider_opened(single_spider)
+    assert pipeline.url_results is None
+    scrape(pipeline, stats, single_spider, None, title='First')
+    output = MessageResolver.resolve(message=message, bucket_name='bucket', bucket_key='output/key.jl')
+    assert 'urls' not in output
+
+
+def test_message_selects_output_compression(pipeline, stats):
+    pipeline.uploader.upload.side_effect = lambda fileobj, bucket_name, key, **kwargs: defer.succeed(key)
+    message = batch_message(url=URLS[0], urls=None, output_compression='gzip')
+    single_spider = spider(message)
+    pipeline.spider_opened(single_spider)
+    scrape(pipeline, stats, single_spider, None, title='First')
+    uploaded = []
+    sender = mock.MagicMock()
+    sender.signals.send_catch_log.side_effect = lambda signal, filename, **kwargs: uploaded.append(filename)
+    pipeline.spider_closed(single_spider, sender)
+
+    assert pipeline.uploader.upload.call_args[1]['compression'].content_encoding == 'gzip'
+    output = MessageResolver.resolve(message=message, bucket_name='bucket', bucket_key=uploaded[0])
+    assert output['s3_key_data'] == pipeline.filename
+    assert output['s3_content_encoding'] == 'gzip'
+
+
+def test_segment_output_is_compressed_on_its_own(pipeline, stats):
+    pipeline.uploader.compress.side_effect = lambda fileobj, compression: defer.succeed(
+        compression.compress(fileobj).read())
+    pipeline.segments = mock.MagicMock()
+    pipeline.segments.append.side_effect = lambda data, content_encoding=None: defer.succeed(
+        SegmentRange('output/segments/1.jl', 0, len(data), content_encoding))
+    message = batch_message(url=URLS[0], urls=None, output_compression='gzip')
+    single_spider = spider(message)
+    pipeline.spider_opened(single_spider)
+    scrape(pipeline, stats, single_spider, None, title='First')
+    uploaded = []
+    sender = mock.MagicMock()
+    sender.signals.send_catch_log.side_effect = lambda signal, filename, **kwargs: uploaded.append(filename)
+    pipeline.spider_closed(single_spider, sender)
+
+    data, content_encoding = pipeline.segments.append.call_args[0]
+    assert content_encoding == 'gzip'
+    assert json.loads(gzip.GzipFile(fileobj=StringIO(data)).read())['title'] == 'First'
+    output = MessageResolver.resolve(message=message, bucket_name='bucket', bucket_key=uploaded[0])
+    assert (output['s3_offset'], output['s3_length']) == (0, len(data))
+    assert output['s3_content_encoding'] == 'gzip'
+
+
+def test_unknown_output_compression_fails_task(pipeline, stats):
+    message = batch_message(url=URLS[0], urls=None, output_compression='brotli')
+    single_spider = spider(message)
+    pipeline.spider_opened(single_spider)
+    scrape(pipeline, stats, single_spider, None, title='First')
+    sender = mock.MagicMock()
+    pipeline.spider_closed(single_spider, sender)
+
+    assert not pipeline.uploader.upload.called
+    assert isinstance(sender.signals.send_catch_log.call_args[1]['failure'].value, ValueError)
@@ -0,0 +1,99 @@
+import mock
+import pytest
+from twisted.internet import defer
+
+from content_analytics.sqs.batcher import SendMessageBatcher, DeleteMessageBatcher, SQSBatchEntryError
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def queue():
+    queue = mock.MagicMock(url='local://out')
+    queue.send_messages.side_effect = lambda Entries: {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+    queue.delete_messages.side_effect = lambda Entries: {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+    return queue
+
+
+@pytest.fixture()
+def executor():
+    executor = mock.MagicMock()
+    executor.call.side_effect = lambda func, *args, **kwargs: defer.maybeDeferred(func, *args, **kwargs)
+    return executor
+
+
+@pytest.fixture()
+def batcher(executor, stats, clock):
+    return SendMessageBatcher(executor, linger=0.5, stats=stats, clock=clock)
+
+
+def test_batch_is_flushed_when_full(batcher, queue, stats):
+    results = [batcher.add(queue, {'MessageBody': str(number)}) for number in range(10)]
+    assert queue.send_messages.call_count == 1
+    assert all(result.called for result in results)
+    assert stats.get_value('sqs/batch/send/fill_ratio') == 1.0
+
+
+def test_batch_is_flushed_after_linger(batcher, queue, clock, stats):
+    result = batcher.add(queue, {'MessageBody': 'body'})
+    assert not queue.send_messages.called
+    clock.advance(0.5)
+    assert result.called
+    assert stats.get_value('sqs/batch/send/fill_ratio') == 0.1
+
+
+def test_batch_is_flushed_before_exceeding_size(batcher, queue):
+    batcher.add(queue, {'MessageBody': 'x' * (SendMessageBatcher.MAX_BYTES - 10)})
+    batcher.add(queue, {'MessageBody': 'x' * 20})
+    assert queue.send_messages.call_count == 1
+    assert len(batcher) == 1
+
+
+def test_batches_are_grouped_by_queue(batcher, queue, clock):
+    other = mock.MagicMock(url='local://other')
+    other.send_messages.return_value = {'Failed': []}
+    batcher.add(queue, {'MessageBody': 'first'})
+    batcher.add(other, {'MessageBody': 'second'})
+    clock.advance(0.5)
+    assert len(queue.send_messages.call_args[1]['Entries']) == 1
+    assert len(other.send_messages.call_args[1]['Entries']) == 1
+
+
+def test_failed_entries_are_retried_individually(batcher, queue, clock):
+    responses = [
+        {'Successful': [{'Id': '0'}], 'Failed': [{'Id': '1', 'Code': 'InternalError', 'SenderFault': False}]},
+        {'Successful': [{'Id': '0'}], 'Failed': []},
+    ]
+    queue.send_messages.side_effect = responses
+    first = batcher.add(queue, {'MessageBody': 'first'})
+    second = batcher.add(queue, {'MessageBody': 'second'})
+    clock.advance(0.5)
+    assert first.called and not second.called
+
+    clock.advance(0.5)
+    assert second.called
+    assert queue.send_messages.call_args[1]['Entries'] == [{'Id': '0', 'MessageBody': 'second'}]
+
+
+def test_sender_fault_entries_are_not_retried(executor, queue, clock):
+    batcher = DeleteMessageBatcher(executor, linger=0.5, clock=clock)
+    queue.delete_messages.side_effect = None
+    queue.delete_messages.return_value = {
+        'Failed': [{'Id': '0', 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True}]
+    }
+    errors = []
+    batcher.add(queue, {'ReceiptHandle': 'handle'}).addErrback(errors.append)
+    clock.advance(0.5)
+    assert errors and errors[0].check(SQSBatchEntryError)
+    assert queue.delete_messages.call_count == 1
+
+
+def test_entries_fail_after_retries(executor, queue, clock):
+    batcher = DeleteMessageBatcher(executor, linger=0.5, max_retries=2, clock=clock)
+    queue.delete_messages.side_effect = Exception('unavailable')
+    errors = []
+    batcher.add(queue, {'ReceiptHandle': 'handle'}).addErrback(errors.append)
+    for _ in range(3):
+        clock.advance(0.5)
+    assert errors
+    assert queue.delete_messages.call_count == 3
@@ -0,0 +1,64 @@
+import mock
+import pytest
+from twisted.internet import defer
+
+from content_analytics.sqs.cache import QueueHandleCache
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def executor():
+    executor = mock.MagicMock()
+    executor.calls = []
+
+    def call(func, *args, **kwargs):
+        d = defer.Deferred()
+        executor.calls.append((d, func, args))
+        return d
+
+    executor.call.side_effect = call
+    return executor
+
+
+@pytest.fixture()
+def cache(executor, stats, clock):
+    return QueueHandleCache(executor, mock.MagicMock(), ttl=100, negative_ttl=10, stats=stats, clock=clock)
+
+
+def test_concurrent_lookups_share_one_resolution(cache, executor, stats):
+    first = cache.get('queue')
+    second = cache.get('queue')
+    assert len(executor.calls) == 1
+
+    executor.calls[0][0].callback('handle')
+    assert first.result == 'handle' and second.result == 'handle'
+    assert stats.get_value(QueueHandleCache.STATS_MISS) == 1
+
+
+def test_resolved_handle_is_cached_until_ttl(cache, executor, clock, stats):
+    cache.get('queue')
+    executor.calls[0][0].callback('handle')
+
+    assert cache.get('queue').result == 'handle'
+    assert len(executor.calls) == 1
+    assert stats.get_value(QueueHandleCache.STATS_HIT) == 1
+
+    clock.advance(100)
+    cache.get('queue')
+    assert len(executor.calls) == 2
+
+
+def test_resolution_errors_are_cached_negatively(cache, executor, clock, stats):
+    errors = []
+    cache.get('queue').addErrback(errors.append)
+    executor.calls[0][0].errback(Exception('access denied'))
+    cache.get('queue').addErrback(errors.append)
+
+    assert len(errors) == 2
+    assert len(executor.calls) == 1
+    assert stats.get_value(QueueHandleCache.STATS_NEGATIVE_HIT) == 1
+
+    clock.advance(10)
+    cache.get('queue')
+    assert len(executor.calls) == 2
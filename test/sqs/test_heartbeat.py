@@ -0,0 +1,88 @@
+import mock
+import pytest
+from twisted.internet import defer
+
+from content_analytics.sqs.heartbeat import VisibilityHeartbeat
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def queue():
+    queue = mock.MagicMock()
+    queue.change_message_visibility_batch.return_value = {'Successful': [], 'Failed': []}
+    return queue
+
+
+@pytest.fixture()
+def heartbeat(clock, queue, stats):
+    executor = mock.MagicMock()
+    executor.call.side_effect = lambda func, *args, **kwargs: defer.maybeDeferred(func, *args, **kwargs)
+    heartbeat = VisibilityHeartbeat(executor, queue, visibility_timeout=300, offset=10, stats=stats, clock=clock)
+    heartbeat._start()
+    return heartbeat
+
+
+def test_due_handles_are_coalesced_into_batches_of_ten(heartbeat, queue, clock):
+    for number in range(20):
+        heartbeat.register('handle-{}'.format(number))
+    clock.advance(heartbeat.interval)
+    clock.advance(heartbeat.spread)
+
+    assert queue.change_message_visibility_batch.call_count == 2
+    for call in queue.change_message_visibility_batch.call_args_list:
+        assert len(call[1]['Entries']) == 10
+
+
+def test_handles_are_not_renewed_before_window(heartbeat, queue, clock):
+    heartbeat.register('handle')
+    clock.advance(heartbeat.interval - heartbeat.window - heartbeat.tick_interval)
+    assert not queue.change_message_visibility_batch.called
+
+
+def test_unregistered_handles_are_not_renewed(heartbeat, queue, clock):
+    heartbeat.register('handle')
+    heartbeat.unregister('handle')
+    clock.advance(heartbeat.interval)
+    assert not queue.change_message_visibility_batch.called
+
+
+def test_failed_entries_are_reported_without_losing_others(heartbeat, queue, clock, stats):
+    on_failure = mock.MagicMock()
+    heartbeat.on_failure = on_failure
+    heartbeat.register('deleted')
+    heartbeat.register('alive')
+
+    def change_visibility(Entries):
+        return {
+            'Successful': [entry for entry in Entries if entry['ReceiptHandle'] == 'alive'],
+            'Failed': [{'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True}
+                       for entry in Entries if entry['ReceiptHandle'] == 'deleted']
+        }
+
+    queue.change_message_visibility_batch.side_effect = change_visibility
+    clock.advance(heartbeat.interval)
+
+    on_failure.assert_called_once_with('deleted', 'ReceiptHandleIsInvalid')
+    assert 'deleted' not in heartbeat
+    assert 'alive' in heartbeat
+    assert stats.get_value(VisibilityHeartbeat.STATS_FAILED) == 1
+
+
+def test_call_errors_are_retried_on_next_tick(heartbeat, queue, clock, stats):
+    heartbeat.register('handle')
+    queue.change_message_visibility_batch.side_effect = [Exception('throttled'), {'Failed': []}]
+    clock.advance(heartbeat.interval)
+    clock.advance(heartbeat.tick_interval)
+
+    assert queue.change_message_visibility_batch.call_count == 2
+    assert stats.get_value(VisibilityHeartbeat.STATS_ERRORS) == 1
+
+
+def test_register_with_deadline_renews_before_it(heartbeat, queue, clock):
+    # Prefetched message which stayed in the buffer for 200 seconds
+    heartbeat.register('prefetched', deadline=100)
+    clock.advance(80)
+    assert not queue.change_message_visibility_batch.called
+    clock.advance(5)
+    assert queue.change_message_visibility_batch.called
@@ -0,0 +1,252 @@
+import mock
+import pytest
+from twisted.internet import defer
+
+from content_analytics.sqs import poller as poller_module
+from content_analytics.sqs.poller import InputQueue, PriorityPoller
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def executor():
+    executor = mock.MagicMock()
+    executor.calls = []
+
+    def call(func, *args, **kwargs):
+        d = defer.Deferred()
+        executor.calls.append((d, func, kwargs))
+        return d
+
+    executor.call.side_effect = call
+    return executor
+
+
+@pytest.fixture()
+def normal():
+    return InputQueue('scraper_in', mock.MagicMock(), weight=1)
+
+
+@pytest.fixture()
+def urgent():
+    return InputQueue('scraper_in_urgent', mock.MagicMock(), weight=3, urgent=True)
+
+
+def create_poller(executor, queues, stats, clock, **kwargs):
+    return PriorityPoller(executor, queues, prefetch=5, release_margin=30, stats=stats, clock=clock, **kwargs)
+
+
+def raw_message(name, sent=None):
+    message = mock.MagicMock()
+    message.message_id = name
+    message.attributes = {'SentTimestamp': str(int(sent * 1000))} if sent is not None else {}
+    return message
+
+
+def respond(executor, queue, messages):
+    for call in list(executor.calls):
+        if call[1] is queue.queue.receive_messages and not call[0].called:
+            executor.calls.remove(call)
+            call[0].callback(messages)
+            return call[2]
+    raise AssertionError('No receive call for {}'.format(queue))
+
+
+def fill(queue, clock, names):
+    queue.buffer.extend((clock.seconds() + queue.visibility_timeout, raw_message(name)) for name in names)
+
+
+def names(taken):
+    return [message.message_id for _, message, _ in taken]
+
+
+def test_poll_waits_for_first_queue_with_messages(executor, normal, urgent, stats, clock):
+    poller = create_poller(executor, [normal, urgent], stats, clock)
+    result = poller.poll(3)
+    assert len(executor.calls) == 2
+    assert not result.called
+
+    kwargs = respond(executor, urgent, [raw_message('u1')])
+    assert kwargs['WaitTimeSeconds'] == 0
+    assert kwargs['AttributeNames'] == ['SentTimestamp']
+    assert names(result.result) == ['u1']
+    assert result.result[0][0] is urgent
+    assert result.result[0][2] == clock.seconds() + urgent.visibility_timeout
+
+
+def test_poll_returns_nothing_when_all_queues_are_empty(executor, normal, urgent, stats, clock):
+    poller = create_poller(executor, [normal, urgent], stats, clock)
+    result = poller.poll(3)
+
+    respond(executor, normal, [])
+    assert not result.called
+    respond(executor, urgent, [])
+    assert result.result == []
+
+
+def test_strict_priority_admits_urgent_before_buffered_normal(executor, normal, urgent, stats, clock):
+    poller = create_poller(executor, [normal, urgent], stats, clock)
+    fill(normal, clock, ['n1', 'n2', 'n3'])
+    fill(urgent, clock, ['u1', 'u2'])
+
+    assert names(poller.poll(3).result) == ['u1', 'u2', 'n1']
+    assert stats.get_value('sqs/poller/urgent/admitted') == 2
+    assert stats.get_value('sqs/poller/normal/admitted') == 1
+
+
+def test_weighted_priority_shares_admission(executor, normal, urgent, stats, clock):
+    poller = create_poller(executor, [normal, urgent], stats, clock, mode=PriorityPoller.WEIGHTED)
+    fill(normal, clock, ['n1', 'n2', 'n3', 'n4'])
+    fill(urgent, clock, ['u1', 'u2', 'u3', 'u4'])
+
+    assert names(poller.poll(4).result) == ['u1', 'u2', 'n1', 'u3']
+
+
+def test_buffers_are_refilled_after_poll(executor, normal, urgent, stats, clock):
+    poller = create_poller(executor, [normal, urgent], stats, clock)
+    fill(normal, clock, ['n1', 'n2', 'n3', 'n4', 'n5'])
+
+    poller.poll(2)
+
+    receives = dict((call[1], call[2]) for call in executor.calls)
+    assert receives[normal.queue.receive_messages]['MaxNumberOfMessages'] == 2
+    assert receives[urgent.queue.receive_messages]['MaxNumberOfMessages'] == 5
+    assert receives[normal.queue.receive_messages]['WaitTimeSeconds'] == 0
+
+    poller.poll(1)
+    assert len(executor.calls) == 2
+
+
+def test_visibility_of_supervised_message_runs_since_it_was_received(executor, normal, stats, clock):
+    clock.advance(1000)
+    poller = create_poller(executor, [normal], stats, clock)
+    result = poller.poll(1)
+    message = raw_message('s1')
+    message.received = clock.seconds() - 100
+    respond(executor, normal, [message])
+    assert result.result[0][2] == clock.seconds() - 100 + normal.visibility_timeout
+
+
+def test_messages_which_can_not_start_in_time_are_released(executor, normal, stats, clock):
+    poller = create_poller(executor, [normal], stats, clock)
+    fill(normal, clock, ['old'])
+    clock.advance(normal.visibility_timeout - 30)
+    fill(normal, clock, ['new'])
+
+    assert names(poller.poll(2).result) == ['new']
+    assert stats.get_value('sqs/poller/normal/released') == 1
+    release = [call for call in executor.calls if call[1] is normal.queue.change_message_visibility_batch]
+    assert release[0][2]['Entries'] == [{'Id': '0', 'ReceiptHandle': mock.ANY, 'VisibilityTimeout': 0}]
+
+
+def test_background_long_polling_keeps_buffers_topped_up(executor, normal, urgent, stats, clock):
+    poller = create_poller(executor, [normal, urgent], stats, clock, wait_time=20)
+    poller.start()
+    assert len(executor.calls) == 2
+
+    kwargs = respond(executor, normal, [raw_message('n1'), raw_message('n2')])
+    assert kwargs['WaitTimeSeconds'] == 20 and kwargs['MaxNumberOfMessages'] == 5
+    kwargs = respond(executor, normal, [raw_message('n3'), raw_message('n4'), raw_message('n5')])
+    assert kwargs['MaxNumberOfMessages'] == 3
+    # Buffer is full, nothing is received until messages are taken
+    assert len(executor.calls) == 1
+    assert stats.get_value('sqs/poller/normal/buffered') == 5
+
+    assert names(poller.poll(2).result) == ['n1', 'n2']
+    assert respond(executor, normal, [])['MaxNumberOfMessages'] == 2
+    assert stats.get_value('sqs/poller/normal/empty_receives') == 1
+
+
+def test_saturated_runner_keeps_messages_it_can_start_in_time(executor, normal, stats, clock):
+    poller = create_poller(executor, [normal], stats, clock, wait_time=20, free_slots=lambda: 0)
+    poller.start()
+    # Without finished tasks there is no estimate yet, the buffer is filled up to prefetch
+    respond(executor, normal, [raw_message('n{}'.format(number)) for number in range(5)])
+    assert not executor.calls
+    assert len(normal.buffer) == 5
+
+    # A slot gets free every 100 seconds, so only the first message starts before its release margin
+    clock.advance(20)
+    poller.task_finished(normal, raw_message('t1'))
+    clock.advance(100)
+    poller.task_finished(normal, raw_message('t2'))
+    poller.tick()
+    assert [message.message_id for _, message in normal.buffer] == ['n0']
+    assert stats.get_value('sqs/poller/normal/released') == 4
+    # Two messages with a full visibility timeout can start in time, one of them is buffered already
+    receive = [call for call in executor.calls if call[1] is normal.queue.receive_messages]
+    assert receive[0][2]['MaxNumberOfMessages'] == 1
+
+
+def test_free_slots_are_not_limited_by_finish_interval(executor, normal, stats, clock):
+    slots = [3]
+    poller = create_poller(executor, [normal], stats, clock, free_slots=lambda: slots[0])
+    poller.finish_interval = 1000
+    fill(normal, clock, ['n1', 'n2', 'n3', 'n4'])
+
+    poller.release_expiring()
+    assert len(normal.buffer) == 3
+    assert names(poller.poll(3).result) == ['n1', 'n2', 'n3']
+
+
+def test_poll_gets_nothing_after_every_queue_was_checked(executor, normal, urgent, stats, clock):
+    poller = create_poller(executor, [normal, urgent], stats, clock)
+    poller.start()
+    result = poller.poll(3)
+
+    # Receives which were in flight before the poll count as checks too
+    respond(executor, normal, [])
+    respond(executor, urgent, [])
+    assert result.result == []
+
+
+def test_stop_releases_buffered_messages_after_receives(executor, normal, stats, clock):
+    poller = create_poller(executor, [normal], stats, clock)
+    poller.start()
+    fill(normal, clock, ['n1'])
+
+    stopped = poller.stop()
+    assert not stopped.called
+    respond(executor, normal, [raw_message('n2')])
+    release = [call for call in executor.calls if call[1] is normal.queue.change_message_visibility_batch]
+    assert sum(len(call[2]['Entries']) for call in release) == 2
+    for call in release:
+        call[0].callback({})
+    assert stopped.called
+    assert stats.get_value('sqs/poller/normal/released') == 2
+    assert not normal.buffer
+
+
+def test_receive_error_is_retried_later(executor, normal, stats, clock):
+    poller = create_poller(executor, [normal], stats, clock)
+    poller.start()
+    executor.calls.pop()[0].errback(Exception('boom'))
+    assert not executor.calls
+
+    clock.advance(PriorityPoller.RECEIVE_RETRY_DELAY)
+    assert len(executor.calls) == 1
+
+
+def test_receive_error_fails_poll(executor, normal, stats, clock):
+    poller = create_poller(executor, [normal], stats, clock)
+    result = poller.poll(1)
+    executor.calls[0][0].errback(Exception('boom'))
+
+    assert stats.get_value('sqs/poller/normal/errors') == 1
+    assert normal.receiving is None
+    with pytest.raises(Exception):
+        result.result.raiseException()
+    result.addErrback(lambda failure: None)
+
+
+def test_latency_metrics(executor, urgent, stats, clock):
+    poller = create_poller(executor, [urgent], stats, clock)
+    with mock.patch.object(poller_module.time, 'time', return_value=1010.0):
+        urgent.buffer.append((300, raw_message('u1', sent=1000.0)))
+        urgent.buffer.append((300, raw_message('u2', sent=1006.0)))
+        taken = poller.poll(2).result
+        poller.task_finished(urgent, taken[0][1])
+
+    assert stats.get_value('sqs/poller/urgent/admission_latency_max') == 10.0
+    assert stats.get_value('sqs/poller/urgent/admission_latency_avg') == 7.0
+    assert stats.get_value('sqs/poller/urgent/task_latency_max') == 10.0
@@ -0,0 +1,100 @@
+import json
+
+import mock
+import pytest
+from botocore.exceptions import ClientError
+from scrapy.settings import Settings
+
+from content_analytics import backends
+from content_analytics.backends import QUEUE, BLOB, create_resource
+from content_analytics.backends.disk import DiskBackend
+from content_analytics.backends.memory import MemoryBackend
+from content_analytics.remotesettings import RemoteSettings
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def settings(request, tmpdir):
+    MemoryBackend.reset()
+    backend = {
+        'memory': 'content_analytics.backends.memory.MemoryBackend',
+        'disk': 'content_analytics.backends.disk.DiskBackend'
+    }[request.param]
+    return Settings({'QUEUE_BACKEND': backend, 'BLOB_BACKEND': backend, 'LOCAL_BACKEND_PATH': str(tmpdir)})
+
+
+def test_default_backend_is_boto():
+    with mock.patch.object(backends.boto3, 'resource') as resource:
+        assert create_resource(Settings(), QUEUE, {'region_name': 'us-east-1'}) is resource.return_value
+    resource.assert_called_once_with('sqs', region_name='us-east-1')
+
+
+def test_queue_messages_are_received_once(settings):
+    sqs = create_resource(settings, QUEUE)
+    with pytest.raises(ClientError):
+        sqs.get_queue_by_name(QueueName='tasks')
+    sqs.create_queue(QueueName='tasks').put({'url': 'http://www.example.com/1'})
+    # Another resource of the same backend sees the same queue
+    queue = create_resource(settings, QUEUE).get_queue_by_name(QueueName='tasks')
+    queue.send_messages(Entries=[{'Id': '0', 'MessageBody': 'second'}])
+
+    messages = queue.receive_messages(MaxNumberOfMessages=10)
+    assert sorted(message.body for message in messages) == ['second', json.dumps({'url': 'http://www.example.com/1'})]
+    assert messages[0].attributes['ApproximateReceiveCount'] == '1'
+    assert queue.receive_messages(MaxNumberOfMessages=10) == []
+
+    response = queue.delete_messages(Entries=[
+        {'Id': '0', 'ReceiptHandle': messages[0].receipt_handle},
+        {'Id': '1', 'ReceiptHandle': 'unknown'}
+    ])
+    assert response['Successful'] == [{'Id': '0'}]
+    assert [entry['Id'] for entry in response['Failed']] == ['1']
+
+
+def test_queue_visibility_timeout(settings):
+    queue = create_resource(settings, QUEUE).create_queue(QueueName='tasks')
+    queue.put('task')
+    message, = queue.receive_messages(VisibilityTimeout=0)
+    released, = queue.receive_messages(VisibilityTimeout=300)
+    assert released.body == 'task'
+    assert released.attributes['ApproximateReceiveCount'] == '2'
+    # Visibility of the expired receipt handle can not be changed anymore
+    assert queue.change_message_visibility_batch(Entries=[
+        {'Id': '0', 'ReceiptHandle': message.receipt_handle, 'VisibilityTimeout': 60}
+    ])['Failed']
+    queue.change_message_visibility_batch(Entries=[
+        {'Id': '0', 'ReceiptHandle': released.receipt_handle, 'VisibilityTimeout': 0}
+    ])
+    assert [m.body for m in queue.receive_messages()] == ['task']
+
+
+def test_blobs(settings):
+    s3 = create_resource(settings, BLOB)
+    s3.Bucket('output').put_object(Key='output/2018/01/01/1.jl', Body='{}\n')
+    client = create_resource(settings, BLOB).meta.client
+    response = client.get_object(Bucket='output', Key='output/2018/01/01/1.jl')
+    assert response['Body'].read() == '{}\n'
+    assert client.store.keys('output') == ['output/2018/01/01/1.jl']
+    with pytest.raises(ClientError):
+        client.get_object(Bucket='output', Key='missing.jl')
+
+
+def test_remote_settings_from_local_blobs(settings):
+    client = create_resource(settings, BLOB).meta.client
+    client.put_object(Bucket='settings', Key='cache.json', Body=json.dumps({'enabled': True}))
+    applied = []
+    remote_settings = RemoteSettings('cache', client, 'settings', 'cache.json', applied.append,
+                                     executor=lambda f, *args: f(*args))
+    remote_settings.load()
+    assert applied == [{'enabled': True}]
+    assert remote_settings.fetch(remote_settings.etag) is None
+
+
+def test_disk_queue_is_shared_between_backends(tmpdir):
+    first = DiskBackend(path=str(tmpdir)).resource(QUEUE).create_queue(QueueName='tasks')
+    second = DiskBackend(path=str(tmpdir)).resource(QUEUE).get_queue_by_name(QueueName='tasks')
+    for number in range(3):
+        first.put(str(number))
+    received = first.receive_messages(MaxNumberOfMessages=2) + second.receive_messages(MaxNumberOfMessages=2)
+    assert sorted(message.body for message in received) == ['0', '1', '2']
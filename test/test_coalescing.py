@@ -0,0 +1,90 @@
+import json
+
+import mock
+import pytest
+
+from content_analytics.coalescing import TaskCoalescer
+from content_analytics.messages.sc import InputMessage
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def coalescer(stats, clock):
+    return TaskCoalescer(result_ttl=60, stats=stats, clock=clock)
+
+
+def input_message(**kwargs):
+    body = {
+        'url': 'http://www.example.com/product?b=2&a=1',
+        'site': 'example',
+        'result_queue': 'scraper_out',
+        'response_format': 'sc',
+    }
+    body.update(kwargs)
+    raw_message = mock.MagicMock()
+    raw_message.body = json.dumps(body)
+    return InputMessage(raw_message)
+
+
+def test_key_normalizes_url():
+    key = TaskCoalescer.get_key(input_message())
+    assert key == TaskCoalescer.get_key(input_message(url='http://www.example.com/product?a=1&b=2#reviews'))
+    assert key != TaskCoalescer.get_key(input_message(url='http://www.example.com/product?a=2&b=2'))
+
+
+def test_key_depends_on_options_and_crawl_date():
+    key = TaskCoalescer.get_key(input_message(cmd_args={'zip_code': '10001'}))
+    assert key == TaskCoalescer.get_key(input_message(cmd_args={'zip_code': '10001'}))
+    assert key != TaskCoalescer.get_key(input_message(cmd_args={'zip_code': '94016'}))
+    assert key != TaskCoalescer.get_key(input_message(cmd_args={'zip_code': '10001'}, crawl_date='2018-01-01'))
+    assert key != TaskCoalescer.get_key(input_message(cmd_args={'zip_code': '10001'}, site='other'))
+
+
+def test_key_depends_on_fields_read_by_spiders():
+    key = TaskCoalescer.get_key(input_message(url=None, searchterms_str='laptop', quantity='20'))
+    assert key == TaskCoalescer.get_key(input_message(url=None, searchterms_str='laptop', quantity='20',
+                                                      task_id=2, server_ip='10.0.0.1', result_queue='other_out'))
+    assert key != TaskCoalescer.get_key(input_message(url=None, searchterms_str='laptop', quantity='100'))
+    assert key != TaskCoalescer.get_key(input_message(url=None, searchterms_str='laptop', quantity='20',
+                                                      num_pages=2))
+    assert TaskCoalescer.get_key(input_message()) != TaskCoalescer.get_key(input_message(output_compression='gzip'))
+
+
+def test_search_term_tasks_are_keyed_by_search_term():
+    message = input_message(url=None, searchterms_str='laptop')
+    assert TaskCoalescer.get_key(message)[2] == 'laptop'
+
+
+def test_duplicates_are_attached_to_leader(coalescer, stats):
+    leader, first, second = mock.MagicMock(), mock.MagicMock(), mock.MagicMock()
+    assert not coalescer.attach('key', leader)
+    assert coalescer.attach('key', first)
+    assert coalescer.attach('key', second)
+    assert stats.get_value('runner/coalescing/attached') == 2
+
+    # Only the leader completes the crawl
+    assert coalescer.complete('key', first, 'result.jl') == []
+    assert coalescer.complete('key', leader, 'result.jl') == [first, second]
+    assert not coalescer.attach('key', mock.MagicMock())
+
+
+def test_successful_result_is_reused_during_ttl(coalescer, stats, clock):
+    leader = mock.MagicMock()
+    coalescer.attach('key', leader)
+    coalescer.complete('key', leader, 'result.jl')
+
+    clock.advance(59)
+    assert coalescer.get_result('key') == 'result.jl'
+    assert stats.get_value('runner/coalescing/reused') == 1
+    clock.advance(1)
+    assert coalescer.get_result('key') is None
+    assert not coalescer.results
+
+
+def test_failed_result_is_not_reused(coalescer):
+    leader, follower = mock.MagicMock(), mock.MagicMock()
+    coalescer.attach('key', leader)
+    coalescer.attach('key', follower)
+    assert coalescer.complete('key', leader) == [follower]
+    assert coalescer.get_result('key') is None
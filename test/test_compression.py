@@ -0,0 +1,30 @@
+import gzip
+from cStringIO import StringIO
+
+import pytest
+
+from content_analytics.compression import GzipCompression, get_compression
+
+
+def test_gzip_compression_from_current_position():
+    fileobj = StringIO('skipped' + '{"title": "First"}\n' * 1000)
+    fileobj.seek(len('skipped'))
+    compressed = GzipCompression().compress(fileobj)
+    data = compressed.read()
+    assert len(data) < 1000
+    assert gzip.GzipFile(fileobj=StringIO(data)).read() == '{"title": "First"}\n' * 1000
+
+
+def test_gzip_stream_is_compressed_chunk_by_chunk():
+    compressor = GzipCompression().compressobj()
+    data = ''.join(compressor.compress('{"title": "First"}\n' * 100) for _ in range(10)) + compressor.flush()
+    assert len(data) < 1000
+    assert gzip.GzipFile(fileobj=StringIO(data)).read() == '{"title": "First"}\n' * 1000
+
+
+def test_get_compression():
+    assert get_compression(None) is None
+    assert get_compression('identity') is None
+    assert get_compression('gzip', level=9).level == 9
+    with pytest.raises(ValueError):
+        get_compression('brotli')
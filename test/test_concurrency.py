@@ -0,0 +1,92 @@
+import mock
+import pytest
+
+from content_analytics.concurrency import AdaptiveConcurrency, ReactorLagProbe
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def load():
+    return mock.MagicMock(return_value=0)
+
+
+@pytest.fixture()
+def controller(load, stats, clock):
+    return AdaptiveConcurrency(
+        initial=10, floor=2, ceiling=12, load=load, interval=10,
+        max_rss=1000, max_task_latency=60, max_error_rate=0.5,
+        on_change=mock.MagicMock(), stats=stats, clock=clock, rss=lambda: 500
+    )
+
+
+def test_initial_target_is_bounded(load):
+    assert AdaptiveConcurrency(initial=100, floor=2, ceiling=20, load=load).target == 20
+    assert AdaptiveConcurrency(initial=0, floor=2, ceiling=20, load=load).target == 2
+
+
+def test_target_increases_additively_when_saturated(controller, load, stats):
+    load.return_value = 10
+    controller.task_started()
+    load.return_value = 3
+
+    assert controller.adjust() == 11
+    controller.on_change.assert_called_once_with(11)
+    assert stats.get_value(AdaptiveConcurrency.STATS_TARGET) == 11
+
+    # Slots were not all used during the last interval
+    assert controller.adjust() == 11
+
+    load.return_value = 11
+    controller.adjust()
+    load.return_value = 12
+    assert controller.adjust() == 12
+    load.return_value = 12
+    assert controller.adjust() == 12
+    assert stats.get_value(AdaptiveConcurrency.STATS_INCREASED) == 2
+
+
+@pytest.mark.parametrize('setup, reason', [
+    (lambda controller: setattr(controller, 'rss', lambda: 2000), 'rss'),
+    (lambda controller: controller.task_finished(120), 'task_latency'),
+    (lambda controller: [controller.task_finished(1, failed=number < 3) for number in range(5)], 'error_rate'),
+])
+def test_target_decreases_multiplicatively_when_overloaded(controller, load, stats, setup, reason):
+    load.return_value = 10
+    setup(controller)
+
+    assert controller.adjust() == 5
+    assert stats.get_value('runner/max_tasks/decreased/{}'.format(reason)) == 1
+    controller.on_change.assert_called_once_with(5)
+
+    setup(controller)
+    controller.adjust()
+    setup(controller)
+    assert controller.adjust() == 2
+
+
+def test_reactor_lag_decreases_target(controller, clock, stats):
+    controller.start()
+    clock.advance(0.5)
+    # The reactor was blocked for two seconds
+    clock.advance(2.5)
+    clock.pump([0.5] * 14)
+
+    assert controller.target == 5
+    assert stats.get_value('runner/max_tasks/decreased/reactor_lag') == 1
+    assert stats.get_value('runner/reactor_lag') == 2.0
+
+
+def test_error_rate_needs_enough_samples(controller, stats):
+    controller.task_finished(1, failed=True)
+    assert controller.adjust() == 10
+    assert stats.get_value('runner/error_rate') is None
+
+
+def test_lag_probe_measures_delay(clock):
+    probe = ReactorLagProbe(interval=1, clock=clock)
+    probe.start()
+    clock.advance(1)
+    clock.advance(1.3)
+    assert probe.reset() == pytest.approx(0.3)
+    assert probe.reset() == 0.0
@@ -0,0 +1,149 @@
+import mock
+import pytest
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from scrapy.exceptions import DontCloseSpider
+
+from content_analytics import signals
+from content_analytics import crawlerpool
+from content_analytics.crawlerpool import CrawlerPool
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def clock():
+    clock = Clock()
+    with mock.patch.object(crawlerpool, 'reactor', clock):
+        yield clock
+
+
+def create_crawler(spider_name):
+    crawler = mock.MagicMock()
+    crawler.spider.name = spider_name
+    crawler.engine.scraper.spidermw.process_start_requests.side_effect = \
+        lambda start_requests, spider: defer.succeed(start_requests)
+    return crawler
+
+
+@pytest.fixture()
+def runner():
+    runner = mock.MagicMock()
+    runner.create_crawler.side_effect = create_crawler
+    return runner
+
+
+@pytest.fixture()
+def pool(runner, stats, clock):
+    return CrawlerPool(runner, idle_timeout=60, max_crawler_tasks=3, stats=stats)
+
+
+def sent_signals(pooled, signal):
+    return [
+        call[1] for call in pooled.crawler.signals.send_catch_log.call_args_list + pooled.crawler.signals.send_catch_log_deferred.call_args_list
+        if call[1]['signal'] is signal
+    ]
+
+
+def test_first_task_starts_new_crawler(pool, runner, stats):
+    pooled = pool.submit('spider', 'message', {'url': 'first'})
+
+    runner.crawl.assert_called_once_with(crawler_or_spidercls=pooled.crawler, message='message', url='first')
+    runner.connect_crawler_signals.assert_called_once_with(pooled.crawler)
+    assert pooled.busy
+    assert stats.get_value('crawler_pool/created') == 1
+
+
+def test_idle_crawler_closes_task_and_stays_open(pool):
+    pooled = pool.submit('spider', 'message', {})
+    pooled.spider_opened(pooled.spider)
+    assert sent_signals(pooled, signals.task_opened)[0]['message'] == 'message'
+
+    with pytest.raises(DontCloseSpider):
+        pooled.spider_idle(pooled.spider)
+
+    closed = sent_signals(pooled, signals.task_closed)
+    assert len(closed) == 1
+    assert closed[0]['reason'] == 'finished' and closed[0]['message'] == 'message'
+    assert not pooled.busy
+    assert pool.idle['spider'] == [pooled]
+    pooled.crawler.stats.clear_stats.assert_called_once_with(pooled.spider)
+
+
+def test_warm_crawler_is_reused_for_next_task(pool, runner, stats):
+    pooled = pool.submit('spider', 'first', {})
+    with pytest.raises(DontCloseSpider):
+        pooled.spider_idle(pooled.spider)
+
+    reused = pool.submit('spider', 'second', {'url': 'second'})
+
+    assert reused is pooled
+    assert runner.crawl.call_count == 1
+    pooled.spider.reset_task.assert_called_once_with(message='second', url='second')
+    assert pooled.crawler.engine.slot.start_requests is not None
+    pooled.crawler.engine.slot.nextcall.schedule.assert_called_once_with()
+    assert sent_signals(pooled, signals.task_opened)[-1]['message'] == 'second'
+    assert stats.get_value('crawler_pool/reused') == 1
+    assert pool.idle['spider'] == []
+
+
+def test_busy_crawler_is_not_reused(pool, runner):
+    first = pool.submit('spider', 'first', {})
+    second = pool.submit('spider', 'second', {})
+
+    assert first is not second
+    assert runner.crawl.call_count == 2
+    assert len(pool) == 2
+
+
+def test_crawler_is_closed_after_max_tasks(pool):
+    pooled = pool.submit('spider', 'message', {})
+    for number in range(2):
+        with pytest.raises(DontCloseSpider):
+            pooled.spider_idle(pooled.spider)
+        pool.submit('spider', number, {})
+
+    pooled.spider_idle(pooled.spider)
+
+    assert pooled.closing
+    assert len(pool) == 0
+    assert 'spider' not in pool.crawlers or not pool.crawlers['spider']
+
+
+def test_crawler_is_closed_after_idle_timeout(pool, clock):
+    pooled = pool.submit('spider', 'message', {})
+    with pytest.raises(DontCloseSpider):
+        pooled.spider_idle(pooled.spider)
+
+    clock.advance(30)
+    with pytest.raises(DontCloseSpider):
+        pooled.spider_idle(pooled.spider)
+
+    clock.advance(30)
+    pooled.spider_idle(pooled.spider)
+    assert pooled.closing
+    assert pool.idle['spider'] == []
+
+
+def test_not_reusable_spider_is_closed_after_first_task(pool):
+    pooled = pool.submit('spider', 'message', {})
+    del pooled.spider.reset_task
+
+    pooled.spider_idle(pooled.spider)
+
+    assert sent_signals(pooled, signals.task_closed)[0]['reason'] == 'finished'
+    assert pooled.closing
+    assert len(pool) == 0
+
+
+def test_closed_spider_closes_active_task(pool, stats):
+    pooled = pool.submit('spider', 'message', {})
+
+    pooled.spider_closed(pooled.spider, 'shutdown')
+    pooled.spider_closed(pooled.spider, 'shutdown')
+
+    closed = sent_signals(pooled, signals.task_closed)
+    assert len(closed) == 1
+    assert closed[0]['reason'] == 'shutdown' and closed[0]['message'] == 'message'
+    assert len(pool) == 0
+    assert stats.get_value('crawler_pool/closed') == 1
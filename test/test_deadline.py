@@ -0,0 +1,100 @@
+import json
+
+import mock
+import pytest
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Request
+from scrapy.settings import Settings
+from scrapy.statscollectors import StatsCollector
+
+from content_analytics.items import SiteProductItem
+from content_analytics.messages.sc import InputMessage
+from content_analytics.middlewares.deadline import TaskDeadlineMiddleware
+from content_analytics.middlewares.mergeitem import MergeItemMiddleware, MergeRequest
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def merge():
+    return MergeItemMiddleware()
+
+
+@pytest.fixture()
+def crawler(merge):
+    crawler = mock.MagicMock()
+    crawler.settings = Settings({'TASK_DEADLINE': 100, 'TASK_DEADLINE_SHED_MARGIN': 30})
+    crawler.stats = StatsCollector(crawler)
+    crawler.engine.scraper.spidermw.middlewares = [merge]
+    return crawler
+
+
+@pytest.fixture()
+def middleware(crawler, clock):
+    return TaskDeadlineMiddleware(crawler, timeout=100, shed_margin=30, clock=clock)
+
+
+def spider(**kwargs):
+    body = dict({'url': 'http://www.example.com/1', 'site': 'example', 'result_queue': 'out',
+                 'response_format': 'sc'}, **kwargs)
+    raw_message = mock.MagicMock()
+    raw_message.body = json.dumps(body)
+    spider = mock.MagicMock()
+    spider.message = InputMessage(raw_message)
+    return spider
+
+
+def test_message_timeout():
+    assert spider(timeout=30).message.get_timeout() == 30
+    assert spider(timeout='45').message.get_timeout() == 45
+    assert spider(timeout='soon').message.get_timeout() is None
+    assert spider().message.get_timeout() is None
+
+
+def test_message_timeout_takes_precedence(middleware, crawler):
+    middleware.task_opened(spider(timeout=20))
+    assert crawler.stats.get_value('deadline/timeout') == 20
+    assert middleware.shed_at == 10
+    middleware.task_opened(spider())
+    assert crawler.stats.get_value('deadline/timeout') == 100
+
+
+def test_optional_requests_are_shed_near_deadline(middleware, crawler, clock):
+    middleware.task_opened(spider())
+    item = SiteProductItem()
+    initial = MergeRequest('http://www.example.com/1', item)
+    reviews = MergeRequest('http://www.example.com/1/reviews', item)
+    optional = Request('http://www.example.com/related', meta={'deadline_optional': True})
+
+    assert middleware.process_request(reviews, None) is None
+    assert reviews.meta['download_timeout'] == 100
+
+    clock.advance(80)
+    for request in (reviews, optional):
+        with pytest.raises(IgnoreRequest):
+            middleware.process_request(request, None)
+    assert crawler.stats.get_value('deadline/shed') == 2
+    middleware.process_request(initial, None)
+    assert initial.meta['download_timeout'] == 20
+
+
+def test_partial_items_are_emitted_at_deadline(middleware, merge, crawler, clock):
+    task_spider = spider()
+    middleware.task_opened(task_spider)
+    item = SiteProductItem(title='Partial')
+    list(merge.process_start_requests([MergeRequest('http://www.example.com/1', item)], task_spider))
+
+    clock.advance(100)
+    crawler.engine.scraper._process_spidermw_output.assert_called_once_with(item, None, None, task_spider)
+    crawler.engine.close_spider.assert_called_once_with(task_spider, reason='deadline')
+    assert crawler.stats.get_value('deadline/partial_items') == 1
+    assert not merge.memorized
+
+
+def test_closed_task_does_not_expire(middleware, crawler, clock):
+    task_spider = spider()
+    middleware.task_opened(task_spider)
+    middleware.task_closed(task_spider)
+    clock.advance(100)
+    assert not crawler.engine.close_spider.called
+    assert middleware.process_request(Request('http://www.example.com/1'), None) is None
@@ -0,0 +1,101 @@
+import mock
+import pytest
+from OpenSSL import SSL
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from scrapy.settings import Settings
+from scrapy.utils.project import get_project_settings
+
+from content_analytics.downloader import (
+    SessionCachingContextFactory,
+    SharedConnectionPool,
+    SharedHTTP11DownloadHandler,
+    SharedHTTPResources
+)
+from content_analytics.utils import CustomClientContextFactory
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def settings():
+    return Settings(dict(get_project_settings(), HTTP_POOL_MAX_PER_HOST=4))
+
+
+@pytest.fixture()
+def resources(settings, stats):
+    resources = SharedHTTPResources(settings, stats=stats)
+    SharedHTTP11DownloadHandler.install(resources)
+    yield resources
+    SharedHTTP11DownloadHandler.install(None)
+
+
+def test_pool_counts_reused_connections(stats):
+    pool = SharedConnectionPool(Clock(), stats=stats)
+    endpoint = mock.MagicMock()
+    connection = mock.MagicMock(state='QUIESCENT')
+    endpoint.connect.return_value = defer.succeed(connection)
+    key = ('https', 'www.example.com', 443)
+
+    pool.getConnection(key, endpoint)
+    pool._putConnection(key, connection)
+    pool.getConnection(key, endpoint)
+    pool.getConnection(key, endpoint)
+
+    assert endpoint.connect.call_count == 2
+    assert stats.get_value('http_pool/created') == 2
+    assert stats.get_value('http_pool/reused') == 1
+    assert stats.get_value('http_pool/reuse_rate') == 0.333
+
+
+def test_tls_options_are_kept_per_host(stats):
+    factory = SessionCachingContextFactory(CustomClientContextFactory(), max_hosts=2, stats=stats)
+    first = factory.creatorForNetloc(b'www.example.com', 443)
+    assert factory.creatorForNetloc(b'www.example.com', 443) is first
+    assert factory.creatorForNetloc(b'www.example.org', 443) is not first
+    factory.creatorForNetloc(b'www.example.net', 443)
+    # The least recently used host is dropped
+    assert list(factory.hosts) == [(b'www.example.org', 443), (b'www.example.net', 443)]
+
+    factory.handshake_done(resumed=False)
+    factory.handshake_done(resumed=True)
+    assert stats.get_value('tls/handshakes') == 2
+    assert stats.get_value('tls/resumed') == 1
+
+
+def test_handlers_share_installed_resources(settings, resources):
+    with mock.patch('scrapy.core.downloader.handlers.http11.HTTPConnectionPool') as pool_cls:
+        first, second = SharedHTTP11DownloadHandler(settings), SharedHTTP11DownloadHandler(settings)
+    # No per-crawler pool is created just to be replaced
+    assert not pool_cls.called
+    assert first._pool is second._pool is resources.pool
+    assert first._default_maxsize == settings.getint('DOWNLOAD_MAXSIZE')
+    assert first._contextFactory is resources.context_factory
+    assert resources.pool.maxPersistentPerHost == 4
+
+    with mock.patch.object(resources.pool, 'closeCachedConnections') as close:
+        first.close()
+        assert not close.called
+
+
+def test_handler_has_own_pool_without_resources(settings):
+    handler = SharedHTTP11DownloadHandler(settings)
+    assert not isinstance(handler._pool, SharedConnectionPool)
+
+
+def test_handler_with_own_tls_settings_gets_its_own_shared_pool(settings, resources):
+    spider_settings = settings.copy()
+    spider_settings.set('DOWNLOADER_CLIENT_TLS_METHOD', 'TLSv1.2', priority='spider')
+    first, second = SharedHTTP11DownloadHandler(spider_settings), SharedHTTP11DownloadHandler(spider_settings)
+    default = SharedHTTP11DownloadHandler(settings)
+
+    assert first._pool is second._pool is not resources.pool
+    assert first._contextFactory is second._contextFactory is not default._contextFactory
+    assert first._contextFactory.context_factory._ssl_method == SSL.TLSv1_2_METHOD
+    assert isinstance(first._pool, SharedConnectionPool) and first._pool.maxPersistentPerHost == 4
+    assert default._pool is resources.pool
+
+    with mock.patch.object(first._pool, 'closeCachedConnections', return_value=defer.succeed(None)) as close, \
+            mock.patch.object(resources.pool, 'closeCachedConnections', return_value=defer.succeed(None)):
+        assert resources.close().called
+    assert close.called
@@ -0,0 +1,15 @@
+import mock
+
+from content_analytics.executor import ThreadPoolExecutor
+
+
+def test_thread_pool_is_started_by_first_call():
+    reactor = mock.MagicMock()
+    executor = ThreadPoolExecutor(reactor, max_threads=2)
+    with mock.patch.object(executor.threadpool, 'start') as start, \
+            mock.patch('content_analytics.executor.threads.deferToThreadPool') as defer_to_thread_pool:
+        executor.call(len, 'abc')
+        executor.call(len, 'de')
+    start.assert_called_once_with()
+    reactor.addSystemEventTrigger.assert_called_once_with('during', 'shutdown', executor.stop)
+    defer_to_thread_pool.assert_called_with(reactor, executor.threadpool, len, 'de')
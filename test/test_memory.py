@@ -0,0 +1,44 @@
+import mock
+
+from content_analytics import memory
+from content_analytics.extensions.memory import MemoryDeltaExtension
+from content_analytics.memory import MemoryWatchdog
+
+# pylint:disable=redefined-outer-name
+
+MB = 1 << 20
+
+
+def test_rss_is_read():
+    assert memory.get_rss() > 0
+
+
+def test_rss_limit(stats, clock):
+    watchdog = MemoryWatchdog(rss_limit=100 * MB, stats=stats, clock=clock)
+    with mock.patch.object(memory, 'get_rss', return_value=99 * MB):
+        assert watchdog.check() is None
+    with mock.patch.object(memory, 'get_rss', return_value=101 * MB):
+        assert watchdog.check() == 'RSS 101 MB is over 100 MB'
+    assert stats.get_value('memory/rss_max') == 101 * MB
+    assert stats.get_value('memory/exceeded') == 1
+
+
+def test_heap_is_sampled_with_interval(stats, clock):
+    watchdog = MemoryWatchdog(heap_limit=1000, heap_interval=60, stats=stats, clock=clock)
+    with mock.patch.object(memory, 'get_heap_objects', return_value=500) as get_heap_objects:
+        assert watchdog.check() is None
+        clock.advance(30)
+        watchdog.check()
+        assert get_heap_objects.call_count == 1
+    clock.advance(30)
+    with mock.patch.object(memory, 'get_heap_objects', return_value=1500):
+        assert watchdog.check() == '1500 heap objects are over 1000'
+    assert stats.get_value('memory/heap_objects') == 1500
+
+
+def test_task_memory_delta_is_in_stats(stats):
+    extension = MemoryDeltaExtension(stats)
+    with mock.patch('content_analytics.extensions.memory.get_rss', side_effect=[100 * MB, 103 * MB]):
+        extension.spider_opened(None)
+        extension.spider_closed(None)
+    assert stats.get_value('memory/rss_delta') == 3 * MB
@@ -0,0 +1,178 @@
+import mock
+import pytest
+from twisted.internet import defer
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.statscollectors import StatsCollector
+
+from content_analytics.middlewares.ratelimit import (
+    DomainLimiter,
+    DomainLimiterMiddleware,
+    LeasedTokenBucket,
+    LocalTokenStore,
+    TokenBucket
+)
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def limiter(stats, clock):
+    return DomainLimiter(stats=stats, clock=clock)
+
+
+def crawler(limiter, **settings):
+    crawler = mock.MagicMock()
+    crawler.settings = Settings(dict({'DOMAIN_LIMITER_ENABLED': True}, **settings))
+    crawler.stats = StatsCollector(crawler)
+    crawler.domain_limiter = limiter
+    crawler.spider.name = 'example_products'
+    return crawler
+
+
+def test_token_bucket_refills_with_rate():
+    bucket = TokenBucket(rate=2, burst=2, now=0)
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 0.5
+    assert bucket.take(0.5) == 0
+    assert TokenBucket(rate=0, burst=1, now=0).take(0) == 0
+
+
+def test_concurrency_is_limited_per_domain(limiter):
+    first = [limiter.acquire('example.com', concurrency=2) for _ in range(3)]
+    other = limiter.acquire('example.org', concurrency=2)
+    assert [waiter.called for waiter in first] == [True, True, False]
+    assert other.called
+
+    limiter.release('example.com')
+    assert first[2].called
+    # Unknown or not acquired domains are ignored
+    limiter.release('example.net')
+    limiter.release('example.org')
+    limiter.release('example.org')
+    assert limiter.slots['example.org'].active == 0
+
+
+def test_rate_is_limited_and_waiting_time_is_measured(limiter, stats, clock):
+    waiters = [limiter.acquire('example.com', rate=1, burst=1, concurrency=10) for _ in range(3)]
+    assert [waiter.called for waiter in waiters] == [True, False, False]
+
+    clock.advance(1)
+    assert waiters[1].called and not waiters[2].called
+    clock.advance(1)
+    assert waiters[2].called
+    assert stats.get_value('domain_limiter/acquired') == 3
+    assert stats.get_value('domain_limiter/delayed') == 2
+    assert stats.get_value('domain_limiter/wait_time_max') == 2
+    assert stats.get_value('domain_limiter/wait_time_avg') == 1.5
+
+
+def test_discarded_waiter_is_not_admitted(limiter):
+    limiter.acquire('example.com', concurrency=1)
+    waiter = limiter.acquire('example.com', concurrency=1)
+    limiter.discard(waiter)
+    limiter.release('example.com')
+    assert not waiter.called
+    assert limiter.slots['example.com'].active == 0
+
+
+def test_middleware_is_shared_by_crawlers(limiter, clock):
+    first = DomainLimiterMiddleware.from_crawler(crawler(limiter, DOMAIN_LIMITER_CONCURRENCY=1))
+    second_crawler = crawler(limiter, DOMAIN_LIMITER_CONCURRENCY=1)
+    second = DomainLimiterMiddleware.from_crawler(second_crawler)
+
+    request = Request('http://www.example.com/1')
+    assert first.process_request(request, None) is None
+    waiting = Request('http://www.example.com/2')
+    result = second.process_request(waiting, None)
+    assert isinstance(result, defer.Deferred) and not result.called
+
+    clock.advance(3)
+    first.process_response(request, Response(request.url), None)
+    assert result.called
+    assert second_crawler.stats.get_value('domain_limiter/delayed') == 1
+    assert second_crawler.stats.get_value('domain_limiter/wait_time') == 3
+
+    second.process_exception(waiting, Exception(), None)
+    assert limiter.slots['www.example.com'].active == 0
+
+
+def test_middleware_is_disabled_by_default(limiter):
+    with pytest.raises(Exception):
+        DomainLimiterMiddleware.from_crawler(crawler(limiter, DOMAIN_LIMITER_ENABLED=False))
+
+
+def test_middleware_uses_site_budget(limiter):
+    budgets = {'example': {'rate': 5, 'concurrency': 2}}
+    middleware = DomainLimiterMiddleware.from_crawler(crawler(limiter, DOMAIN_LIMITER_BUDGETS=budgets))
+    assert (middleware.rate, middleware.burst, middleware.concurrency) == (5, 5, 2)
+
+    other_crawler = crawler(limiter, DOMAIN_LIMITER_BUDGETS=budgets, DOMAIN_LIMITER_RATE=1)
+    other_crawler.spider.name = 'other_products'
+    other = DomainLimiterMiddleware.from_crawler(other_crawler)
+    assert (other.rate, other.burst, other.concurrency) == (1, 1, 8)
+
+
+def sync_executor(function, *args):
+    return defer.maybeDeferred(function, *args)
+
+
+def leased_bucket(store, clock, stats=None, **kwargs):
+    params = dict(key='example.com', rate=10, burst=10, lease_size=5, lease_ttl=1, now=clock.seconds())
+    params.update(kwargs)
+    return LeasedTokenBucket(store, stats=stats, clock=clock, executor=sync_executor, **params)
+
+
+def test_local_token_store_refills_with_rate():
+    store = LocalTokenStore()
+    assert store.lease('example.com', rate=2, burst=4, count=3, now=0) == 3
+    assert store.lease('example.com', rate=2, burst=4, count=3, now=0) == 1
+    assert store.lease('example.com', rate=2, burst=4, count=3, now=0) == 0
+    assert store.lease('example.com', rate=2, burst=4, count=3, now=1) == 2
+    assert store.lease('example.com', rate=2, burst=4, count=3, now=100) == 3
+
+
+def test_nodes_share_rate_through_store(clock, stats):
+    store = LocalTokenStore()
+    nodes = [leased_bucket(store, clock, stats) for _ in range(2)]
+    with mock.patch('content_analytics.middlewares.ratelimit.time.time', return_value=0):
+        taken = sum(1 for _ in range(20) for node in nodes if node.take(0) == 0)
+    # Burst of the shared bucket is split between the nodes
+    assert taken == 10
+    assert stats.get_value('domain_limiter/leased_tokens') == 10
+    assert stats.get_value('domain_limiter/leases_denied') >= 1
+
+
+def test_leased_tokens_expire(clock, stats):
+    bucket = leased_bucket(LocalTokenStore(), clock, stats, burst=5)
+    with mock.patch('content_analytics.middlewares.ratelimit.time.time', return_value=0):
+        assert bucket.take(0) == 0
+    clock.advance(2)
+    with mock.patch('content_analytics.middlewares.ratelimit.time.time', return_value=2):
+        assert bucket.take(2) == 0
+    assert stats.get_value('domain_limiter/expired_tokens') == 4
+
+
+def test_store_errors_fall_back_to_local_bucket(clock, stats):
+    store = mock.MagicMock()
+    store.lease.side_effect = Exception('Timeout')
+    bucket = leased_bucket(store, clock, stats, rate=1, burst=1)
+    assert bucket.take(0) > 0
+    assert stats.get_value('domain_limiter/lease_errors') == 1
+    # Local limits are used until the store is retried
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 1
+    assert store.lease.call_count == 1
+
+
+def test_waiters_are_woken_up_by_lease(stats, clock):
+    store = LocalTokenStore()
+    limiter = DomainLimiter(stats=stats, clock=clock, store=store)
+    leasing = defer.Deferred()
+    with mock.patch('content_analytics.middlewares.ratelimit.threads.deferToThread', return_value=leasing):
+        waiter = limiter.acquire('example.com', rate=10, burst=10)
+    assert not waiter.called
+    leasing.callback(5)
+    assert waiter.called
+    assert limiter.slots['example.com'].bucket.tokens == 4
@@ -0,0 +1,31 @@
+import mock
+from aerospike import exception  # pylint: disable=E0611
+
+from content_analytics.middlewares.ratelimit.aero import AerospikeTokenStore
+
+
+def token_store(client):
+    with mock.patch('content_analytics.middlewares.ratelimit.aero.aerospike.client', return_value=client):
+        return AerospikeTokenStore(hosts=[('localhost', 3000)], namespace='cache', set_='rate_limits', ttl=60)
+
+
+def test_new_bucket_is_created_with_burst():
+    client = mock.MagicMock()
+    client.get.side_effect = exception.RecordNotFound
+    assert token_store(client).lease('example.com', rate=1, burst=10, count=4, now=100) == 4
+    _, kwargs = client.put.call_args
+    assert client.put.call_args[0][1] == {'tokens': 6, 'updated': 100}
+    assert kwargs['policy'] == {'exists': 1}
+
+
+def test_lease_is_retried_on_generation_conflict():
+    client = mock.MagicMock()
+    client.get.side_effect = [
+        (None, {'gen': 1}, {'tokens': 1, 'updated': 100}),
+        (None, {'gen': 2}, {'tokens': 0, 'updated': 100}),
+    ]
+    client.put.side_effect = [exception.RecordGenerationError, None]
+    # Another node took the last token in between
+    assert token_store(client).lease('example.com', rate=1, burst=10, count=4, now=100) == 0
+    assert client.put.call_count == 2
+    assert client.put.call_args[1]['meta'] == {'ttl': 60, 'gen': 2}
@@ -0,0 +1,80 @@
+import json
+from datetime import datetime
+
+import mock
+import pytest
+from botocore.exceptions import ClientError
+from twisted.internet import defer
+
+from content_analytics.remotesettings import RemoteSettings
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def client():
+    return mock.MagicMock()
+
+
+def response(config, etag):
+    body = mock.MagicMock()
+    body.read.return_value = json.dumps(config)
+    return {'ETag': etag, 'LastModified': datetime(2018, 1, 1), 'Body': body}
+
+
+def not_modified():
+    return ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+
+
+def remote_settings(client, applied, tmpdir, stats, clock):
+    return RemoteSettings('proxy', client, 'bucket', 'proxy.cfg', applied.append, cache_dir=str(tmpdir),
+                          interval=60, stats=stats, clock=clock, executor=defer.maybeDeferred)
+
+
+def test_settings_are_refreshed_with_etag(client, tmpdir, stats, clock):
+    applied = []
+    settings = remote_settings(client, applied, tmpdir, stats, clock)
+    client.get_object.return_value = response({'walmart': 1}, '"v1"')
+    settings.load()
+    settings.start()
+    assert applied == [{'walmart': 1}]
+    assert stats.get_value('settings/proxy/version') == 'v1'
+
+    client.get_object.side_effect = not_modified()
+    clock.advance(60)
+    client.get_object.assert_called_with(Bucket='bucket', Key='proxy.cfg', IfNoneMatch='"v1"')
+    assert stats.get_value('settings/proxy/not_modified') == 1
+
+    client.get_object.side_effect = None
+    client.get_object.return_value = response({'walmart': 2}, '"v2"')
+    clock.advance(60)
+    assert applied == [{'walmart': 1}, {'walmart': 2}]
+    assert stats.get_value('settings/proxy/version') == 'v2'
+    assert stats.get_value('settings/proxy/age') > 0
+
+
+def test_refresh_errors_keep_current_settings(client, tmpdir, stats, clock):
+    applied = []
+    settings = remote_settings(client, applied, tmpdir, stats, clock)
+    client.get_object.return_value = response({'walmart': 1}, '"v1"')
+    settings.load()
+    client.get_object.side_effect = Exception('Timeout')
+    settings.refresh()
+    assert applied == [{'walmart': 1}]
+    assert settings.etag == '"v1"'
+    assert stats.get_value('settings/proxy/errors') == 1
+
+
+def test_saved_copy_is_used_without_s3(client, tmpdir, stats, clock):
+    client.get_object.return_value = response({'walmart': 1}, '"v1"')
+    remote_settings(client, [], tmpdir, stats, clock).load()
+
+    applied = []
+    restarted = remote_settings(client, applied, tmpdir, stats, clock)
+    client.get_object.side_effect = Exception('Timeout')
+    restarted.load()
+    assert applied == [{'walmart': 1}]
+    assert restarted.etag == '"v1"'
+
+    with pytest.raises(Exception):
+        remote_settings(client, [], tmpdir.join('empty'), stats, clock).load()
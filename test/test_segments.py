@@ -0,0 +1,87 @@
+import json
+
+import mock
+import pytest
+from twisted.internet import defer
+
+from content_analytics.messages.sc import InputMessage, MessageResolver
+from content_analytics.segments import SegmentRange, SegmentWriter
+
+# pylint:disable=redefined-outer-name
+
+
+class Uploader(object):
+    def __init__(self):
+        self.uploads = []
+
+    def upload(self, fileobj, bucket_name, key):
+        d = defer.Deferred()
+        self.uploads.append((d, fileobj.read(), bucket_name, key))
+        return d
+
+
+@pytest.fixture()
+def uploader():
+    return Uploader()
+
+
+@pytest.fixture()
+def segments(uploader, stats, clock):
+    return SegmentWriter(uploader, 'bucket', max_bytes=20, max_age=5, stats=stats, clock=clock)
+
+
+def test_outputs_wait_for_segment_upload(segments, uploader, clock):
+    ranges = []
+    segments.append('{"a": 1}\n').addCallback(ranges.append)
+    segments.append('{"b": 22}\n').addCallback(ranges.append)
+    assert not uploader.uploads
+
+    clock.advance(5)
+    (d, data, bucket_name, key), = uploader.uploads
+    assert (data, bucket_name) == ('{"a": 1}\n{"b": 22}\n', 'bucket')
+    assert key.startswith('output/') and '/segments/' in key
+    assert not ranges
+
+    d.callback(key)
+    assert ranges == [key, key]
+    assert [(r.offset, r.length) for r in ranges] == [(0, 9), (9, 10)]
+    assert data[ranges[1].offset:ranges[1].offset + ranges[1].length] == '{"b": 22}\n'
+    assert ranges[1].http_range == 'bytes=9-18'
+
+
+def test_segment_is_flushed_on_size(segments, uploader, clock, stats):
+    segments.append('x' * 15)
+    segments.append('y' * 15)
+    assert len(uploader.uploads) == 1
+    segments.append('z')
+    assert uploader.uploads[0][3] != segments.key
+    clock.advance(5)
+    assert len(uploader.uploads) == 2
+    assert stats.get_value('segments/outputs_max') == 2
+
+
+def test_failed_upload_fails_all_outputs(segments, uploader):
+    failures = []
+    for data in ('a\n', 'b\n'):
+        segments.append(data).addErrback(failures.append)
+    segments.flush()
+    uploader.uploads[0][0].errback(IOError('Connection reset'))
+    assert len(failures) == 2
+    assert segments.stats.get_value('segments/failed') == 1
+
+
+def test_output_message_has_range():
+    raw_message = mock.MagicMock()
+    raw_message.body = json.dumps({'url': 'http://www.example.com/1', 'site': 'example', 'task_id': 1,
+                                   'result_queue': 'out', 'response_format': 'sc'})
+    message = InputMessage(raw_message)
+    key = SegmentRange('output/2018/01/01/segments/1.jl', 100, 50)
+    output = json.loads(str(MessageResolver.resolve(message=message, bucket_name='bucket', bucket_key=key)))
+    assert output['s3_key_data'] == output['s3_key'] == 'output/2018/01/01/segments/1.jl'
+    assert (output['s3_offset'], output['s3_length']) == (100, 50)
+    plain = MessageResolver.resolve(message=message, bucket_name='bucket', bucket_key='output/1.jl')
+    assert 's3_offset' not in plain
+    compressed = SegmentRange('output/2018/01/01/segments/1.jl', 100, 50, 'gzip')
+    output = MessageResolver.resolve(message=message, bucket_name='bucket', bucket_key=compressed)
+    assert output['s3_content_encoding'] == 'gzip'
+
@@ -0,0 +1,69 @@
+import sys
+
+import mock
+import pytest
+from scrapy.settings import Settings
+from scrapy.spiderloader import SpiderLoader
+
+from content_analytics import spiderloader
+from content_analytics.spiderloader import ManifestSpiderLoader, build_manifest, read_manifest, write_manifest
+
+# pylint:disable=redefined-outer-name
+
+SPIDER_MODULES = ['content_analytics.spiders']
+
+
+@pytest.fixture()
+def manifest_path(tmpdir):
+    path = str(tmpdir.join('manifest.json'))
+    write_manifest(path, {
+        'spider_modules': SPIDER_MODULES,
+        'spiders': {
+            'gnc_products': 'content_analytics.spiders.gnc',
+            'moved_products': 'content_analytics.spiders.gnc'
+        }
+    })
+    return path
+
+
+@pytest.fixture()
+def settings(manifest_path):
+    return Settings({'SPIDER_MODULES': SPIDER_MODULES, 'SPIDER_MANIFEST': manifest_path})
+
+
+def test_manifest_is_up_to_date():
+    assert read_manifest(spiderloader.DEFAULT_MANIFEST_PATH) == build_manifest(SPIDER_MODULES), \
+        'Spider manifest is outdated, rebuild it with python -m content_analytics.spiderloader'
+
+
+def test_spiders_are_listed_without_imports(settings):
+    with mock.patch.object(spiderloader, 'import_module') as import_module:
+        loader = ManifestSpiderLoader.from_settings(settings)
+        assert sorted(loader.list()) == ['gnc_products', 'moved_products']
+    assert not import_module.called
+
+
+def test_spider_is_imported_on_load(settings):
+    loader = ManifestSpiderLoader.from_settings(settings)
+    with mock.patch.object(spiderloader, 'import_module', wraps=spiderloader.import_module) as import_module:
+        spider_class = loader.load('gnc_products')
+        assert loader.load('gnc_products') is spider_class
+    import_module.assert_called_once_with('content_analytics.spiders.gnc')
+    assert spider_class.name == 'gnc_products'
+    assert 'content_analytics.spiders.gnc' in sys.modules
+    with pytest.raises(KeyError):
+        loader.load('unknown_products')
+
+
+def test_outdated_manifest_falls_back_to_all_spiders(settings):
+    loader = ManifestSpiderLoader.from_settings(settings)
+    with mock.patch.object(SpiderLoader, 'load', return_value=mock.sentinel.spider_class) as load:
+        assert loader.load('moved_products') is mock.sentinel.spider_class
+    load.assert_called_once_with('moved_products')
+
+
+def test_missing_or_other_manifest_uses_scrapy_loader(settings, tmpdir):
+    settings.set('SPIDER_MANIFEST', str(tmpdir.join('missing.json')))
+    assert isinstance(ManifestSpiderLoader.from_settings(settings), SpiderLoader)
+    write_manifest(settings['SPIDER_MANIFEST'], {'spider_modules': ['other.spiders'], 'spiders': {}})
+    assert isinstance(ManifestSpiderLoader.from_settings(settings), SpiderLoader)
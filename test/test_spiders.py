@@ -0,0 +1,24 @@
+from content_analytics.spiders.staples import StaplesProductsSpider
+from content_analytics.spiders.target import TargetProductsSpider
+
+
+def batch_requests(spider):
+    return [(request.url, request.meta['item']['batch_url']) for request in spider.make_requests()]
+
+
+def test_batch_urls_are_normalized_like_single_url():
+    url = 'https://www.target.com/p/some-product/-/A-1234567'
+    single = TargetProductsSpider(product_url=url)
+    batch = TargetProductsSpider(product_urls=[url])
+    assert batch_requests(batch) == [(single.product_url, url)]
+    assert 'redsky' in single.product_url
+
+
+def test_unsupported_batch_urls_are_skipped():
+    spider = StaplesProductsSpider(product_urls=[
+        'https://www.staples.com/Some-Product/product_12345',
+        'https://www.staples.com/deals'
+    ])
+    assert batch_requests(spider) == [
+        ('https://www.staples.com/product_12345', 'https://www.staples.com/Some-Product/product_12345')
+    ]
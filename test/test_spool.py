@@ -0,0 +1,133 @@
+import os
+import gzip
+import json
+from cStringIO import StringIO
+
+import mock
+import pytest
+from twisted.internet import defer
+from twisted.internet.task import Clock
+
+from content_analytics.backends.memory import MemoryBackend
+from content_analytics.compression import GzipCompression
+from content_analytics.spool import UploadSpool
+from content_analytics.uploader import S3Uploader
+
+# pylint:disable=redefined-outer-name
+
+# Over the maximal pid of Linux, so no process is running with it
+DEAD_PID = 4194305
+
+
+class ImmediateExecutor(object):
+    def call(self, func, *args, **kwargs):
+        return defer.maybeDeferred(func, *args, **kwargs)
+
+
+@pytest.fixture()
+def client():
+    MemoryBackend.reset()
+    client = MemoryBackend().resource('s3').meta.client
+    client.upload_fileobj = mock.MagicMock(side_effect=client.upload_fileobj)
+    return client
+
+
+@pytest.fixture()
+def uploader(client, stats, tmpdir, clock):
+    uploader = S3Uploader(client, ImmediateExecutor(), stats=stats)
+    uploader.spool = UploadSpool(uploader, str(tmpdir), max_retries=2, retry_delay=5, stats=stats, clock=clock)
+    return uploader
+
+
+def test_failed_upload_is_retried_from_spool(uploader, client, stats, clock):
+    client.upload_fileobj.side_effect = [IOError('Connection reset'), IOError('Connection reset'), None]
+    output = StringIO('skipped{"title": "First"}\n')
+    output.seek(len('skipped'))
+    results = []
+    uploader.upload(output, 'bucket', 'output/1.jl').addCallback(results.append)
+    output.close()
+    assert not results
+    assert stats.get_value(UploadSpool.STATS_DEPTH) == 1
+    entry, = uploader.spool.entries.values()
+    assert open(entry.data_path).read() == '{"title": "First"}\n'
+    assert json.load(open(entry.meta_path))['key'] == 'output/1.jl'
+
+    clock.advance(5)
+    assert not results
+    # Retry delay is doubled
+    clock.advance(5)
+    assert not results
+    clock.advance(5)
+    assert results == ['output/1.jl']
+    assert client.upload_fileobj.call_count == 3
+    assert stats.get_value(UploadSpool.STATS_DEPTH) == 0
+    assert stats.get_value(UploadSpool.STATS_DEPTH_MAX) == 1
+    assert not os.listdir(uploader.spool.own_path)
+
+
+def test_compressed_upload_is_spooled_compressed(uploader, client, clock):
+    uploads = []
+
+    def upload_fileobj(Fileobj, Bucket, Key, ExtraArgs=None, **kwargs):
+        if not uploads:
+            uploads.append(None)
+            raise IOError('Connection reset')
+        uploads.append((Fileobj.read(), ExtraArgs))
+
+    client.upload_fileobj.side_effect = upload_fileobj
+    uploader.upload(StringIO('{"title": "First"}\n'), 'bucket', 'output/1.jl', compression=GzipCompression())
+    entry, = uploader.spool.entries.values()
+    assert entry.content_encoding == 'gzip'
+    assert gzip.GzipFile(entry.data_path).read() == '{"title": "First"}\n'
+
+    clock.advance(5)
+    # Spooled data is uploaded as is
+    data, extra_args = uploads[1]
+    assert extra_args['ContentEncoding'] == 'gzip'
+    assert gzip.GzipFile(fileobj=StringIO(data)).read() == '{"title": "First"}\n'
+
+
+def test_spooled_upload_is_dropped_after_retries(uploader, client, stats, clock):
+    client.upload_fileobj.side_effect = IOError('Connection reset')
+    failures = []
+    uploader.upload(StringIO('{}\n'), 'bucket', 'output/1.jl').addErrback(failures.append)
+    clock.pump([5, 10])
+    assert failures[0].check(IOError)
+    assert client.upload_fileobj.call_count == 3
+    assert stats.get_value(UploadSpool.STATS_DROPPED) == 1
+    assert not uploader.spool.entries
+    assert not os.listdir(uploader.spool.own_path)
+
+
+def test_entries_of_dead_process_are_recovered(uploader, client, stats, clock, tmpdir):
+    dead = UploadSpool(uploader, str(tmpdir), pid=DEAD_PID, clock=Clock())
+    upload_fileobj, client.upload_fileobj.side_effect = client.upload_fileobj.side_effect, IOError('Connection reset')
+    uploader.spool, spool = dead, uploader.spool
+    uploader.upload(StringIO('{}\n'), 'bucket', 'output/1.jl')
+    uploader.spool, client.upload_fileobj.side_effect = spool, upload_fileobj
+
+    assert spool.recover() == 1
+    assert not os.path.exists(dead.own_path)
+    clock.advance(5)
+    assert MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0] == '{}\n'
+    assert stats.get_value(UploadSpool.STATS_RECOVERED) == 1
+    assert stats.get_value(UploadSpool.STATS_UPLOADED) == 1
+
+
+def test_entries_of_previous_process_with_same_pid_are_recovered(uploader, client, stats, clock, tmpdir):
+    previous = UploadSpool(uploader, str(tmpdir), pid=uploader.spool.pid, clock=Clock())
+    upload_fileobj, client.upload_fileobj.side_effect = client.upload_fileobj.side_effect, IOError('Connection reset')
+    uploader.spool, spool = previous, uploader.spool
+    uploader.upload(StringIO('{}\n'), 'bucket', 'output/1.jl')
+    uploader.spool, client.upload_fileobj.side_effect = spool, upload_fileobj
+    dead_path = os.path.join(str(tmpdir), str(DEAD_PID))
+    os.makedirs(dead_path)
+    open(os.path.join(dead_path, 'interrupted.data.tmp'), 'w').close()
+
+    assert spool.recover() == 1
+    assert spool.recover() == 0
+    assert stats.get_value(UploadSpool.STATS_DEPTH) == 1
+    assert not os.path.exists(dead_path)
+    clock.advance(5)
+    assert MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0] == '{}\n'
+    assert not os.listdir(spool.own_path)
@@ -0,0 +1,25 @@
+from content_analytics.stats import StatsMixin
+
+
+class Component(StatsMixin):
+    stats_prefix = 'component'
+
+    def __init__(self, stats=None):
+        self.stats = stats
+
+
+def test_observed_values_are_summarized_under_prefix(stats):
+    component = Component(stats)
+    component._inc_stats('calls', 2)
+    for value in (1, 2, 6):
+        component._observe('time', value)
+    assert stats.get_value('component/calls') == 2
+    assert stats.get_value('component/time_count') == 3
+    assert stats.get_value('component/time_avg') == 3.0
+    assert stats.get_value('component/time_max') == 6
+
+
+def test_stats_are_optional():
+    component = Component()
+    component._inc_stats('calls')
+    component._observe('time', 1)
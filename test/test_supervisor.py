@@ -0,0 +1,216 @@
+import threading
+import multiprocessing
+
+import mock
+import pytest
+from scrapy.settings import Settings
+
+from content_analytics import supervisor as supervisor_module
+from content_analytics.memory import RECYCLE_EXIT_CODE
+from content_analytics.supervisor import NORMAL, URGENT, PrefetchedQueue, Supervisor, SupervisedQueue, \
+    SupervisedMessage, Worker, WorkerConnection, aggregate_stats
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def now():
+    now = [1000.0]
+    with mock.patch.object(supervisor_module.time, 'time', side_effect=lambda: now[0]):
+        yield now
+
+
+@pytest.fixture()
+def supervisor(now):
+    supervisor = Supervisor(Settings({'RUNNER_WORKERS': 2, 'RUNNER_SUPERVISOR_RESTART_DELAY': 5}))
+    for kind in (NORMAL, URGENT):
+        supervisor.queues[kind] = PrefetchedQueue(kind, mock.MagicMock(), 300, 10)
+    return supervisor
+
+
+def add_worker(supervisor, number=0):
+    worker = Worker(number, mock.MagicMock(), dict((kind, mock.MagicMock()) for kind in supervisor.queues))
+    for connection in worker.connections.values():
+        connection.poll.return_value = False
+    supervisor.workers[number] = worker
+    return worker
+
+
+def buffer_messages(supervisor, count, received, kind=NORMAL):
+    for number in range(count):
+        supervisor.queues[kind].buffer.append(
+            (received, SupervisedMessage(str(number), 'handle-{}'.format(number), '{}'))
+        )
+
+
+def test_supervised_queue_takes_messages_from_supervisor():
+    queue = mock.MagicMock()
+    connection = mock.MagicMock()
+    connection.receive.return_value = ['message']
+    supervised = SupervisedQueue(queue, connection, URGENT)
+
+    assert supervised.receive_messages(MaxNumberOfMessages=5, VisibilityTimeout=300, WaitTimeSeconds=20) == ['message']
+    connection.receive.assert_called_once_with(URGENT, 5, 20)
+    assert supervised.url is queue.url
+    supervised.delete_messages(Entries=[])
+    queue.delete_messages.assert_called_once_with(Entries=[])
+
+
+def test_aggregate_stats_sums_counters_and_averages_ratios():
+    stats = aggregate_stats([
+        {'sqs/batch/send/calls': 2, 'sqs/batch/send/fill_ratio': 0.5, 'start_time': 'ignored'},
+        {'sqs/batch/send/calls': 3, 'sqs/batch/send/fill_ratio': 1.0},
+    ])
+    assert stats == {'sqs/batch/send/calls': 5, 'sqs/batch/send/fill_ratio': 0.75}
+
+
+def test_aggregate_stats_keeps_maximums_and_weights_averages():
+    stats = aggregate_stats([
+        {'runner/tasks/total_time_count': 9, 'runner/tasks/total_time_avg': 2.0,
+         'runner/tasks/total_time_max': 5.0, 'spool/depth_max': 3, 'runner/reactor_lag_min': 0.2},
+        {'runner/tasks/total_time_count': 1, 'runner/tasks/total_time_avg': 12.0,
+         'runner/tasks/total_time_max': 12.0, 'spool/depth_max': 1, 'runner/reactor_lag_min': 0.1},
+    ])
+    assert stats == {
+        'runner/tasks/total_time_count': 10,
+        'runner/tasks/total_time_avg': 3.0,
+        'runner/tasks/total_time_max': 12.0,
+        'spool/depth_max': 3,
+        'runner/reactor_lag_min': 0.1,
+    }
+
+
+def test_aggregate_stats_averages_without_counts_equally():
+    stats = aggregate_stats([{'http/latency_avg': 1.0}, {'http/latency_avg': 2.0}])
+    assert stats == {'http/latency_avg': 1.5}
+
+
+def test_request_is_served_from_buffer(supervisor, now):
+    worker = add_worker(supervisor)
+    buffer_messages(supervisor, 3, now[0])
+    worker.requests[NORMAL] = (2, now[0], supervisor.queues[NORMAL].receives)
+
+    supervisor.serve_requests()
+
+    sent = worker.connections[NORMAL].send.call_args[0][0]
+    assert [message.message_id for message in sent] == ['0', '1']
+    assert not worker.requests
+    assert len(supervisor.queues[NORMAL].buffer) == 1
+    assert supervisor.stats.get_value('supervisor/prefetch/served') == 2
+
+
+def test_empty_response_waits_for_queue_check_and_wait_time(supervisor, now):
+    worker = add_worker(supervisor)
+    worker.requests[NORMAL] = (10, now[0] + 20, supervisor.queues[NORMAL].receives)
+
+    supervisor.serve_requests()
+    supervisor.queues[NORMAL].receives += 1
+    supervisor.serve_requests()
+    assert not worker.connections[NORMAL].send.called
+
+    now[0] += 20
+    supervisor.serve_requests()
+    worker.connections[NORMAL].send.assert_called_once_with([])
+
+
+def test_urgent_request_is_served_while_normal_one_waits(supervisor, now):
+    worker = add_worker(supervisor)
+    buffer_messages(supervisor, 1, now[0], kind=URGENT)
+    worker.requests[NORMAL] = (10, now[0] + 20, supervisor.queues[NORMAL].receives)
+    worker.requests[URGENT] = (10, now[0] + 20, supervisor.queues[URGENT].receives)
+
+    supervisor.serve_requests()
+
+    assert [message.message_id for message in worker.connections[URGENT].send.call_args[0][0]] == ['0']
+    assert not worker.connections[NORMAL].send.called
+    assert list(worker.requests) == [NORMAL]
+
+
+def test_expired_prefetched_messages_are_dropped(supervisor, now):
+    buffer_messages(supervisor, 2, now[0] - 295)
+    buffer_messages(supervisor, 1, now[0])
+
+    assert len(supervisor.take_messages(supervisor.queues[NORMAL], 10)) == 1
+    assert supervisor.stats.get_value('supervisor/prefetch/expired') == 2
+
+
+def test_prefetched_messages_keep_receive_time(supervisor, now):
+    def receive_messages(**kwargs):
+        supervisor.stopping.set()
+        return [mock.MagicMock(message_id='1', attributes={'SentTimestamp': '990000'})]
+
+    queue = supervisor.queues[URGENT]
+    queue.queue.receive_messages.side_effect = receive_messages
+    with mock.patch.object(supervisor, 'release_buffer'):
+        supervisor.prefetch_messages(queue)
+
+    assert queue.queue.receive_messages.call_args[1]['AttributeNames'] == ['SentTimestamp']
+    assert not supervisor.queues[NORMAL].buffer
+    (received, message), = queue.buffer
+    assert message.received == received == now[0]
+    assert message.attributes == {'SentTimestamp': '990000'}
+
+
+def test_stats_are_sent_while_receive_waits():
+    connection, worker_end = multiprocessing.Pipe()
+    worker_connection = WorkerConnection({NORMAL: worker_end})
+    received = []
+    receiving = threading.Thread(target=lambda: received.append(worker_connection.receive(NORMAL, 10, 20)))
+    receiving.start()
+    assert connection.recv() == ('receive', 10, 20)
+
+    # Supervisor answers the long poll only at its deadline
+    worker_connection.send_stats({'item_scraped_count': 1})
+    assert connection.recv() == ('stats', {'item_scraped_count': 1})
+    connection.send(['message'])
+    receiving.join(5)
+    assert received == [['message']]
+
+
+def test_crashed_worker_is_restarted(supervisor, now):
+    crashed = add_worker(supervisor, 0)
+    crashed.process.is_alive.return_value = False
+    crashed.process.exitcode = -9
+    crashed.stats = {'sqs/batch/send/entries': 7}
+    finished = add_worker(supervisor, 1)
+    finished.process.is_alive.return_value = False
+    finished.process.exitcode = 0
+
+    with mock.patch.object(supervisor, 'start_worker') as start_worker:
+        supervisor.check_workers()
+        assert not start_worker.called
+        assert not supervisor.workers
+
+        now[0] += 5
+        supervisor.check_workers()
+        start_worker.assert_called_once_with(0)
+
+    assert supervisor.stats.get_value('supervisor/workers/crashed') == 1
+    assert supervisor.get_stats()['sqs/batch/send/entries'] == 7
+
+
+def test_recycled_worker_is_restarted_right_away(supervisor, now):
+    recycled = add_worker(supervisor, 0)
+    recycled.process.is_alive.return_value = False
+    recycled.process.exitcode = RECYCLE_EXIT_CODE
+
+    with mock.patch.object(supervisor, 'start_worker') as start_worker:
+        supervisor.check_workers()
+        start_worker.assert_called_once_with(0)
+
+    assert supervisor.stats.get_value('supervisor/workers/recycled') == 1
+    assert not supervisor.stats.get_value('supervisor/workers/crashed')
+
+
+def test_buffered_messages_are_released(supervisor, now):
+    buffer_messages(supervisor, 12, now[0])
+
+    buffer_messages(supervisor, 1, now[0], kind=URGENT)
+
+    supervisor.release_buffer()
+
+    calls = supervisor.queues[NORMAL].queue.change_message_visibility_batch.call_args_list
+    assert [len(call[1]['Entries']) for call in calls] == [10, 2]
+    assert calls[0][1]['Entries'][0] == {'Id': '0', 'ReceiptHandle': 'handle-0', 'VisibilityTimeout': 0}
+    assert supervisor.queues[URGENT].queue.change_message_visibility_batch.call_count == 1
+    assert not supervisor.queues[NORMAL].buffer and not supervisor.queues[URGENT].buffer
@@ -0,0 +1,96 @@
+import mock
+import pytest
+
+from content_analytics.tasks import TaskRegistry
+
+# pylint:disable=redefined-outer-name
+
+
+@pytest.fixture()
+def registry(stats, clock):
+    return TaskRegistry(stats=stats, clock=clock)
+
+
+def raw_message(message_id):
+    message = mock.MagicMock()
+    message.message_id = message_id
+    message.receipt_handle = 'handle-{}'.format(message_id)
+    return message
+
+
+def test_task_goes_through_all_states(registry, stats, clock):
+    message = raw_message('1')
+    task = registry.add(message, deadline=300)
+    assert task.state == TaskRegistry.RECEIVED
+    assert registry.get(message) is task
+    assert registry.in_progress == 1
+
+    clock.advance(1)
+    assert registry.transition(task, TaskRegistry.CRAWLING)
+    clock.advance(10)
+    assert registry.transition(task, TaskRegistry.SCRAPED)
+    assert registry.in_progress == 0
+    assert registry.finishing == 1
+    clock.advance(2)
+    assert registry.transition(task, TaskRegistry.UPLOADED)
+    clock.advance(0.5)
+    assert registry.transition(task, TaskRegistry.ACKED)
+
+    assert task.timestamps == {'received': 0, 'crawling': 1, 'scraped': 11, 'uploaded': 13, 'acked': 13.5}
+    assert message not in registry
+    assert len(registry) == 0
+    assert stats.get_value('runner/tasks/received_time_avg') == 1
+    assert stats.get_value('runner/tasks/crawling_time_max') == 10
+    assert stats.get_value('runner/tasks/scraped_time_avg') == 2
+    assert stats.get_value('runner/tasks/uploaded_time_count') == 1
+    assert stats.get_value('runner/tasks/total_time_avg') == 13.5
+    assert stats.get_value('runner/tasks/acked') == 1
+    assert stats.get_value('runner/tasks/finishing') == 0
+
+
+def test_transitions_only_go_forward(registry):
+    task = registry.add(raw_message('1'))
+    assert registry.transition(task, TaskRegistry.SCRAPED)
+    assert not registry.transition(task, TaskRegistry.CRAWLING)
+    assert not registry.transition(task, TaskRegistry.SCRAPED)
+    assert task.state == TaskRegistry.SCRAPED
+    assert registry.count(TaskRegistry.SCRAPED) == 1
+
+
+def test_transition_checks_expected_states(registry):
+    task = registry.add(raw_message('1'))
+    assert not registry.transition(task, TaskRegistry.UPLOADED, expected=[TaskRegistry.SCRAPED])
+    assert registry.transition(task, TaskRegistry.SCRAPED, expected=TaskRegistry.IN_PROGRESS)
+    assert not registry.transition(task, TaskRegistry.UPLOADED, expected=TaskRegistry.IN_PROGRESS)
+
+
+def test_duplicate_delivery_is_not_registered(registry, stats):
+    first = raw_message('1')
+    task = registry.add(first)
+    assert registry.add(raw_message('1')) is None
+    assert registry.get(raw_message('1')) is None
+    assert registry.get(first) is task
+    assert stats.get_value('runner/tasks/duplicates') == 1
+
+
+def test_removed_task_is_forgotten(registry):
+    task = registry.add(raw_message('1'))
+    registry.add(raw_message('2'))
+    registry.remove(task)
+    assert not registry.transition(task, TaskRegistry.CRAWLING)
+    assert registry.in_progress == 1
+    registry.remove(task)
+    assert len(registry) == 1
+
+
+def test_removed_task_frees_slot_and_cancels_deadline_call(registry, stats, clock):
+    task = registry.add(raw_message('1'))
+    registry.transition(task, TaskRegistry.CRAWLING)
+    overdue = []
+    task.deadline_call = clock.callLater(360, overdue.append, task)
+
+    registry.remove(task)
+    assert registry.in_progress == 0
+    assert stats.get_value('runner/tasks/in_progress') == 0
+    assert task.deadline_call is None
+    assert not clock.getDelayedCalls()
@@ -0,0 +1,229 @@
+import gzip
+from cStringIO import StringIO
+
+import mock
+import pytest
+from twisted.internet import defer
+from scrapy.settings import Settings
+
+from content_analytics.backends.memory import MemoryBackend
+from content_analytics.compression import GzipCompression
+from content_analytics.spool import UploadSpool
+from content_analytics.uploader import MultipartOutput, S3Uploader
+
+# pylint:disable=redefined-outer-name
+
+
+class HeldExecutor(object):
+    """Runs calls only when they are released, like a thread pool with busy threads."""
+
+    def __init__(self):
+        self.calls = []
+
+    def call(self, func, *args, **kwargs):
+        d = defer.Deferred()
+        self.calls.append((d, func, args, kwargs))
+        return d
+
+    def release(self):
+        d, func, args, kwargs = self.calls.pop(0)
+        defer.maybeDeferred(func, *args, **kwargs).chainDeferred(d)
+
+
+class ImmediateExecutor(object):
+    def call(self, func, *args, **kwargs):
+        return defer.maybeDeferred(func, *args, **kwargs)
+
+
+@pytest.fixture()
+def executor():
+    return HeldExecutor()
+
+
+@pytest.fixture()
+def client():
+    return mock.MagicMock()
+
+
+@pytest.fixture()
+def uploader(client, executor, stats):
+    return S3Uploader(client, executor, max_threads=1, stats=stats)
+
+
+def test_uploads_are_queued_over_max_threads(uploader, client, executor, stats):
+    first = uploader.upload(StringIO('first'), 'bucket', 'output/1.jl')
+    uploader.upload(StringIO('second'), 'bucket', 'output/2.jl')
+    assert stats.get_value(S3Uploader.STATS_PENDING) == 2
+    assert stats.get_value(S3Uploader.STATS_QUEUED) == 1
+    assert not client.upload_fileobj.called
+
+    executor.release()
+    assert first.result == 'output/1.jl'
+    assert client.upload_fileobj.call_args[1]['Key'] == 'output/1.jl'
+    assert stats.get_value(S3Uploader.STATS_QUEUED) == 0
+    executor.release()
+    assert stats.get_value(S3Uploader.STATS_PENDING) == 0
+    assert stats.get_value(S3Uploader.STATS_UPLOADED) == 2
+    assert stats.get_value(S3Uploader.STATS_QUEUED_MAX) == 1
+    assert stats.get_value('{}_count'.format(S3Uploader.STATS_UPLOAD_TIME)) == 2
+
+
+def test_failed_upload(uploader, client, executor, stats):
+    client.upload_fileobj.side_effect = IOError('Connection reset')
+    d = uploader.upload(StringIO('first'), 'bucket', 'output/1.jl')
+    executor.release()
+    assert stats.get_value(S3Uploader.STATS_FAILED) == 1
+    assert stats.get_value(S3Uploader.STATS_PENDING) == 0
+    d.addErrback(lambda failure: failure.trap(IOError))
+
+
+def test_client_is_created_once_from_settings():
+    MemoryBackend.reset()
+    uploader = S3Uploader.from_settings(Settings({
+        'BLOB_BACKEND': 'content_analytics.backends.memory.MemoryBackend',
+        'S3_UPLOAD_THREADS': 4
+    }))
+    assert uploader.max_threads == 4
+    assert uploader.executor.threadpool.max == 4
+    uploader.client.upload_fileobj(StringIO('data'), 'bucket', 'output/1.jl')
+    assert MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0] == 'data'
+
+
+def test_upload_is_compressed_in_upload_thread(uploader, client, executor, stats):
+    uploaded = []
+    client.upload_fileobj.side_effect = lambda Fileobj, **kwargs: uploaded.append(Fileobj.read())
+    uploader.upload(StringIO('{}\n' * 1000), 'bucket', 'output/1.jl', content_type='application/x-ndjson',
+                    compression=GzipCompression())
+    assert stats.get_value(S3Uploader.STATS_RAW_BYTES) is None
+    executor.release()
+
+    assert client.upload_fileobj.call_args[1]['ExtraArgs'] == {
+        'ContentType': 'application/x-ndjson',
+        'ContentEncoding': 'gzip'
+    }
+    assert gzip.GzipFile(fileobj=StringIO(uploaded[0])).read() == '{}\n' * 1000
+    assert stats.get_value(S3Uploader.STATS_RAW_BYTES) == 3000
+    assert stats.get_value(S3Uploader.STATS_COMPRESSED_BYTES) == len(uploaded[0])
+
+
+@pytest.fixture()
+def memory_uploader(stats, clock):
+    MemoryBackend.reset()
+    client = S3Uploader.from_settings(Settings({'BLOB_BACKEND': 'content_analytics.backends.memory.MemoryBackend'})).client
+    return S3Uploader(client, ImmediateExecutor(), stats=stats, clock=clock)
+
+
+@mock.patch.object(MultipartOutput, 'MIN_PART_SIZE', 10)
+def test_output_is_uploaded_in_parts_while_written(memory_uploader, stats):
+    output = MultipartOutput(memory_uploader, 'bucket', 'output/1.jl', part_size=10, max_memory=4)
+    output.write('{"a": 1}\n')
+    output.write('{"b": 2}\n')
+    assert output.multipart
+    assert stats.get_value(S3Uploader.STATS_PARTS) == 1
+    output.write('{"c": 3}\n')
+
+    result = output.finish()
+    assert result.result == 'output/1.jl'
+    assert stats.get_value(S3Uploader.STATS_PARTS) == 2
+    assert MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0] == '{"a": 1}\n{"b": 2}\n{"c": 3}\n'
+    assert not memory_uploader.client.multipart_uploads
+
+
+def test_small_output_is_uploaded_at_once(memory_uploader, stats):
+    output = MultipartOutput(memory_uploader, 'bucket', 'output/1.jl')
+    output.write('{"a": 1}\n')
+    assert output.finish().result == 'output/1.jl'
+    assert stats.get_value(S3Uploader.STATS_PARTS) is None
+    assert MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0] == '{"a": 1}\n'
+
+
+@mock.patch.object(MultipartOutput, 'MIN_PART_SIZE', 10)
+def test_compressed_output_is_uploaded_in_parts_while_written(memory_uploader, stats):
+    client = memory_uploader.client
+    output = MultipartOutput(memory_uploader, 'bucket', 'output/1.jl', part_size=10, compression=GzipCompression())
+    with mock.patch.object(client, 'create_multipart_upload', side_effect=client.create_multipart_upload) as create:
+        output.write('{"a": 1}\n{"b": 2}\n')
+    assert create.call_args[1]['ContentEncoding'] == 'gzip'
+    # Compressed part is uploaded once it reaches the part size
+    assert stats.get_value(S3Uploader.STATS_PARTS) == 1
+    output.write('{"c": 3}\n')
+
+    assert output.finish().result == 'output/1.jl'
+    assert stats.get_value(S3Uploader.STATS_PARTS) == 2
+    data = MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0]
+    assert gzip.GzipFile(fileobj=StringIO(data)).read() == '{"a": 1}\n{"b": 2}\n{"c": 3}\n'
+    assert stats.get_value(S3Uploader.STATS_RAW_BYTES) == 27
+    assert stats.get_value(S3Uploader.STATS_COMPRESSED_BYTES) == len(data)
+
+
+def test_small_compressed_output_is_compressed_at_once(memory_uploader, stats):
+    output = MultipartOutput(memory_uploader, 'bucket', 'output/1.jl', compression=GzipCompression())
+    output.write('{"a": 1}\n')
+    assert output.finish().result == 'output/1.jl'
+    assert stats.get_value(S3Uploader.STATS_PARTS) is None
+    data = MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0]
+    assert gzip.GzipFile(fileobj=StringIO(data)).read() == '{"a": 1}\n'
+
+
+@mock.patch.object(MultipartOutput, 'MIN_PART_SIZE', 10)
+def test_failed_part_is_retried(memory_uploader, stats, clock):
+    output = MultipartOutput(memory_uploader, 'bucket', 'output/1.jl', part_size=10)
+    upload_part = memory_uploader.client.upload_part
+    failures = [IOError('Connection reset')]
+
+    def fail_once(**kwargs):
+        if failures:
+            raise failures.pop()
+        return upload_part(**kwargs)
+
+    with mock.patch.object(memory_uploader.client, 'upload_part', side_effect=fail_once) as failing:
+        output.write('{"a": 1}\n{"b": 2}\n')
+        assert stats.get_value(S3Uploader.STATS_PARTS) is None
+        clock.advance(memory_uploader.retry_delay)
+        assert failing.call_count == 2
+    assert stats.get_value(S3Uploader.STATS_RETRIED) == 1
+    assert stats.get_value(S3Uploader.STATS_PARTS) == 1
+    output.write('{"c": 3}\n')
+
+    assert output.finish().result == 'output/1.jl'
+    assert MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0] == '{"a": 1}\n{"b": 2}\n{"c": 3}\n'
+    assert not memory_uploader.client.multipart_uploads
+
+
+@mock.patch.object(MultipartOutput, 'MIN_PART_SIZE', 10)
+def test_failed_multipart_upload_is_uploaded_at_once(memory_uploader, stats, clock):
+    output = MultipartOutput(memory_uploader, 'bucket', 'output/1.jl', part_size=10)
+    with mock.patch.object(memory_uploader.client, 'upload_part', side_effect=IOError('Connection reset')):
+        output.write('{"a": 1}\n{"b": 2}\n')
+        # Backoff of every retry is doubled
+        for attempt in range(memory_uploader.retries):
+            clock.advance(memory_uploader.retry_delay * 2 ** attempt)
+    assert stats.get_value(S3Uploader.STATS_RETRIED) == memory_uploader.retries
+    output.write('{"c": 3}\n')
+
+    assert output.finish().result == 'output/1.jl'
+    output.close()
+    assert not memory_uploader.client.multipart_uploads
+    assert MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0] == '{"a": 1}\n{"b": 2}\n{"c": 3}\n'
+
+
+@mock.patch.object(MultipartOutput, 'MIN_PART_SIZE', 10)
+def test_failed_multipart_upload_is_spooled(memory_uploader, tmpdir, clock):
+    memory_uploader.spool = UploadSpool(memory_uploader, str(tmpdir), retry_delay=5, clock=clock)
+    memory_uploader.retries = 0
+    output = MultipartOutput(memory_uploader, 'bucket', 'output/1.jl', part_size=10)
+    with mock.patch.object(memory_uploader.client, 'upload_part', side_effect=IOError('Connection reset')):
+        output.write('{"a": 1}\n{"b": 2}\n')
+    output.write('{"c": 3}\n')
+
+    results = []
+    with mock.patch.object(memory_uploader.client, 'upload_fileobj', side_effect=IOError('Connection reset')):
+        output.finish().addCallback(results.append)
+    output.close()
+    assert not results
+    entry, = memory_uploader.spool.entries.values()
+    assert open(entry.data_path).read() == '{"a": 1}\n{"b": 2}\n{"c": 3}\n'
+
+    clock.advance(5)
+    assert results == ['output/1.jl']
+    assert MemoryBackend.blob_store.get('bucket', 'output/1.jl')[0] == '{"a": 1}\n{"b": 2}\n{"c": 3}\n'